@@ -1,40 +1,127 @@
 import argparse
+import functools
+import multiprocessing
 import os
 import sys
 
 from enum import Enum
 import math as m
 
+import numpy
+
+from cache import TokenCache
+from calibration import log_odds, roc_table, save_roc_table
+from hashing import HashedVocabulary
+from interning import InternedBigrams
+from message import message_tokens, read_message_tokens
+from model import save_model
+from prefetch import prefetch_files
+from profiling import StageTimer, add_arguments, profile
+from scoring import classify_batch
+from sketch import SketchVocabulary
+from tokenizer import read_bigrams, read_ngrams, text_bigrams, text_ngrams
+from vocab_file import load_vocabulary, save_vocabulary, sort_entries, vocab_entries
+from vocabulary import Vocabulary
+
 class MessageType(Enum):
     REGULAR = 1,
     SPAM = 2
 
-class Counter():
-
-    def __init__(self):
-        self.counter_regular = 0
-        self.counter_spam = 0
-        self.pRegular = 0
-        self.pSpam = 0
+def make_vocabulary(hash_size=0, sketch_epsilon=0, sketch_delta=0.01, interned=False, min_ngram_size=6):
+    """
+    Create the store of the term counts of a classifier. At most one of hash_size, sketch_epsilon and interned
+    may be set.
+
+    :param hash_size: Hash the terms into this many buckets instead of storing them (see hashing.py)
+    :param sketch_epsilon: Estimate the counts of infrequent terms with count-min sketches with this relative error
+                           instead of storing them (see sketch.py)
+    :param sketch_delta: Probability that a count-min sketch estimate exceeds the error bound
+    :param interned: Count non-overlapping bigrams as packed integer word ids (see interning.py)
+    :param min_ngram_size: Minimum length of an interned bigram
+    :return: Vocabulary, HashedVocabulary, SketchVocabulary or InternedBigrams
+    """
+    if (hash_size > 0) + (sketch_epsilon > 0) + bool(interned) > 1:
+        raise ValueError("hash_size, sketch_epsilon and interned are mutually exclusive")
+    if hash_size > 0:
+        return HashedVocabulary(hash_size)
+    if sketch_epsilon > 0:
+        return SketchVocabulary(sketch_epsilon, sketch_delta)
+    if interned:
+        return InternedBigrams(min_ngram_size)
+    return Vocabulary()
+
+## The token cache of a worker process, opened once per process by init_worker
+worker_cache = None
+
+def init_worker(cache_dir, cache_size):
+    """
+    Open the token cache in a worker process, so that the cache directory is scanned once per process instead of
+    once per shard.
 
-    def increment_counter(self, message_type):
-        """
-        Increment a word's frequency count by one, depending on whether it occurred in a regular or spam message.
+    :param cache_dir: Directory of the token cache, or None to tokenize every message
+    :param cache_size: Maximum size of the token cache in bytes
+    :return: None
+    """
+    global worker_cache
+    worker_cache = TokenCache(cache_dir, cache_size) if cache_dir is not None else None
 
-        :param message_type: The message type to be parsed (MessageType.REGULAR or MessageType.SPAM)
-        :return: None
-        """
-        if message_type == MessageType.REGULAR:
-            self.counter_regular += 1
-        else:
-            self.counter_spam += 1
+def count_tokens(message_list, orders=(1,), min_word_size=4, min_ngram_size=6, parse_mime=False, pairs=False,
+                 prefetch=0, prefetch_depth=64):
+    """
+    Count the occurrences of each token in a list of messages. This is the work done by a single process
+    when training in parallel.
+
+    :param message_list: List of message file paths
+    :param orders: The n-gram orders of the tokens (see tokenizer.ngrams)
+    :param min_word_size: Minimum length of a unigram
+    :param min_ngram_size: Minimum length of a higher order n-gram
+    :param parse_mime: Set to True to tokenize the header fields and MIME parts separately (see message.py)
+    :param pairs: Set to True to group the words into non-overlapping bigrams instead (see Bayespam)
+    :param prefetch: Number of threads reading the messages ahead of the tokenizer (0 to read them in turn)
+    :param prefetch_depth: Maximum number of messages read ahead
+    :return: Dictionary mapping each token to its frequency count, in order of first occurrence
+    """
+    bayespam = Bayespam(orders, min_word_size, min_ngram_size, parse_mime=parse_mime, pairs=pairs)
+    bayespam.prefetch, bayespam.prefetch_depth = prefetch, prefetch_depth
+    ## The cache of the worker process (see init_worker), if any
+    bayespam.cache = worker_cache
+    counts = {}
+    for msg, tokens in bayespam.read_files(message_list):
+        try:
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+        except Exception as e:
+            raise IOError("Error while reading message %s: %s" % (msg, e))
+    return counts
 
 class Bayespam():
 
-    def __init__(self):
+    def __init__(self, orders=(1,), min_word_size=4, min_ngram_size=6, minimum_frequency=1, parse_mime=False,
+                 pairs=False, vocab=None):
         self.regular_list = None
         self.spam_list = None
-        self.vocab = {}
+        ## The term counts, a Vocabulary unless another store is given (see make_vocabulary)
+        self.vocab = Vocabulary() if vocab is None else vocab
+        self.vocab.minimum_frequency = minimum_frequency
+
+        ## The n-gram orders in the vocabulary, e.g. (1,) for words only or (1, 2) for words and bigrams
+        self.orders = tuple(sorted(orders))
+        self.min_word_size = min_word_size
+        self.min_ngram_size = min_ngram_size
+        ## Tokenize the header fields and MIME parts of messages separately instead of as flat text
+        self.parse_mime = parse_mime
+        ## Group the words into non-overlapping bigrams of at least min_ngram_size characters instead of forming
+        ## n-grams, like the original bigram classifier. Empty tokens are only paired if skip_empty is False (the
+        ## original classifier paired them in the test messages, but not in the training messages)
+        self.pairs = pairs
+        self.skip_empty = True
+
+        ## Optional TokenCache of tokenized messages
+        self.cache = None
+        ## Number of threads reading messages ahead of the tokenizer (0 to read them in turn, see prefetch.py),
+        ## and the maximum number of messages read ahead
+        self.prefetch = 0
+        self.prefetch_depth = 64
 
     def list_dirs(self, path):
         """
@@ -67,30 +154,84 @@ class Bayespam():
             print("Error: directory %s should contain a folder named 'spam'." % path)
             exit()
 
-    ## filters test data by removing punctuation, numbers,
-    ## words with length < 3, and converts to lower case
+    @property
+    def interned(self):
+        """
+        True if the tokens are packed bigrams counted by InternedBigrams instead of strings.
+        """
+        return isinstance(self.vocab, InternedBigrams)
+
     def read_file(self, file):
-        f = open(file, 'r', encoding='latin1')
-        punctuations = '''|=!()-[]{};:'"\,<>./?@##$%^&*_~1234567890\n\t'''
-        token_list = []
-        for line in f:
-            split_line = line.split(" ")
-            for idx in range(len(split_line)):
-                token = ""
-                for char in split_line[idx]:
-                    if char not in punctuations:
-                        token += char
-                token = token.lower()
-                if (len(token) >= 4):
-                    token_list.append(token)
-        return token_list
-
-
-    def read_messages(self, message_type):
+        """
+        Stream the tokens of a single message: punctuation and numbers are removed, words with length < 4 are
+        filtered out and the remaining tokens are converted to lower case. With higher n-gram orders, the
+        overlapping n-grams of the words are generated from the same pass over the file.
+
+        :param file: File path of the message
+        :return: Generator (or list, when cached) of tokens, or NumPy array of packed bigrams when interned
+        """
+        if self.interned:
+            ## The words are cached, and interned and paired on every read
+            words = None
+            if self.cache is not None:
+                words = self.cache.tokens(file, ('words',), self.vocab.read_words)
+            return self.vocab.read_file(file, self.skip_empty, words)
+        if self.cache is not None:
+            if self.pairs:
+                settings = ('bigrams', self.min_ngram_size, self.skip_empty)
+            else:
+                settings = ('message' if self.parse_mime else 'ngrams', self.orders, self.min_word_size,
+                            self.min_ngram_size)
+            return self.cache.tokens(file, settings, self.tokenize_file)
+        return self.tokenize_file(file)
+
+    def tokenize_file(self, file):
+        """
+        Tokenize a single message without the cache (see read_file).
+
+        :param file: File path of the message
+        :return: Generator of tokens
+        """
+        if self.pairs:
+            return read_bigrams(file, self.min_ngram_size, self.skip_empty)
+        if self.parse_mime:
+            return read_message_tokens(file, self.orders, self.min_word_size, self.min_ngram_size)
+        return read_ngrams(file, self.orders, self.min_word_size, self.min_ngram_size)
+
+    def tokenize_text(self, text):
+        """
+        Tokenize a message which is already in memory, like tokenize_file tokenizes the file of the message.
+
+        :param text: The message, with '\\n' line endings
+        :return: Generator of tokens, or NumPy array of packed bigrams when interned
+        """
+        if self.interned:
+            return self.vocab.pack(self.vocab.text_words(text), self.skip_empty)
+        if self.pairs:
+            return text_bigrams(text, self.min_ngram_size, self.skip_empty)
+        if self.parse_mime:
+            return message_tokens(text, self.orders, self.min_word_size, self.min_ngram_size)
+        return text_ngrams(text, self.orders, self.min_word_size, self.min_ngram_size)
+
+    def read_files(self, files):
+        """
+        Stream the tokens of a list of messages. With self.prefetch threads, the next messages are read while the
+        current one is tokenized. Cached messages are not read at all, so the cache is used without prefetching.
+
+        :param files: List of message file paths
+        :return: Generator of (file path, tokens) pairs, in the order of files
+        """
+        if self.prefetch <= 0 or self.cache is not None:
+            return ((file, self.read_file(file)) for file in files)
+        return ((file, self.tokenize_text(text))
+                for file, text in prefetch_files(files, self.prefetch, self.prefetch_depth))
+
+    def read_messages(self, message_type, workers=1):
         """
         Parse all messages in either the 'regular' or 'spam' directory. Each token is stored in the vocabulary,
         together with a frequency count of its occurrences in both message types.
         :param message_type: The message type to be parsed (MessageType.REGULAR or MessageType.SPAM)
+        :param workers: Number of processes used to parse the messages
         :return: None
         """
         if message_type == MessageType.REGULAR:
@@ -101,42 +242,78 @@ class Bayespam():
             message_list = []
             print("Error: input parameter message_type should be MessageType.REGULAR or MessageType.SPAM")
             exit()
-        
-        ## punctuation to remove
-        punctuations = '''|=!()-[]{};:'"\,<>./?@##$%^&*_~1234567890\n\t'''
-        for msg in message_list:
-            try:
-                ## Make sure to use latin1 encoding, otherwise it will be unable to read some of the messages
-                f = open(msg, 'r', encoding='latin1')
-
-                ## Loop through each line in the message
-                for line in f:
-                    ## Split the string on the space character, resulting in a list of tokens
-                    split_line = line.split(" ")
-                    ## Loop through the tokens
-                    for idx in range(len(split_line)):
-                        
-                        ## filter out punctuation
-                        token = ""
-                        for char in split_line[idx]:
-                            if char not in punctuations:
-                                token += char
-                        token = token.lower() ## convert to lower case
-                      
-                        if (len(token) >= 4): ## only add to vocab if length >= 4
-                            if token in self.vocab.keys():
-                                ## If the token is already in the vocab, retrieve its counter
-                                counter = self.vocab[token]
-                            else:
-                                ## Else: initialize a new counter
-                                counter = Counter()
-
-                            ## Increment the token's counter by one and store in the vocab
-                            counter.increment_counter(message_type)
-                            self.vocab[token] = counter
-            except Exception as e:
-                print("Error while reading message %s: " % msg, e)
-                exit()
+
+        if message_type == MessageType.SPAM:
+            self.vocab.n_messages_spam += len(message_list)
+        else:
+            self.vocab.n_messages_regular += len(message_list)
+
+        if workers > 1:
+            self.read_messages_parallel(message_list, message_type, workers)
+            return
+
+        try:
+            for msg, tokens in self.read_files(message_list):
+                try:
+                    ## Count the tokens of the message (punctuation removed, lower case, length >= 4)
+                    self.vocab.add_tokens(tokens, message_type == MessageType.SPAM)
+                except Exception as e:
+                    raise IOError("Error while reading message %s: %s" % (msg, e))
+        except Exception as e:
+            print(e)
+            exit()
+
+    def update(self, messages, message_type):
+        """
+        Add newly labeled messages to the trained vocabulary without retraining.
+
+        :param messages: List of message file paths
+        :param message_type: The message type of the messages (MessageType.REGULAR or MessageType.SPAM)
+        :return: None
+        """
+        self.vocab.update([self.read_file(msg) for msg in messages], message_type == MessageType.SPAM)
+
+    def forget(self, messages, message_type):
+        """
+        Remove previously added messages (e.g. mislabeled ones) from the trained vocabulary without retraining.
+
+        :param messages: List of message file paths
+        :param message_type: The message type the messages were added as (MessageType.REGULAR or MessageType.SPAM)
+        :return: None
+        """
+        self.vocab.forget([self.read_file(msg) for msg in messages], message_type == MessageType.SPAM)
+
+    def read_messages_parallel(self, message_list, message_type, workers):
+        """
+        Parse a list of messages with a pool of processes. The list is split into consecutive shards which are
+        counted separately and merged into the vocabulary in their original order, so the vocabulary is identical
+        to the one built by a single process.
+
+        :param message_list: List of message file paths
+        :param message_type: The message type to be parsed (MessageType.REGULAR or MessageType.SPAM)
+        :param workers: Number of processes
+        :return: None
+        """
+        ## Use a few shards per process to even out differences in message sizes
+        n_shards = max(1, min(len(message_list), workers * 4))
+        shards = [message_list[i * len(message_list) // n_shards:(i + 1) * len(message_list) // n_shards]
+                  for i in range(n_shards)]
+
+        count_shard = functools.partial(count_tokens, orders=self.orders, min_word_size=self.min_word_size,
+                                        min_ngram_size=self.min_ngram_size, parse_mime=self.parse_mime,
+                                        pairs=self.pairs, prefetch=self.prefetch, prefetch_depth=self.prefetch_depth)
+        cache_settings = (None, 0) if self.cache is None else (self.cache.directory, self.cache.max_bytes)
+        try:
+            with multiprocessing.Pool(workers, init_worker, cache_settings) as pool:
+                for counts in pool.imap(count_shard, shards):
+                    for token, count in counts.items():
+                        self.vocab.add(token, message_type == MessageType.SPAM, count)
+        except Exception as e:
+            print(e)
+            exit()
+        ## Every worker capped the cache by its own entries only, so cap the entries of all workers together
+        if self.cache is not None:
+            self.cache.scan()
 
     def print_vocab(self):
         """
@@ -157,24 +334,26 @@ class Bayespam():
         :return: None
         """
 
-        if sort_by_freq:
-            vocab = sorted(self.vocab.items(), key=lambda x: x[1].counter_regular + x[1].counter_spam, reverse=True)
-            vocab = {x[0]: x[1] for x in vocab}
+        if self.interned:
+            entries = self.vocab.items()
         else:
-            vocab = self.vocab
+            entries = vocab_entries(self.vocab)
+            if self.vocab.minimum_frequency > 1:
+                ## Terms which occur less often are not used
+                entries = (entry for entry in entries if entry[1] + entry[2] >= self.vocab.minimum_frequency)
+        if sort_by_freq:
+            ## Sorted in bounded memory, without a sorted copy of the whole vocabulary
+            entries = sort_entries(entries, 'frequency')
 
         try:
-            f = open(destination_fp, 'w', encoding="latin1")
-
-            for word, counter in vocab.items():
+            with open(destination_fp, 'w', encoding="latin1") as f:
                 ## repr(word) makes sure that special  characters such as \t (tab) and \n (newline) are printed.
-                f.write("%s | In regular: %d | In spam: %d\n" % (repr(word), counter.counter_regular, counter.counter_spam),)
-
-            f.close()
+                f.writelines("%s | In regular: %d | In spam: %d\n" % (repr(word), count_regular, count_spam)
+                             for word, count_regular, count_spam in entries)
         except Exception as e:
             print("An error occurred while writing the vocab to a file: ", e)
 
-def main():
+def main(argv=None):
     ## We require the file paths of the training and test sets as input arguments (in that order)
     ## The argparse library helps us cleanly parse input arguments
     parser = argparse.ArgumentParser()
@@ -182,23 +361,149 @@ def main():
                         help='File path of the directory containing the training data')
     parser.add_argument('test_path', type=str,
                         help='File path of the directory containing the test data')
-    args = parser.parse_args()
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes used to parse the training messages')
+    parser.add_argument('--save-model', type=str, default=None,
+                        help='File path to save the trained model to (see classify.py)')
+    parser.add_argument('--ngrams', type=str, default='1',
+                        help='Comma separated n-gram orders to train on, e.g. 1,2 for words and bigrams, or pairs for '
+                             'the non-overlapping bigrams of bigram_bayespam.py')
+    parser.add_argument('--min-word-size', type=int, default=4,
+                        help='Minimum length of a word')
+    parser.add_argument('--min-ngram-size', type=int, default=6,
+                        help='Minimum length of a higher order n-gram (including spaces)')
+    parser.add_argument('--min-frequency', type=int, default=1,
+                        help='Ignore terms which occur less often in the training data')
+    parser.add_argument('--epsilon', type=float, default=sys.float_info.epsilon,
+                        help='Smoothing value of the zero probabilities')
+    parser.add_argument('--top-k', type=int, default=None,
+                        help='Keep only the k most discriminative terms for scoring')
+    parser.add_argument('--selection', choices=['mi', 'chi2', 'log_odds'], default='mi',
+                        help='Score of the terms used by --top-k: mutual information, chi-square or log odds ratio')
+    parser.add_argument('--cache', type=str, default=None,
+                        help='Directory of a cache of tokenized messages, reused by later runs')
+    parser.add_argument('--cache-size', type=int, default=256,
+                        help='Maximum size of the token cache in MB (with --workers, every process caps the entries '
+                             'it has seen, and the cache is cut back to the cap after training)')
+    parser.add_argument('--prefetch', type=int, default=0,
+                        help='Number of threads reading messages ahead of the tokenizer (see prefetch.py)')
+    parser.add_argument('--prefetch-depth', type=int, default=64,
+                        help='Maximum number of messages read ahead by --prefetch')
+    parser.add_argument('--parse-mime', action='store_true',
+                        help='Tokenize the header fields and MIME parts of messages separately (see message.py)')
+    parser.add_argument('--roc', type=str, default=None,
+                        help='File path to save the ROC table and calibration of the test scores to (see classify.py)')
+    parser.add_argument('--export-vocab', type=str, default=None,
+                        help='File path to export the trained vocabulary to, sorted by term (see vocab_file.py)')
+    parser.add_argument('--load-vocab', type=str, default=None,
+                        help='Load the vocabulary and its settings from an exported file instead of training')
+    parser.add_argument('--hash-size', type=int, default=0,
+                        help='Hash the terms into this many buckets instead of storing them (0 to disable)')
+    parser.add_argument('--sketch-epsilon', type=float, default=0,
+                        help='Estimate the frequencies of candidate terms with a count-min sketch with this '
+                             'relative error instead of storing them (0 to disable)')
+    parser.add_argument('--sketch-delta', type=float, default=0.01,
+                        help='Probability that a count-min sketch estimate exceeds the error bound')
+    parser.add_argument('--interned', action='store_true',
+                        help='Count and score the bigrams of --ngrams pairs as packed integer word ids')
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.ngrams == 'pairs':
+        orders = (2,)
+    else:
+        try:
+            orders = tuple(int(n) for n in args.ngrams.split(','))
+        except ValueError:
+            orders = ()
+        if not orders or min(orders) < 1:
+            print("Error: --ngrams should be a comma separated list of positive n-gram orders, e.g. 1,2")
+            exit()
+
+    ## The other term stores only hold counts, so not everything a Vocabulary supports can be done with them
+    if (args.hash_size > 0) + (args.sketch_epsilon > 0) + args.interned > 1:
+        parser.error("--hash-size, --sketch-epsilon and --interned are mutually exclusive")
+    if args.interned and args.ngrams != 'pairs':
+        parser.error("--interned requires --ngrams pairs")
+    if args.interned and args.workers > 1:
+        parser.error("--interned can not be combined with --workers")
+    if (args.hash_size > 0 or args.interned) and (args.top_k is not None or args.save_model is not None or
+                                                  args.export_vocab is not None or args.load_vocab is not None):
+        parser.error("--hash-size and --interned can not be combined with --top-k, --save-model, --export-vocab "
+                     "or --load-vocab")
+    ## Models and vocabulary files record n-gram orders, which do not describe non-overlapping pairs
+    if args.ngrams == 'pairs' and (args.parse_mime or args.save_model is not None or
+                                   args.export_vocab is not None or args.load_vocab is not None):
+        parser.error("--ngrams pairs can not be combined with --parse-mime, --save-model, --export-vocab or "
+                     "--load-vocab")
+
+    timer = StageTimer()
+    with profile(args.profile, args.profile_format):
+        run(args, orders, timer)
+    if args.timings:
+        print(timer.format())
+
+def run(args, orders, timer):
+    """
+    Train on the training set and evaluate on the test set, timing every stage.
 
+    :param args: The parsed command line arguments
+    :param orders: The n-gram orders to train on
+    :param timer: StageTimer
+    :return: None
+    """
     ## Read the file path of the folder containing the training set from the input arguments
     train_path = args.train_path
 
     ## Initialize a Bayespam object
-    bayespam = Bayespam()
+    vocab = make_vocabulary(args.hash_size, args.sketch_epsilon, args.sketch_delta, args.interned,
+                            args.min_ngram_size)
+    bayespam = Bayespam(orders, args.min_word_size, args.min_ngram_size, args.min_frequency, args.parse_mime,
+                        args.ngrams == 'pairs', vocab)
+    bayespam.vocab.epsilon = args.epsilon
+    bayespam.prefetch, bayespam.prefetch_depth = args.prefetch, args.prefetch_depth
+    if args.cache is not None:
+        bayespam.cache = TokenCache(args.cache, args.cache_size << 20)
     ## Initialize a list of the regular and spam message locations in the training folder
-    bayespam.list_dirs(train_path)
-
-    ## Parse the messages in the regular message directory
-    bayespam.read_messages(MessageType.REGULAR)
-    ## Parse the messages in the spam message directory
-    bayespam.read_messages(MessageType.SPAM)
+    if args.load_vocab is not None:
+        with timer.stage('load_vocab') as stage:
+            try:
+                bayespam.vocab, settings = load_vocabulary(args.load_vocab)
+            except Exception as e:
+                print("Error while loading vocabulary %s: " % args.load_vocab, e)
+                exit()
+            bayespam.vocab.minimum_frequency = args.min_frequency
+            bayespam.vocab.epsilon = args.epsilon
+            ## Test messages are tokenized with the settings the vocabulary was trained with
+            bayespam.orders = settings.get('orders', bayespam.orders)
+            bayespam.min_word_size = settings.get('min_word_size', bayespam.min_word_size)
+            bayespam.min_ngram_size = settings.get('min_ngram_size', bayespam.min_ngram_size)
+            bayespam.parse_mime = bool(settings.get('parse_mime', 0))
+    else:
+        with timer.stage('list_dirs') as stage:
+            bayespam.list_dirs(train_path)
+            stage.messages += len(bayespam.regular_list) + len(bayespam.spam_list)
+
+        with timer.stage('train') as stage:
+            ## Parse the messages in the regular message directory
+            bayespam.read_messages(MessageType.REGULAR, args.workers)
+            ## Parse the messages in the spam message directory
+            bayespam.read_messages(MessageType.SPAM, args.workers)
+            stage.messages += len(bayespam.regular_list) + len(bayespam.spam_list)
+            stage.tokens += bayespam.vocab.n_words_regular + bayespam.vocab.n_words_spam
 
     ## bayespam.print_vocab()
-    bayespam.write_vocab("vocab.txt")
+    ## A hashed vocabulary does not store the terms themselves
+    if args.hash_size == 0:
+        with timer.stage('write_vocab'):
+            bayespam.write_vocab("vocab.txt")
+    if args.export_vocab is not None:
+        try:
+            with timer.stage('export_vocab'):
+                save_vocabulary(args.export_vocab, bayespam.vocab, bayespam.orders, bayespam.min_word_size,
+                                bayespam.min_ngram_size, bayespam.parse_mime)
+        except Exception as e:
+            print("An error occurred while exporting the vocabulary: ", e)
 
     """
     Now, implement the follow code yourselves:
@@ -214,85 +519,70 @@ def main():
     """
 
     ## 1) Computing a priori class probablities
-    n_messages_regular = len(bayespam.regular_list)
-    n_messages_spam = len(bayespam.spam_list)
+    n_messages_regular = bayespam.vocab.n_messages_regular
+    n_messages_spam = bayespam.vocab.n_messages_spam
     n_messages_total = n_messages_regular + n_messages_spam
 
     pRegular = m.log(n_messages_regular/n_messages_total, 10)
     pSpam = m.log(n_messages_spam/n_messages_total, 10)
 
     ## Computing class conditional word likelihoods
-    ## Count total number of words contained in regular/spam mail
-    n_words_regular = 0
-    n_words_spam = 0
+    with timer.stage('probabilities'):
+        bayespam.vocab.compute_probabilities()
 
-    for word, counter in bayespam.vocab.items():
-        n_words_regular += counter.counter_regular
-        n_words_spam += counter.counter_spam
+    ## Keep only the most discriminative terms for scoring
+    if args.top_k is not None:
+        with timer.stage('select'):
+            bayespam.vocab = bayespam.vocab.select(args.top_k, args.selection)
 
-    for word, counter in bayespam.vocab.items():
-        if (counter.counter_regular > 0):
-            counter.pRegular = m.log(counter.counter_regular/n_words_regular, 10)
-        else:
-            counter.pRegular = m.log(sys.float_info.epsilon/(n_words_regular + n_words_spam), 10)
+    ## Save the trained model so that messages can be classified without retraining
+    if args.save_model is not None:
+        try:
+            with timer.stage('save_model'):
+                save_model(args.save_model, bayespam.vocab, pRegular, pSpam, bayespam.orders,
+                           bayespam.min_word_size, bayespam.min_ngram_size, bayespam.parse_mime)
+        except Exception as e:
+            print("An error occurred while saving the model: ", e)
 
-        if (counter.counter_spam > 0):
-            counter.pSpam = m.log(counter.counter_spam/n_words_spam, 10)
-        else:
-            counter.pSpam = m.log(sys.float_info.epsilon/(n_words_regular + n_words_spam), 10)
-        
-    ## initialise variables
-    correctRegular = 0
-    falseRegular = 0
-    correctSpam = 0
-    falseSpam = 0
-    
     ## open test data
     test_path = args.test_path
-    bayespam.list_dirs(test_path)
+    with timer.stage('list_dirs_test') as stage:
+        bayespam.list_dirs(test_path)
+        stage.messages += len(bayespam.regular_list) + len(bayespam.spam_list)
 
     ## number of messages
     allMsg = len(bayespam.regular_list) + len(bayespam.spam_list)
 
-    ## loop through regular messages 
-    for msg in bayespam.regular_list:
-
-        ## calculate probabilities
-        p_reg_msg = pRegular + (1/allMsg)
-        p_spam_msg = pSpam + (1/allMsg)
-        
-        for token in bayespam.read_file(msg):
-            if (token in bayespam.vocab):
-                p_reg_msg += bayespam.vocab.get(token).pRegular
-                p_spam_msg += bayespam.vocab.get(token).pSpam
-
-        ## increment corresponding counter depending on found probability
-        if (p_reg_msg > p_spam_msg):
-            correctRegular += 1
-        else:
-            falseSpam += 1
-
-    ## loop through spam messages 
-    for msg in bayespam.spam_list:
+    ## Like the original bigram classifier, the empty tokens of the test messages are paired as well
+    bayespam.skip_empty = False
+
+    ## classify all regular and spam messages in a single batch
+    try:
+        with timer.stage('tokenize_test') as stage:
+            ## Packed bigrams are already arrays, the other tokens are collected into lists
+            messages = [tokens if bayespam.interned else list(tokens)
+                        for _, tokens in bayespam.read_files(bayespam.regular_list + bayespam.spam_list)]
+            stage.messages += len(messages)
+            stage.tokens += sum(map(len, messages))
+        with timer.stage('score') as stage:
+            if bayespam.interned:
+                p_regular, p_spam, is_spam = bayespam.vocab.classify_batch(messages, pRegular, pSpam)
+            else:
+                p_regular, p_spam, is_spam = classify_batch(messages, bayespam.vocab, pRegular, pSpam)
+            stage.messages += len(messages)
+            stage.tokens += sum(map(len, messages))
+    except Exception as e:
+        print("Error while classifying the test messages: ", e)
+        exit()
+
+    ## count the correct and false classifications of both message types
+    n_spam_regular = int(is_spam[:len(bayespam.regular_list)].sum())
+    n_spam_spam = int(is_spam[len(bayespam.regular_list):].sum())
+    correctRegular = len(bayespam.regular_list) - n_spam_regular
+    falseSpam = n_spam_regular
+    correctSpam = n_spam_spam
+    falseRegular = len(bayespam.spam_list) - n_spam_spam
 
-        ## calculate probabilities
-        p_reg_msg = pRegular + (1/allMsg)
-        p_spam_msg = pSpam + (1/allMsg)
-        
-        f = open(msg, 'r', encoding='latin1')
-
-        for token in f: 
-            if (token in bayespam.vocab):
-                p_reg_msg += bayespam.vocab.get(token).pRegular
-                p_spam_msg += bayespam.vocab.get(token).pSpam
-
-        ## increment corresponding counter depending on found probability
-        if (p_reg_msg > p_spam_msg):
-            falseRegular += 1
-        else:
-            correctSpam += 1
-
-    
     ## print confusion matrix
     print("True positive rate: ", correctRegular/allMsg, "\t", "False positive rate: ", falseRegular/allMsg)
     print("False negative rate: ", falseSpam/allMsg, "\t", "True negative rate: ", correctSpam/allMsg)
@@ -301,6 +591,17 @@ def main():
     sensitivity = correctRegular/(correctRegular + falseSpam)
     specificity = correctSpam/(correctSpam + falseRegular)
     print("sensitivity = ", sensitivity, " specificity = ", specificity)
+
+    ## ROC table of the log-odds scores, from which other thresholds than 0 can be picked without rescoring
+    with timer.stage('roc'):
+        labels = numpy.arange(allMsg) >= len(bayespam.regular_list)
+        roc = roc_table(log_odds(p_regular, p_spam), labels, calibrate=args.roc is not None)
+    print("AUC = ", roc.auc())
+    if args.roc is not None:
+        try:
+            save_roc_table(args.roc, roc)
+        except Exception as e:
+            print("An error occurred while saving the ROC table: ", e)
  
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,1457 @@
+"""benchmark.py -- throughput benchmarks for the spam filters.
+
+Usage: python benchmark.py <benchmark> [options], run from the Bayespam directory."""
+
+import argparse
+import base64
+import json
+import math as m
+import multiprocessing
+import os
+import random
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy
+
+import bigram_bayespam
+import classify
+import crossval
+import sweep
+from bayespam import Bayespam, MessageType
+from cache import TokenCache
+from calibration import fit_platt, log_odds, roc_table
+from dedup import DuplicateCache
+from mail_sources import read_message_file
+from message import parse_message
+from model import Model, save_model
+from prefetch import prefetch_files, read_text
+from scoring import classify_batch, evaluate
+from tokenizer import read_tokens
+from vocab_file import load_vocabulary, save_vocabulary, vocab_entries
+from vocabulary import Vocabulary
+
+## punctuation removed by the original character loop
+PUNCTUATIONS = '''|=!()-[]{};:'"\,<>./?@##$%^&*_~1234567890\n\t'''
+
+
+class LegacyCounter():
+    """The original per-word Counter object, kept as the memory benchmark baseline."""
+
+    def __init__(self):
+        self.counter_regular = 0
+        self.counter_spam = 0
+        self.pRegular = 0
+        self.pSpam = 0
+
+
+def legacy_read_file(file):
+    """
+    The original character-by-character tokenizer of Bayespam.read_file, kept as the benchmark baseline.
+
+    :param file: File path of the message
+    :return: List of tokens
+    """
+    token_list = []
+    with open(file, 'r', encoding='latin1') as f:
+        for line in f:
+            split_line = line.split(" ")
+            for idx in range(len(split_line)):
+                token = ""
+                for char in split_line[idx]:
+                    if char not in PUNCTUATIONS:
+                        token += char
+                token = token.lower()
+                if (len(token) >= 4):
+                    token_list.append(token)
+    return token_list
+
+
+def list_messages(path):
+    """
+    List all regular and spam messages in a data directory.
+
+    :param path: File path of the directory containing the training or test data
+    :return: List of message file paths
+    """
+    bayespam = Bayespam()
+    bayespam.list_dirs(path)
+    return bayespam.regular_list + bayespam.spam_list
+
+
+def legacy_write_vocab(vocab, destination_fp):
+    """
+    The original Bayespam.write_vocab(sort_by_freq=True), which sorts a copy of the whole vocabulary into a
+    second dictionary, kept as the benchmark baseline.
+
+    :param vocab: Vocabulary
+    :param destination_fp: Destination file path of the vocabulary file
+    :return: None
+    """
+    vocab = sorted(vocab.items(), key=lambda x: x[1].counter_regular + x[1].counter_spam, reverse=True)
+    vocab = {x[0]: x[1] for x in vocab}
+    f = open(destination_fp, 'w', encoding="latin1")
+    for word, counter in vocab.items():
+        f.write("%s | In regular: %d | In spam: %d\n" % (repr(word), counter.counter_regular, counter.counter_spam),)
+    f.close()
+
+
+def time_best(function, repeat):
+    """
+    Run a function repeat times and return the fastest wall-clock time.
+
+    :param function: Function without arguments
+    :param repeat: Number of runs
+    :return: Fastest run time in seconds
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def print_throughput(name, seconds, n_messages, n_bytes):
+    print("%-10s %8.3f s  %10.1f messages/sec  %8.2f MB/sec" %
+          (name, seconds, n_messages / seconds, n_bytes / seconds / 1e6))
+
+
+def bench_tokenizer(args):
+    """
+    Compare the original tokenizer loop with the translation table tokenizer on a data directory.
+    """
+    messages = list_messages(args.path)
+    n_bytes = sum(os.path.getsize(msg) for msg in messages)
+
+    ## Both tokenizers must produce exactly the same tokens
+    for msg in messages:
+        if legacy_read_file(msg) != list(read_tokens(msg)):
+            print("Error: tokenizers disagree on message %s" % msg)
+            sys.exit(1)
+
+    print("%d messages, %.2f MB, best of %d runs" % (len(messages), n_bytes / 1e6, args.repeat))
+    legacy = time_best(lambda: [legacy_read_file(msg) for msg in messages], args.repeat)
+    print_throughput("legacy", legacy, len(messages), n_bytes)
+    table = time_best(lambda: [list(read_tokens(msg)) for msg in messages], args.repeat)
+    print_throughput("tokenizer", table, len(messages), n_bytes)
+    print("speedup: %.1fx" % (legacy / table))
+
+
+def vocab_counts(bayespam):
+    """
+    List the (word, regular count, spam count) entries of a vocabulary in insertion order.
+    """
+    return [(word, counter.counter_regular, counter.counter_spam) for word, counter in bayespam.vocab.items()]
+
+
+def bench_workers(args):
+    """
+    Time building the vocabulary with 1 up to max_workers processes. The message lists are repeated scale
+    times to simulate a larger corpus.
+    """
+    reference = None
+    print("workers   seconds   messages/sec   speedup")
+    for workers in range(1, args.max_workers + 1):
+        bayespam = Bayespam()
+        bayespam.list_dirs(args.path)
+        bayespam.regular_list *= args.scale
+        bayespam.spam_list *= args.scale
+        n_messages = len(bayespam.regular_list) + len(bayespam.spam_list)
+
+        start = time.perf_counter()
+        bayespam.read_messages(MessageType.REGULAR, workers)
+        bayespam.read_messages(MessageType.SPAM, workers)
+        seconds = time.perf_counter() - start
+
+        ## Every number of workers must build exactly the same vocabulary
+        if reference is None:
+            reference = (seconds, vocab_counts(bayespam))
+        elif vocab_counts(bayespam) != reference[1]:
+            print("Error: vocabulary built with %d workers differs from the serial vocabulary" % workers)
+            sys.exit(1)
+        print("%7d %9.3f %14.1f %9.2fx" % (workers, seconds, n_messages / seconds, reference[0] / seconds))
+
+
+def build_legacy_vocab(entries):
+    """
+    Build a dictionary of LegacyCounter objects with probabilities, as the original main() did.
+
+    :param entries: List of (term, regular count, spam count) tuples
+    :return: Dictionary mapping each term to its LegacyCounter
+    """
+    vocab = {}
+    for term, count_regular, count_spam in entries:
+        counter = LegacyCounter()
+        counter.counter_regular = count_regular
+        counter.counter_spam = count_spam
+        counter.pRegular = -float(count_regular + 1)
+        counter.pSpam = -float(count_spam + 1)
+        vocab[term] = counter
+    return vocab
+
+
+def build_vocab(entries):
+    """
+    Build a Vocabulary with probabilities.
+
+    :param entries: List of (term, regular count, spam count) tuples
+    :return: Vocabulary
+    """
+    vocab = Vocabulary()
+    for term, count_regular, count_spam in entries:
+        vocab.add(term, False, count_regular)
+        vocab.add(term, True, count_spam)
+    vocab.compute_probabilities()
+    return vocab
+
+
+def traced_size(build, entries):
+    """
+    Measure the memory allocated by a vocabulary. The term strings themselves are shared with the entries and
+    therefore not included.
+
+    :param build: Function building a vocabulary from a list of entries
+    :param entries: List of (term, regular count, spam count) tuples
+    :return: Number of bytes held by the vocabulary
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    vocab = build(entries)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del vocab
+    return size
+
+
+def bench_memory(args):
+    """
+    Compare the memory per term of a dictionary of Counter objects with a Vocabulary, on the vocabulary of a
+    training directory and on a synthetic vocabulary of n_terms terms.
+    """
+    bayespam = Bayespam()
+    bayespam.list_dirs(args.path)
+    bayespam.read_messages(MessageType.REGULAR)
+    bayespam.read_messages(MessageType.SPAM)
+    corpus = vocab_counts(bayespam)
+
+    random.seed(0)
+    synthetic = [("term%08d" % i, random.randint(0, 100), random.randint(0, 100)) for i in range(args.n_terms)]
+
+    print("vocabulary          terms   Counter dict    Vocabulary   (bytes per term)")
+    for name, entries in (("corpus", corpus), ("synthetic", synthetic)):
+        legacy = traced_size(build_legacy_vocab, entries) / len(entries)
+        compact = traced_size(build_vocab, entries) / len(entries)
+        print("%-12s %12d %14.1f %13.1f   %.1fx smaller" % (name, len(entries), legacy, compact, legacy / compact))
+
+
+def bench_model(args):
+    """
+    Compare the start-up time of training from the corpus with opening a saved model file.
+    """
+    def train():
+        bayespam = Bayespam()
+        bayespam.list_dirs(args.path)
+        bayespam.read_messages(MessageType.REGULAR)
+        bayespam.read_messages(MessageType.SPAM)
+        bayespam.vocab.compute_probabilities()
+        return bayespam
+
+    bayespam = train()
+    n_messages = len(bayespam.regular_list) + len(bayespam.spam_list)
+    with tempfile.TemporaryDirectory() as directory:
+        model_fp = os.path.join(directory, 'model.bin')
+        save_model(model_fp, bayespam.vocab, m.log(len(bayespam.regular_list) / n_messages, 10),
+                   m.log(len(bayespam.spam_list) / n_messages, 10))
+
+        def open_model():
+            Model(model_fp).close()
+
+        print("%d terms, model file of %.1f kB, best of %d runs" %
+              (len(bayespam.vocab), os.path.getsize(model_fp) / 1e3, args.repeat))
+        print("train from corpus %10.3f ms" % (time_best(train, args.repeat) * 1e3))
+        print("open model file   %10.3f ms" % (time_best(open_model, args.repeat) * 1e3))
+
+
+def classify_loop(messages, vocab, prior_regular, prior_spam):
+    """
+    The original per-message scoring loop of main(), kept as the scoring benchmark baseline.
+
+    :param messages: List of messages, each a list of tokens
+    :return: List with for every message whether it is spam
+    """
+    is_spam = []
+    for tokens in messages:
+        p_reg_msg = prior_regular
+        p_spam_msg = prior_spam
+        for token in tokens:
+            if (token in vocab):
+                p_reg_msg += vocab.get(token).pRegular
+                p_spam_msg += vocab.get(token).pSpam
+        is_spam.append(not p_reg_msg > p_spam_msg)
+    return is_spam
+
+
+def bench_scoring(args):
+    """
+    Compare the per-message scoring loop with batch scoring, on the test messages repeated scale times.
+    Tokenization is done beforehand and not included in the times.
+    """
+    bayespam = Bayespam()
+    bayespam.list_dirs(args.train_path)
+    bayespam.read_messages(MessageType.REGULAR)
+    bayespam.read_messages(MessageType.SPAM)
+    bayespam.vocab.compute_probabilities()
+    prior_regular = m.log(0.5, 10)
+    prior_spam = m.log(0.5, 10)
+
+    messages = [list(read_tokens(msg)) for msg in list_messages(args.test_path)] * args.scale
+    if list(classify_batch(messages, bayespam.vocab, prior_regular, prior_spam)[2]) != \
+            classify_loop(messages, bayespam.vocab, prior_regular, prior_spam):
+        print("Error: batch scoring and the scoring loop disagree")
+        sys.exit(1)
+
+    print("%d messages, best of %d runs" % (len(messages), args.repeat))
+    loop = time_best(lambda: classify_loop(messages, bayespam.vocab, prior_regular, prior_spam), args.repeat)
+    print("loop  %8.3f s  %12.1f messages/sec" % (loop, len(messages) / loop))
+    batch = time_best(lambda: classify_batch(messages, bayespam.vocab, prior_regular, prior_spam), args.repeat)
+    print("batch %8.3f s  %12.1f messages/sec" % (batch, len(messages) / batch))
+    print("speedup: %.1fx" % (loop / batch))
+
+
+def train_vocab(regular_list, spam_list):
+    """
+    Train a vocabulary from scratch on lists of regular and spam messages.
+    """
+    bayespam = Bayespam()
+    bayespam.regular_list = regular_list
+    bayespam.spam_list = spam_list
+    bayespam.read_messages(MessageType.REGULAR)
+    bayespam.read_messages(MessageType.SPAM)
+    bayespam.vocab.compute_probabilities()
+    return bayespam
+
+
+def bench_online(args):
+    """
+    Train on half of the training messages, fold in the other half with update() in small batches, add and
+    forget a batch of mislabeled messages, and check that the result is equivalent to a full retrain.
+    """
+    full = Bayespam()
+    full.list_dirs(args.train_path)
+    regular_half = len(full.regular_list) // 2
+    spam_half = len(full.spam_list) // 2
+
+    online = train_vocab(full.regular_list[:regular_half], full.spam_list[:spam_half])
+    update_times = []
+    for message_list, message_type in ((full.regular_list[regular_half:], MessageType.REGULAR),
+                                       (full.spam_list[spam_half:], MessageType.SPAM)):
+        for i in range(0, len(message_list), args.batch_size):
+            start = time.perf_counter()
+            online.update(message_list[i:i + args.batch_size], message_type)
+            online.vocab.compute_probabilities()
+            update_times.append(time.perf_counter() - start)
+
+    ## Regular messages which were mislabeled as spam, and the correction
+    mislabeled = full.regular_list[:args.batch_size]
+    online.update(mislabeled, MessageType.SPAM)
+    start = time.perf_counter()
+    online.forget(mislabeled, MessageType.SPAM)
+    online.vocab.compute_probabilities()
+    forget_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    retrained = train_vocab(full.regular_list, full.spam_list)
+    retrain_time = time.perf_counter() - start
+
+    ## The counts, log-probabilities and priors must be identical to the full retrain
+    for word, entry in online.vocab.items():
+        other = retrained.vocab.get(word)
+        if other is None:
+            equal = entry.counter_regular == entry.counter_spam == 0
+        else:
+            equal = (entry.counter_regular, entry.counter_spam, entry.pRegular, entry.pSpam) == \
+                    (other.counter_regular, other.counter_spam, other.pRegular, other.pSpam)
+        if not equal:
+            print("Error: online training and full retrain disagree on %s" % repr(word))
+            sys.exit(1)
+    if online.vocab.priors() != retrained.vocab.priors() or \
+            any(word not in online.vocab for word in retrained.vocab):
+        print("Error: online training and full retrain disagree")
+        sys.exit(1)
+
+    messages = [list(read_tokens(msg)) for msg in list_messages(args.test_path)]
+    if list(classify_batch(messages, online.vocab, *online.vocab.priors())[2]) != \
+            list(classify_batch(messages, retrained.vocab, *retrained.vocab.priors())[2]):
+        print("Error: online training and full retrain classify the test messages differently")
+        sys.exit(1)
+
+    print("online training is equivalent to a full retrain")
+    print("update of %d messages %10.3f ms (mean)" % (args.batch_size, sum(update_times) / len(update_times) * 1e3))
+    print("forget of %d messages %10.3f ms" % (args.batch_size, forget_time * 1e3))
+    print("full retrain           %10.3f ms" % (retrain_time * 1e3))
+
+
+def bench_hashing(args):
+    """
+    Accuracy and memory of the bigram classifier with a hashed vocabulary of increasing sizes, compared with
+    the exact vocabulary.
+    """
+    test = Bayespam()
+    test.list_dirs(args.test_path)
+
+    print("buckets      model memory   sensitivity   specificity   accuracy")
+    for hash_size in [0] + [1 << bits for bits in range(args.min_bits, args.max_bits + 1, 2)]:
+        tracemalloc.start()
+        bayespam = bigram_bayespam.bigram_bayespam(hash_size)
+        bayespam.list_dirs(args.train_path)
+        bayespam.read_messages(MessageType.REGULAR)
+        bayespam.read_messages(MessageType.SPAM)
+        bayespam.vocab.compute_probabilities()
+        ## The exact classifier keeps every bigram, the hashed one only its arrays
+        memory = tracemalloc.get_traced_memory()[0] if hash_size == 0 else bayespam.vocab.nbytes
+        tracemalloc.stop()
+
+        n_messages = len(bayespam.regular_list) + len(bayespam.spam_list)
+        prior_regular = m.log(len(bayespam.regular_list) / n_messages, 10)
+        prior_spam = m.log(len(bayespam.spam_list) / n_messages, 10)
+        bayespam.skip_empty = False
+        messages = [list(bayespam.read_file(msg)) for msg in test.regular_list + test.spam_list]
+        is_spam = classify_loop(messages, bayespam.vocab, prior_regular, prior_spam)
+        print("%-10s %11.1f kB %13.3f %13.3f %10.3f" % ((hash_size or "exact", memory / 1e3) +
+                                                      evaluate(is_spam, len(test.regular_list))))
+
+
+def train_bigram_vocab(train_path, sketch_epsilon, sketch_delta):
+    """
+    Build the bigram vocabulary, exactly or with count-min sketches. Run in a fresh process to measure its peak
+    memory.
+
+    :return: Tuple of the vocab counts, the peak traced memory and the peak RSS (both in bytes)
+    """
+    tracemalloc.start()
+    bayespam = bigram_bayespam.bigram_bayespam(0, sketch_epsilon, sketch_delta)
+    bayespam.list_dirs(train_path)
+    bayespam.read_messages(MessageType.REGULAR)
+    bayespam.read_messages(MessageType.SPAM)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    ## ru_maxrss is in kilobytes on Linux
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    ## The exact vocabulary also holds the infrequent bigrams, which are not used
+    minimum_frequency = bayespam.vocab.minimum_frequency
+    return ([entry for entry in vocab_entries(bayespam.vocab) if entry[1] + entry[2] >= minimum_frequency], peak,
+            max_rss)
+
+
+def bench_sketch(args):
+    """
+    Peak memory and vocabulary agreement of count-min sketch promotion versus counting every bigram exactly.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for epsilon in [0] + args.epsilons:
+        with context.Pool(1) as pool:
+            results.append(pool.apply(train_bigram_vocab, (args.train_path, epsilon, args.delta)))
+
+    exact = {word: (regular, spam) for word, regular, spam in results[0][0]}
+    print("epsilon     peak traced   peak RSS   vocab size   agreement   exact counts   mean overcount")
+    for epsilon, (counts, peak, max_rss) in zip([0] + args.epsilons, results):
+        vocab = {word: (regular, spam) for word, regular, spam in counts}
+        common = exact.keys() & vocab.keys()
+        ## Jaccard index of the vocabularies, and how well the counts of the common bigrams agree
+        agreement = len(common) / len(exact.keys() | vocab.keys())
+        exact_counts = sum(vocab[word] == exact[word] for word in common) / max(len(common), 1)
+        overcount = sum(sum(vocab[word]) - sum(exact[word]) for word in common) / max(len(common), 1)
+        print("%-10s %9.1f kB %7.1f MB %12d %11.3f %14.3f %16.2f" %
+              (epsilon or "exact", peak / 1e3, max_rss / 1e6, len(vocab), agreement, exact_counts, overcount))
+
+
+def run_ngrams(train_path, test_path, orders):
+    """
+    Train the n-gram classifier on a training set and classify a test set, like bayespam.py --ngrams.
+
+    :return: Tuple of the number of terms and the sensitivity, specificity and accuracy
+    """
+    bayespam = Bayespam(orders)
+    bayespam.list_dirs(train_path)
+    bayespam.read_messages(MessageType.REGULAR)
+    bayespam.read_messages(MessageType.SPAM)
+    prior_regular, prior_spam = bayespam.vocab.priors()
+    bayespam.list_dirs(test_path)
+    messages = [bayespam.read_file(msg) for msg in bayespam.regular_list + bayespam.spam_list]
+    _, _, is_spam = classify_batch(messages, bayespam.vocab, prior_regular, prior_spam)
+    return (len(bayespam.vocab),) + evaluate(is_spam, len(bayespam.regular_list))
+
+
+def run_bigram_script(train_path, test_path):
+    """
+    Train the separate (non-overlapping) bigram classifier and classify a test set, like bigram_bayespam.py.
+
+    :return: Tuple of the number of terms and the sensitivity, specificity and accuracy
+    """
+    bayespam = bigram_bayespam.bigram_bayespam()
+    bayespam.list_dirs(train_path)
+    bayespam.read_messages(MessageType.REGULAR)
+    bayespam.read_messages(MessageType.SPAM)
+    prior_regular, prior_spam = bayespam.vocab.priors()
+    bayespam.list_dirs(test_path)
+    bayespam.skip_empty = False
+    messages = [bayespam.read_file(msg) for msg in bayespam.regular_list + bayespam.spam_list]
+    _, _, is_spam = classify_batch(messages, bayespam.vocab, prior_regular, prior_spam)
+    n_terms = int((bayespam.vocab.p_regular != 0).sum())
+    return (n_terms,) + evaluate(is_spam, len(bayespam.regular_list))
+
+
+def bench_ngrams(args):
+    """
+    Training and test time of a single combined unigram+bigram pass versus running the unigram and bigram
+    classifiers separately, together with the accuracy of every configuration.
+    """
+    configurations = [
+        ("unigrams", lambda: run_ngrams(args.train_path, args.test_path, (1,))),
+        ("bigram script", lambda: run_bigram_script(args.train_path, args.test_path)),
+        ("bigrams (overlapping)", lambda: run_ngrams(args.train_path, args.test_path, (2,))),
+        ("unigrams+bigrams", lambda: run_ngrams(args.train_path, args.test_path, (1, 2))),
+        ("unigrams+bigrams+trigrams", lambda: run_ngrams(args.train_path, args.test_path, (1, 2, 3))),
+    ]
+    print("configuration                   time     terms   sensitivity   specificity   accuracy")
+    times = {}
+    for name, run in configurations:
+        results = run()
+        times[name] = time_best(run, args.repeat)
+        print("%-25s %9.3f s %9d %13.3f %13.3f %10.3f" % ((name, times[name]) + results))
+    print("unigram and bigram scripts              %6.3f s" % (times["unigrams"] + times["bigram script"]))
+    print("unigram and overlapping bigram runs     %6.3f s" % (times["unigrams"] + times["bigrams (overlapping)"]))
+    print("combined unigram+bigram single pass     %6.3f s" % times["unigrams+bigrams"])
+
+
+def bench_cache(args):
+    """
+    Tokenizing the training and test sets without the token cache, with an empty cache and with a warm cache.
+    """
+    messages = list_messages(args.train_path) + list_messages(args.test_path)
+    n_bytes = sum(os.path.getsize(msg) for msg in messages)
+    print("%d messages, %.1f MB, best of %d runs" % (len(messages), n_bytes / 1e6, args.repeat))
+
+    for orders in [(1,), (1, 2)]:
+        print("n-gram orders %s" % ",".join(map(str, orders)))
+        bayespam = Bayespam(orders)
+        uncached = [list(bayespam.read_file(msg)) for msg in messages]
+        print_throughput("no cache", time_best(lambda: [list(bayespam.read_file(msg)) for msg in messages],
+                                               args.repeat), len(messages), n_bytes)
+
+        def cold():
+            with tempfile.TemporaryDirectory() as cold_directory:
+                bayespam.cache = TokenCache(cold_directory)
+                return [bayespam.read_file(msg) for msg in messages]
+
+        with tempfile.TemporaryDirectory() as directory:
+            def warm():
+                bayespam.cache = TokenCache(directory)
+                return [bayespam.read_file(msg) for msg in messages]
+
+            print_throughput("cold", time_best(cold, args.repeat), len(messages), n_bytes)
+            warm()
+            print_throughput("warm", time_best(warm, args.repeat), len(messages), n_bytes)
+            assert warm() == uncached
+            print("cache of %.1f kB, %d hits, %d misses" %
+                  (bayespam.cache.n_bytes / 1e3, bayespam.cache.hits, bayespam.cache.misses))
+
+        ## A cache capped at half of its size evicts, but keeps serving correct tokens (a sequential scan of a
+        ## corpus larger than the cache misses every time under LRU)
+        with tempfile.TemporaryDirectory() as directory:
+            bayespam.cache = TokenCache(directory)
+            [bayespam.read_file(msg) for msg in messages]
+            bayespam.cache = TokenCache(directory, bayespam.cache.n_bytes // 2)
+            assert [bayespam.read_file(msg) for msg in messages] == uncached
+            print("cache capped at half: %d evictions, %d hits, %d misses" %
+                  (bayespam.cache.evictions, bayespam.cache.hits, bayespam.cache.misses))
+    print("cached tokens are identical to the tokenizer output")
+
+
+def retrain_setting(train_path, test_path, setting):
+    """
+    Train and evaluate the unigram classifier from scratch with a single setting of the sweep grid.
+
+    :param setting: Tuple of the minimum word size, minimum frequency and epsilon
+    :return: Tuple of the number of terms used, sensitivity, specificity and accuracy
+    """
+    min_word_size, min_frequency, epsilon = setting
+    bayespam = Bayespam((1,), min_word_size, minimum_frequency=min_frequency)
+    bayespam.vocab.epsilon = epsilon
+    bayespam.list_dirs(train_path)
+    bayespam.read_messages(MessageType.REGULAR)
+    bayespam.read_messages(MessageType.SPAM)
+    prior_regular, prior_spam = bayespam.vocab.priors()
+    bayespam.list_dirs(test_path)
+    messages = [bayespam.read_file(msg) for msg in bayespam.regular_list + bayespam.spam_list]
+    _, _, is_spam = classify_batch(messages, bayespam.vocab, prior_regular, prior_spam)
+    n_used = int((bayespam.vocab.p_regular != 0).sum())
+    return (n_used,) + evaluate(is_spam, len(bayespam.regular_list))
+
+
+def bench_sweep(args):
+    """
+    A sweep over a grid of settings from counts made once, versus retraining for every setting.
+    """
+    grid = [(min_word_size, min_frequency, epsilon) for min_word_size in range(2, 7)
+            for min_frequency in (1, 2, 5) for epsilon in (1e-16, 1e-8)]
+
+    start = time.perf_counter()
+    data = sweep.count_unigrams(args.train_path, args.test_path, (1,), 2)
+    results = sweep.sweep(data, grid, args.workers)
+    sweep_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    retrained = [retrain_setting(args.train_path, args.test_path, setting) for setting in grid]
+    retrain_time = time.perf_counter() - start
+
+    for setting, result, expected in zip(grid, results, retrained):
+        assert result[1:] == expected[1:], (setting, result, expected)
+    print("%d settings, the sweep gives the same results as retraining" % len(grid))
+    print("sweep (%d workers) %10.3f s" % (args.workers, sweep_time))
+    print("retrain every time %10.3f s" % retrain_time)
+
+
+def bench_crossval(args):
+    """
+    k-fold cross-validation by count subtraction versus retraining a vocabulary for every fold.
+    """
+    bayespam = Bayespam()
+    messages = []
+    labels = []
+    for path in args.paths:
+        bayespam.list_dirs(path)
+        for msg in bayespam.regular_list + bayespam.spam_list:
+            messages.append(list(bayespam.read_file(msg)))
+            labels.append(msg in bayespam.spam_list)
+
+    start = time.perf_counter()
+    results = crossval.cross_validate(crossval.build_folds(messages, labels, args.folds), args.workers)
+    subtraction_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    retrained = []
+    for fold in crossval.split_folds(labels, args.folds):
+        held_out = set(fold)
+        vocab = Vocabulary()
+        for i, tokens in enumerate(messages):
+            if i not in held_out:
+                vocab.add_tokens(tokens, labels[i])
+                if labels[i]:
+                    vocab.n_messages_spam += 1
+                else:
+                    vocab.n_messages_regular += 1
+        prior_regular, prior_spam = vocab.priors()
+        _, _, is_spam = classify_batch([messages[i] for i in fold], vocab, prior_regular, prior_spam)
+        fold_labels = [labels[i] for i in fold]
+        retrained.append((sum(spam and not label for spam, label in zip(is_spam, fold_labels)),
+                          sum(label and not spam for spam, label in zip(is_spam, fold_labels))))
+    retrain_time = time.perf_counter() - start
+
+    assert [result[2:4] for result in results] == retrained, (results, retrained)
+    print("%d messages, %d folds: count subtraction gives the same errors as retraining" %
+          (len(messages), args.folds))
+    print("count subtraction (%d workers) %10.3f ms" % (args.workers, subtraction_time * 1e3))
+    print("retrain every fold            %10.3f ms" % (retrain_time * 1e3))
+
+
+def synthesize_corpus(source_path, destination_path, scale, seed=0):
+    """
+    Write a synthetic data directory with scale variants of every message of a data directory. Every variant
+    appends a random suffix to a tenth of the words, so the vocabulary grows with the corpus like it would
+    with real mail instead of only the counts.
+
+    :param source_path: File path of the data directory with 'regular' and 'spam' folders
+    :param destination_path: File path of the synthetic data directory
+    :param scale: Number of variants of every message
+    :param seed: Seed of the random suffixes
+    :return: None
+    """
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    for folder in ('regular', 'spam'):
+        os.makedirs(os.path.join(destination_path, folder))
+        for name in sorted(os.listdir(os.path.join(source_path, folder))):
+            with open(os.path.join(source_path, folder, name), 'r', encoding='latin1') as f:
+                lines = f.read().split('\n')
+            for variant in range(scale):
+                text = '\n'.join(" ".join(word + rng.choice(letters) + rng.choice(letters)
+                                           if rng.random() < 0.1 else word for word in line.split(" "))
+                                  for line in lines)
+                with open(os.path.join(destination_path, folder, '%d-%s' % (variant, name)), 'w',
+                          encoding='latin1') as f:
+                    f.write(text)
+
+
+def time_stages(train_path, test_path, trace=False):
+    """
+    Run the stages of bayespam.main() once and time every stage.
+
+    :param trace: Set to True to also measure the peak traced memory of every stage (slows down the stages)
+    :return: Dictionary mapping every stage to a dictionary with its time and, if traced, its peak memory
+    """
+    stages = {}
+    bayespam = Bayespam()
+
+    def stage(name, function):
+        if trace:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        result = function()
+        stages[name] = {'seconds': time.perf_counter() - start}
+        if trace:
+            stages[name]['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        return result
+
+    stage('list_dirs', lambda: bayespam.list_dirs(train_path))
+    stage('tokenize_train', lambda: (bayespam.read_messages(MessageType.REGULAR),
+                                     bayespam.read_messages(MessageType.SPAM)))
+    stage('probabilities', bayespam.vocab.compute_probabilities)
+    prior_regular, prior_spam = bayespam.vocab.priors()
+    stage('list_dirs_test', lambda: bayespam.list_dirs(test_path))
+    test_list = bayespam.regular_list + bayespam.spam_list
+    messages = stage('tokenize_test', lambda: [list(bayespam.read_file(msg)) for msg in test_list])
+    _, _, is_spam = stage('score', lambda: classify_batch(messages, bayespam.vocab, prior_regular, prior_spam))
+    stages['n_terms'] = len(bayespam.vocab)
+    stages['accuracy'] = evaluate(is_spam, len(bayespam.regular_list))[2]
+    return stages
+
+
+def run_stages(train_path, test_path, repeat):
+    """
+    Time the stages repeat times (the fastest time of every stage is kept), then measure their peak memory in
+    a traced run. Run in a fresh process to measure its peak RSS.
+
+    :return: Dictionary of the results
+    """
+    runs = [time_stages(train_path, test_path) for _ in range(repeat)]
+    tracemalloc.start()
+    traced = time_stages(train_path, test_path, trace=True)
+    tracemalloc.stop()
+
+    stages = {name: {'seconds': min(run[name]['seconds'] for run in runs),
+                     'peak_bytes': traced[name]['peak_bytes']} for name in STAGES}
+    ## ru_maxrss is in kilobytes on Linux
+    return {'stages': stages, 'n_terms': runs[0]['n_terms'], 'accuracy': runs[0]['accuracy'],
+            'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+
+
+## The stages of bayespam.main() timed by the stages benchmark, in order
+STAGES = ['list_dirs', 'tokenize_train', 'probabilities', 'list_dirs_test', 'tokenize_test', 'score']
+
+
+def bench_stages(args):
+    """
+    Time and peak memory of every stage of bayespam.main() on the shipped corpus and on synthetic corpora
+    scaled up from it. The results can be written to a JSON file and compared with an earlier one.
+    """
+    results = {'python': platform.python_version(), 'platform': platform.platform(),
+               'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'scales': []}
+    context = multiprocessing.get_context('spawn')
+    for scale in args.scales:
+        with tempfile.TemporaryDirectory() as directory:
+            if scale == 1:
+                train_path, test_path = args.train_path, args.test_path
+            else:
+                train_path, test_path = os.path.join(directory, 'train'), os.path.join(directory, 'test')
+                synthesize_corpus(args.train_path, train_path, scale)
+                synthesize_corpus(args.test_path, test_path, scale, seed=1)
+            train_list, test_list = list_messages(train_path), list_messages(test_path)
+            n_bytes = sum(os.path.getsize(msg) for msg in train_list + test_list)
+            with context.Pool(1) as pool:
+                result = pool.apply(run_stages, (train_path, test_path, args.repeat))
+        result.update(scale=scale, n_train=len(train_list), n_test=len(test_list), n_bytes=n_bytes)
+        results['scales'].append(result)
+
+    previous = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            previous = {result['scale']: result for result in json.load(f)['scales']}
+
+    for result in results['scales']:
+        print("scale %dx: %d + %d messages, %.1f MB, %d terms, accuracy %.3f, peak RSS %.1f MB" %
+              (result['scale'], result['n_train'], result['n_test'], result['n_bytes'] / 1e6, result['n_terms'],
+               result['accuracy'], result['max_rss_bytes'] / 1e6))
+        print("stage                seconds   messages/sec   peak traced" +
+              ("   time vs previous" if previous else ""))
+        for name in STAGES:
+            stage = result['stages'][name]
+            n_messages = result['n_test'] if name in ('list_dirs_test', 'tokenize_test', 'score') else result['n_train']
+            line = "%-15s %12.4f %14.1f %10.1f MB" % (name, stage['seconds'], n_messages / max(stage['seconds'], 1e-9),
+                                                     stage['peak_bytes'] / 1e6)
+            if previous and result['scale'] in previous:
+                line += " %18.2fx" % (stage['seconds'] / max(previous[result['scale']]['stages'][name]['seconds'],
+                                                             1e-9))
+            print(line)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+def bench_selection(args):
+    """
+    Accuracy, model size and per-message latency of the top-k most discriminative terms of every selection
+    method, for increasing k.
+    """
+    bayespam = Bayespam()
+    bayespam.list_dirs(args.train_path)
+    bayespam.read_messages(MessageType.REGULAR)
+    bayespam.read_messages(MessageType.SPAM)
+    vocab = bayespam.vocab
+    prior_regular, prior_spam = vocab.priors()
+    vocab.compute_probabilities()
+    bayespam.list_dirs(args.test_path)
+    messages = [list(bayespam.read_file(msg)) for msg in bayespam.regular_list + bayespam.spam_list]
+
+    print("method         k     terms   model size   accuracy   latency/message")
+    with tempfile.TemporaryDirectory() as directory:
+        model_fp = os.path.join(directory, 'model.bin')
+        for method in args.methods:
+            for k in args.k + [len(vocab)]:
+                selected = vocab.select(k, method)
+                _, _, is_spam = classify_batch(messages, selected, prior_regular, prior_spam)
+                save_model(model_fp, selected, prior_regular, prior_spam)
+                model = Model(model_fp)
+                ## Latency of scoring one message at a time with a model file, like classify.py
+                latency = time_best(lambda: [model.score(tokens) for tokens in messages], args.repeat) / len(messages)
+                print("%-8s %7d %9d %9.1f kB %10.3f %14.1f us" %
+                      (method, k, len(selected), os.path.getsize(model_fp) / 1e3,
+                       evaluate(is_spam, len(bayespam.regular_list))[2], latency * 1e6))
+                model.close()
+
+
+def bench_early_exit(args):
+    """
+    Early-exit classification with a model file versus scoring every token, on the test set, on large messages
+    made by concatenating test messages of the same type (one row per --concatenate count), and on messages
+    mixing regular and spam tokens (whose margins stay small). The decisions must be identical.
+    """
+    bayespam = Bayespam()
+    bayespam.list_dirs(args.train_path)
+    bayespam.read_messages(MessageType.REGULAR)
+    bayespam.read_messages(MessageType.SPAM)
+    prior_regular, prior_spam = bayespam.vocab.priors()
+    bayespam.vocab.compute_probabilities()
+    bayespam.list_dirs(args.test_path)
+    regular = [list(bayespam.read_file(msg)) for msg in bayespam.regular_list]
+    spam = [list(bayespam.read_file(msg)) for msg in bayespam.spam_list]
+
+    rng = random.Random(0)
+    long_messages = [("long x%d" % n, [sum(rng.sample(messages, min(n, len(messages))), [])
+                                       for messages in (regular, spam) for _ in range(20)])
+                     for n in args.concatenate]
+    mixed = []
+    for _ in range(200):
+        tokens = rng.choice(regular) + rng.choice(spam)
+        rng.shuffle(tokens)
+        mixed.append(tokens)
+
+    with tempfile.TemporaryDirectory() as directory:
+        model_fp = os.path.join(directory, 'model.bin')
+        save_model(model_fp, bayespam.vocab, prior_regular, prior_spam)
+        model = Model(model_fp)
+
+        print("messages          count   tokens/msg   tokens scored   score (ms)   early exit (ms)   speedup")
+        for name, messages in [("test set", regular + spam)] + long_messages + [("mixed", mixed)]:
+            full = [not p_regular > p_spam for p_regular, p_spam in (model.score(tokens) for tokens in messages)]
+            early = [model.classify(tokens) for tokens in messages]
+            if full != [is_spam for is_spam, _ in early]:
+                print("Error: early exit changed a decision on the %s messages" % name)
+                sys.exit(1)
+            scored = sum(n_scored for _, n_scored in early) / max(sum(map(len, messages)), 1)
+            score_time = time_best(lambda: [model.score(tokens) for tokens in messages], args.repeat)
+            classify_time = time_best(lambda: [model.classify(tokens) for tokens in messages], args.repeat)
+            print("%-13s %9d %12.0f %14.1f%% %12.3f %17.3f %8.2fx" %
+                  (name, len(messages), sum(map(len, messages)) / len(messages), scored * 100, score_time * 1e3,
+                   classify_time * 1e3, score_time / classify_time))
+        model.close()
+    print("early exit gives the same decisions as full scoring")
+
+
+def bench_dedup(args):
+    """
+    Classification of a stream of campaign-like mail with and without the duplicate cache. The stream repeats
+    the test messages, either unchanged or with a personalised greeting and tracking code, as bulk mail does.
+    Reports the hit rates and the fraction of cached verdicts which agree with scoring the message.
+    """
+    bayespam = Bayespam()
+    bayespam.list_dirs(args.train_path)
+    bayespam.read_messages(MessageType.REGULAR)
+    bayespam.read_messages(MessageType.SPAM)
+    prior_regular, prior_spam = bayespam.vocab.priors()
+    bayespam.vocab.compute_probabilities()
+    bayespam.list_dirs(args.test_path)
+    originals = [lines for msg in bayespam.regular_list + bayespam.spam_list for _, lines in read_message_file(msg)]
+
+    rng = random.Random(0)
+    stream = []
+    for _ in range(args.n_messages):
+        lines = list(rng.choice(originals))
+        if rng.random() < args.mutated:
+            lines.insert(min(1, len(lines)), "Dear %s,\n" % rng.choice(['john', 'maria', 'pieter', 'anna', 'user']))
+            lines.append("ref: %08x\n" % rng.getrandbits(32))
+        stream.append(lines)
+
+    with tempfile.TemporaryDirectory() as directory:
+        model_fp = os.path.join(directory, 'model.bin')
+        save_model(model_fp, bayespam.vocab, prior_regular, prior_spam)
+        model = Model(model_fp)
+
+        start = time.perf_counter()
+        full = [classify.classify_message(model, lines) for lines in stream]
+        full_time = time.perf_counter() - start
+        print("%d messages (%d distinct originals, %.0f%% mutated copies)" %
+              (len(stream), len(originals), args.mutated * 100))
+        print("cache               time (ms)   speedup   exact hits   near hits   agreement")
+        print("%-16s %12.1f %9s %12s %11s %11s" % ("none", full_time * 1e3, "1.00x", "-", "-", "-"))
+        for name, max_distance in (("exact only", None), ("near, 3 bits", 3), ("near, 6 bits", 6)):
+            dedup = DuplicateCache(args.capacity, max_distance)
+            start = time.perf_counter()
+            cached = [classify.classify_message(model, lines, dedup) for lines in stream]
+            cached_time = time.perf_counter() - start
+            stats = dedup.as_dict()
+            agreement = sum(a == b for a, b in zip(full, cached)) / len(stream)
+            print("%-16s %12.1f %8.2fx %11.1f%% %10.1f%% %10.2f%%" %
+                  (name, cached_time * 1e3, full_time / cached_time, stats['exact_hit_rate'] * 100,
+                   (stats['hit_rate'] - stats['exact_hit_rate']) * 100, agreement * 100))
+        model.close()
+
+
+def traced_peak(function):
+    """
+    :param function: Function without arguments
+    :return: Peak memory in bytes allocated while running the function, on top of what was allocated before
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    function()
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return peak
+
+
+def bench_vocab_file(args):
+    """
+    Export and import of a synthetic bigram vocabulary of n_terms terms: the original write_vocab versus
+    save_vocabulary sorting in memory and with an external sort in chunks, and load_vocabulary. Reports the time
+    and the peak memory allocated on top of the vocabulary itself, and checks that the vocabulary survives the
+    round trip.
+    """
+    rng = random.Random(0)
+    words = ["word%05d" % i for i in range(20000)]
+    vocab = Vocabulary()
+    while len(vocab) < args.n_terms:
+        term = "%s %s" % (rng.choice(words), rng.choice(words))
+        if term not in vocab:
+            id = vocab.new_term(term)
+            vocab.counts_regular[id] = int(rng.paretovariate(1.2))
+            vocab.counts_spam[id] = int(rng.paretovariate(1.2))
+    vocab.n_words_regular = sum(vocab.counts_regular)
+    vocab.n_words_spam = sum(vocab.counts_spam)
+    vocab.n_messages_regular = vocab.n_messages_spam = 1000
+
+    with tempfile.TemporaryDirectory() as directory:
+        vocab_fp = os.path.join(directory, 'vocab.tsv')
+        writers = [("write_vocab (original)", lambda: legacy_write_vocab(vocab, vocab_fp))]
+        for chunk_size in [args.n_terms] + args.chunk_sizes:
+            name = "save_vocabulary, %s" % ("in memory" if chunk_size >= args.n_terms else "chunks of %d" % chunk_size)
+            writers.append((name, lambda chunk_size=chunk_size: save_vocabulary(vocab_fp, vocab, (2,),
+                                                                                   chunk_size=chunk_size)))
+        print("%d terms" % len(vocab))
+        print("%-36s %10s %16s" % ("method", "time (s)", "peak memory (MB)"))
+        for name, write in writers:
+            seconds = time_best(write, args.repeat)
+            print("%-36s %10.3f %16.1f" % (name, seconds, traced_peak(write) / 1e6))
+
+        seconds = time_best(lambda: load_vocabulary(vocab_fp), args.repeat)
+        loaded, settings = load_vocabulary(vocab_fp)
+        print("%-36s %10.3f %16.1f" % ("load_vocabulary", seconds, traced_peak(lambda: load_vocabulary(vocab_fp)) / 1e6))
+        print("file size %.1f MB" % (os.path.getsize(vocab_fp) / 1e6))
+
+    for term, count_regular, count_spam in zip(vocab.terms, vocab.counts_regular, vocab.counts_spam):
+        id = loaded.lookup(term)
+        if id < 0 or (loaded.counts_regular[id], loaded.counts_spam[id]) != (count_regular, count_spam):
+            print("Error: the loaded vocabulary differs from the exported one at %s" % repr(term))
+            sys.exit(1)
+    if len(loaded) != len(vocab) or loaded.priors() != vocab.priors() or settings['orders'] != (2,):
+        print("Error: the loaded vocabulary differs from the exported one")
+        sys.exit(1)
+    print("the loaded vocabulary equals the exported one")
+
+
+def bench_message(args):
+    """
+    Tokenizing messages as flat text versus by header fields and MIME parts (message.py), on the training and
+    test sets: tokens and time per message, the size of the vocabulary and the accuracy on the test set.
+    """
+    files = []
+    for path in args.paths:
+        bayespam = Bayespam()
+        bayespam.list_dirs(path)
+        files += bayespam.regular_list + bayespam.spam_list
+    n_parts = n_skipped = skipped_bytes = 0
+    for file in files:
+        with open(file, 'r', encoding='latin1') as f:
+            _, parts = parse_message(f.read())
+        n_parts += len(parts)
+        for part in parts:
+            if not part.is_text:
+                n_skipped += 1
+                skipped_bytes += len(part.raw_body)
+    print("%d messages, %d parts, %d non-text parts (%.1f kB) not decoded" %
+          (len(files), n_parts, n_skipped, skipped_bytes / 1e3))
+
+    orders = tuple(int(n) for n in args.ngrams.split(','))
+    print("tokenizer      tokens/message   time/message (us)   terms   sensitivity   specificity   accuracy")
+    for name, parse_mime in (("flat", False), ("message.py", True)):
+        bayespam = Bayespam(orders, parse_mime=parse_mime)
+        n_tokens = sum(len(list(bayespam.read_file(file))) for file in files)
+        seconds = time_best(lambda: [list(bayespam.read_file(file)) for file in files], args.repeat)
+
+        bayespam.list_dirs(args.paths[0])
+        bayespam.read_messages(MessageType.REGULAR)
+        bayespam.read_messages(MessageType.SPAM)
+        prior_regular, prior_spam = bayespam.vocab.priors()
+        bayespam.list_dirs(args.paths[-1])
+        messages = [list(bayespam.read_file(msg)) for msg in bayespam.regular_list + bayespam.spam_list]
+        _, _, is_spam = classify_batch(messages, bayespam.vocab, prior_regular, prior_spam)
+        print("%-12s %16.1f %19.1f %7d %13.4f %13.4f %10.4f" %
+              ((name, n_tokens / len(files), seconds / len(files) * 1e6, len(bayespam.vocab)) +
+               evaluate(is_spam, len(bayespam.regular_list))))
+
+    ## A message with a base64 encoded attachment, which the flat tokenizer splits into junk tokens
+    rng = random.Random(0)
+    with open(files[0], 'r', encoding='latin1') as f:
+        body = f.read().partition('\n\n')[2]
+    attachment = base64.encodebytes(rng.randbytes(args.attachment_size)).decode('ascii')
+    text = ("From: a@example.com\nSubject: report\nContent-Type: multipart/mixed; boundary=\"b\"\n\n"
+            "--b\nContent-Type: text/plain\n\n%s\n--b\nContent-Type: application/octet-stream\n"
+            "Content-Transfer-Encoding: base64\n\n%s\n--b--\n" % (body, attachment))
+    with tempfile.TemporaryDirectory() as directory:
+        message_fp = os.path.join(directory, 'attachment.msg')
+        with open(message_fp, 'w', encoding='latin1') as f:
+            f.write(text)
+        print("message with a %d kB attachment:" % (args.attachment_size // 1000))
+        for name, parse_mime in (("flat", False), ("message.py", True)):
+            bayespam = Bayespam(orders, parse_mime=parse_mime)
+            n_tokens = len(list(bayespam.read_file(message_fp)))
+            seconds = time_best(lambda: list(bayespam.read_file(message_fp)), args.repeat)
+            print("%-12s %16d %19.1f" % (name, n_tokens, seconds * 1e6))
+
+
+def train_and_score_bigrams(train_path, test_path, interned, trace=False):
+    """
+    Train the exact bigram classifier of bigram_bayespam.py on strings or on interned ids, and classify a test
+    set one message at a time.
+
+    :return: Tuple of the decisions (is spam) on the test set, the training and scoring time in seconds, and
+             the peak traced memory and the number of memory blocks held after training (0 if not traced)
+    """
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    bayespam = bigram_bayespam.bigram_bayespam(interned=interned)
+    bayespam.list_dirs(train_path)
+    bayespam.read_messages(MessageType.REGULAR)
+    bayespam.read_messages(MessageType.SPAM)
+    bayespam.vocab.compute_probabilities()
+    train_time = time.perf_counter() - start
+    peak = blocks = 0
+    if trace:
+        blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    start = time.perf_counter()
+    bayespam.list_dirs(test_path)
+    bayespam.skip_empty = False
+    is_spam = []
+    for msg in bayespam.regular_list + bayespam.spam_list:
+        p_regular = p_spam = 0.0
+        if interned:
+            p_regular, p_spam = bayespam.vocab.score(bayespam.read_file(msg))
+        else:
+            for token in bayespam.read_file(msg):
+                counter = bayespam.vocab.get(token)
+                if counter is not None:
+                    p_regular += counter.pRegular
+                    p_spam += counter.pSpam
+        is_spam.append(not p_regular > p_spam)
+    return is_spam, train_time, time.perf_counter() - start, peak, blocks
+
+
+def bench_interning(args):
+    """
+    The exact bigram classifier on strings versus on interned word ids and packed bigrams, on synthetic corpora
+    of increasing size: training and scoring time, and the peak memory and number of memory blocks allocated
+    while training (traced in a separate run). The decisions must be identical.
+    """
+    print("scale   pipeline    train (s)   score (s)   peak traced (MB)   blocks after training")
+    for scale in args.scales:
+        with tempfile.TemporaryDirectory() as directory:
+            train_path = os.path.join(directory, 'train')
+            test_path = os.path.join(directory, 'test')
+            synthesize_corpus(args.train_path, train_path, scale)
+            synthesize_corpus(args.test_path, test_path, max(1, scale // 4), seed=1)
+            decisions = []
+            for name, interned in (("strings", False), ("interned", True)):
+                is_spam, train_time, score_time, _, _ = train_and_score_bigrams(train_path, test_path, interned)
+                _, _, _, peak, blocks = train_and_score_bigrams(train_path, test_path, interned, trace=True)
+                decisions.append(is_spam)
+                print("%5d   %-9s %11.3f %11.3f %18.1f %23d" %
+                      (scale, name, train_time, score_time, peak / 1e6, blocks))
+            if decisions[0] != decisions[1]:
+                print("Error: the interned pipeline changed a decision")
+                sys.exit(1)
+    print("the interned pipeline gives the same decisions")
+
+
+def drop_page_cache(files):
+    """
+    Evict files from the page cache, so they are read from disk again. Dirty pages cannot be evicted, so
+    everything is written back first. Needs no privileges, unlike writing to /proc/sys/vm/drop_caches.
+
+    :param files: List of file paths
+    :return: None
+    """
+    os.sync()
+    for file in files:
+        fd = os.open(file, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def bench_prefetch(args):
+    """
+    Training on a synthetic corpus of tens of thousands of message files, with the files read in turn versus
+    prefetched by 1..N threads (see prefetch.py). Every run starts from a cold page cache, except for the
+    warm reference run. The vocabularies must be identical. The files are also tokenized with a simulated
+    latency of every read.
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        print("Error: the page cache can only be dropped on platforms with posix_fadvise")
+        sys.exit(1)
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        synthesize_corpus(args.path, directory, args.scale)
+        bayespam = Bayespam()
+        bayespam.list_dirs(directory)
+        files = bayespam.regular_list + bayespam.spam_list
+        n_bytes = sum(os.path.getsize(file) for file in files)
+        print("%d messages, %.1f MB" % (len(files), n_bytes / 1e6))
+
+        def train(threads, cold):
+            bayespam.vocab = Vocabulary()
+            bayespam.prefetch, bayespam.prefetch_depth = threads, args.depth
+            if cold:
+                drop_page_cache(files)
+            start = time.perf_counter()
+            bayespam.read_messages(MessageType.REGULAR)
+            bayespam.read_messages(MessageType.SPAM)
+            return time.perf_counter() - start
+
+        print("cache   threads   seconds   messages/sec   speedup")
+        train(0, False)
+        reference = list(vocab_entries(bayespam.vocab))
+        reference_tokens = bayespam.vocab.n_words_regular + bayespam.vocab.n_words_spam
+        seconds = train(0, False)
+        print("%-5s %9d %9.3f %14.1f" % ("warm", 0, seconds, len(files) / seconds))
+        baseline = None
+        for threads in [0] + args.threads:
+            seconds = train(threads, True)
+            baseline = baseline or seconds
+            if list(vocab_entries(bayespam.vocab)) != reference:
+                print("Error: the vocabulary built with %d prefetch threads differs" % threads)
+                sys.exit(1)
+            print("%-5s %9d %9.3f %14.1f %8.2fx" %
+                  ("cold", threads, seconds, len(files) / seconds, baseline / seconds))
+
+        ## The disk of a test machine may be much faster than the storage of a mail server (network storage,
+        ## spinning disks), so also tokenize with a simulated latency of every read
+        def slow_read(file):
+            time.sleep(args.latency / 1e3)
+            return read_text(file)
+
+        print("simulated read latency of %.2f ms" % args.latency)
+        print("threads   seconds   messages/sec   speedup")
+        baseline = None
+        for threads in [0] + args.threads:
+            start = time.perf_counter()
+            if threads == 0:
+                texts = ((file, slow_read(file)) for file in files)
+            else:
+                texts = prefetch_files(files, threads, args.depth, slow_read)
+            n_tokens = sum(len(list(bayespam.tokenize_text(text))) for _, text in texts)
+            seconds = time.perf_counter() - start
+            baseline = baseline or seconds
+            if n_tokens != reference_tokens:
+                print("Error: %d prefetch threads tokenized a different number of tokens" % threads)
+                sys.exit(1)
+            print("%7d %9.3f %14.1f %8.2fx" % (threads, seconds, len(files) / seconds, baseline / seconds))
+
+
+def bench_roc(args):
+    """
+    The ROC table of a single sorted pass versus thresholding the scores again for every threshold, on
+    synthetic log-odds scores of a large test set: time, and the rates and AUC must agree. Then the ROC table,
+    AUC and calibration of the scores of the test set.
+    """
+    rng = numpy.random.default_rng(0)
+    is_spam = rng.random(args.messages) < 0.3
+    ## Rounded, so that many messages share a score
+    scores = numpy.round(rng.normal(is_spam * 300.0, 400.0))
+    n_spam, n_regular = int(is_spam.sum()), int((~is_spam).sum())
+
+    table_time = time_best(lambda: roc_table(scores, is_spam), args.repeat)
+    table = roc_table(scores, is_spam)
+    auc_time = time_best(table.auc, args.repeat)
+    checked = table.thresholds[rng.integers(0, len(table), args.thresholds)]
+    start = time.perf_counter()
+    for threshold in checked:
+        spam = scores >= threshold
+        rates = (int((spam & is_spam).sum()) / n_spam, int((spam & ~is_spam).sum()) / n_regular)
+        if rates != table.rates(threshold):
+            print("Error: the ROC table differs from thresholding the scores at %g" % threshold)
+            sys.exit(1)
+    loop_time = (time.perf_counter() - start) / len(checked) * len(table)
+    ## The AUC is the probability that a spam message scores higher than a regular one (ties count half)
+    sample = rng.choice(args.messages, 4000, replace=False)
+    spam_scores, regular_scores = scores[sample][is_spam[sample]], scores[sample][~is_spam[sample]]
+    pairwise = (((spam_scores[:, None] > regular_scores[None, :]).sum() +
+                 (spam_scores[:, None] == regular_scores[None, :]).sum() / 2) /
+                (len(spam_scores) * len(regular_scores)))
+    sample_auc = roc_table(scores[sample], is_spam[sample]).auc()
+    if abs(pairwise - sample_auc) > 1e-12:
+        print("Error: the AUC differs from the pairwise AUC (%g, %g)" % (sample_auc, pairwise))
+        sys.exit(1)
+    platt_time = time_best(lambda: fit_platt(scores, is_spam), args.repeat)
+    print("%d messages, %d distinct scores" % (args.messages, len(table)))
+    print("ROC table (single sort)       %10.3f s" % table_time)
+    print("thresholding every score      %10.3f s (estimated from %d thresholds)" % (loop_time, len(checked)))
+    print("AUC                           %10.6f s   AUC = %.6f" % (auc_time, table.auc()))
+    print("Platt scaling                 %10.3f s" % platt_time)
+    print("the ROC table gives the same rates as thresholding the scores")
+
+    bayespam = Bayespam()
+    bayespam.list_dirs(args.train_path)
+    bayespam.read_messages(MessageType.REGULAR)
+    bayespam.read_messages(MessageType.SPAM)
+    prior_regular, prior_spam = bayespam.vocab.priors()
+    bayespam.vocab.compute_probabilities()
+    bayespam.list_dirs(args.test_path)
+    messages = [list(bayespam.read_file(msg)) for msg in bayespam.regular_list + bayespam.spam_list]
+    p_regular, p_spam, _ = classify_batch(messages, bayespam.vocab, prior_regular, prior_spam)
+    labels = numpy.arange(len(messages)) >= len(bayespam.regular_list)
+    table = roc_table(log_odds(p_regular, p_spam), labels, calibrate=True)
+    print("test set: AUC = %.4f, Platt scaling a = %.5f, b = %.4f" % ((table.auc(),) + table.platt))
+    print("max false positive rate   threshold   true positive rate   false positive rate")
+    for max_false_positive_rate in (0.0, 0.01, 0.05, 0.1):
+        threshold = table.threshold_for(max_false_positive_rate)
+        print("%23.2f %11.1f %20.4f %21.4f" % ((max_false_positive_rate, threshold) + table.rates(threshold)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    tokenizer_parser = subparsers.add_parser('tokenizer', help='Tokenizer throughput in messages/sec and MB/sec')
+    tokenizer_parser.add_argument('path', type=str, nargs='?', default='train',
+                                  help='File path of the directory containing the data')
+    tokenizer_parser.add_argument('--repeat', type=int, default=5, help='Number of runs (the fastest is reported)')
+    tokenizer_parser.set_defaults(function=bench_tokenizer)
+
+    workers_parser = subparsers.add_parser('workers', help='Scaling of parallel training over 1..N processes')
+    workers_parser.add_argument('path', type=str, nargs='?', default='train',
+                                help='File path of the directory containing the training data')
+    workers_parser.add_argument('--max-workers', type=int, default=os.cpu_count(),
+                                help='Largest number of processes to test')
+    workers_parser.add_argument('--scale', type=int, default=50, help='Number of times the corpus is repeated')
+    workers_parser.set_defaults(function=bench_workers)
+
+    memory_parser = subparsers.add_parser('memory', help='Memory per vocabulary term')
+    memory_parser.add_argument('path', type=str, nargs='?', default='train',
+                               help='File path of the directory containing the training data')
+    memory_parser.add_argument('--n-terms', type=int, default=1000000, help='Size of the synthetic vocabulary')
+    memory_parser.set_defaults(function=bench_memory)
+
+    model_parser = subparsers.add_parser('model', help='Start-up time of training versus opening a model file')
+    model_parser.add_argument('path', type=str, nargs='?', default='train',
+                              help='File path of the directory containing the training data')
+    model_parser.add_argument('--repeat', type=int, default=5, help='Number of runs (the fastest is reported)')
+    model_parser.set_defaults(function=bench_model)
+
+    scoring_parser = subparsers.add_parser('scoring', help='Per-message scoring loop versus batch scoring')
+    scoring_parser.add_argument('train_path', type=str, nargs='?', default='train',
+                                help='File path of the directory containing the training data')
+    scoring_parser.add_argument('test_path', type=str, nargs='?', default='test',
+                                help='File path of the directory containing the test data')
+    scoring_parser.add_argument('--scale', type=int, default=20, help='Number of times the test set is repeated')
+    scoring_parser.add_argument('--repeat', type=int, default=5, help='Number of runs (the fastest is reported)')
+    scoring_parser.set_defaults(function=bench_scoring)
+
+    online_parser = subparsers.add_parser('online', help='Online update/forget versus a full retrain')
+    online_parser.add_argument('train_path', type=str, nargs='?', default='train',
+                               help='File path of the directory containing the training data')
+    online_parser.add_argument('test_path', type=str, nargs='?', default='test',
+                               help='File path of the directory containing the test data')
+    online_parser.add_argument('--batch-size', type=int, default=5, help='Number of messages per update')
+    online_parser.set_defaults(function=bench_online)
+
+    hashing_parser = subparsers.add_parser('hashing', help='Accuracy/memory of hashed bigram vocabularies')
+    hashing_parser.add_argument('train_path', type=str, nargs='?', default='train',
+                                help='File path of the directory containing the training data')
+    hashing_parser.add_argument('test_path', type=str, nargs='?', default='test',
+                                help='File path of the directory containing the test data')
+    hashing_parser.add_argument('--min-bits', type=int, default=8, help='Smallest table size as a power of two')
+    hashing_parser.add_argument('--max-bits', type=int, default=22, help='Largest table size as a power of two')
+    hashing_parser.set_defaults(function=bench_hashing)
+
+    sketch_parser = subparsers.add_parser('sketch', help='Count-min sketch promotion versus exact bigram counts')
+    sketch_parser.add_argument('train_path', type=str, nargs='?', default='train',
+                               help='File path of the directory containing the training data')
+    sketch_parser.add_argument('--epsilons', type=float, nargs='+', default=[1e-3, 1e-4, 1e-5],
+                               help='Relative errors of the sketches to test')
+    sketch_parser.add_argument('--delta', type=float, default=0.01, help='Failure probability of the sketches')
+    sketch_parser.set_defaults(function=bench_sketch)
+
+    ngrams_parser = subparsers.add_parser('ngrams', help='Combined n-gram pass versus separate unigram/bigram runs')
+    ngrams_parser.add_argument('train_path', type=str, nargs='?', default='train',
+                               help='File path of the directory containing the training data')
+    ngrams_parser.add_argument('test_path', type=str, nargs='?', default='test',
+                               help='File path of the directory containing the test data')
+    ngrams_parser.add_argument('--repeat', type=int, default=3, help='Number of runs (the fastest is reported)')
+    ngrams_parser.set_defaults(function=bench_ngrams)
+
+    cache_parser = subparsers.add_parser('cache', help='Tokenizing with and without the token cache')
+    cache_parser.add_argument('train_path', type=str, nargs='?', default='train',
+                              help='File path of the directory containing the training data')
+    cache_parser.add_argument('test_path', type=str, nargs='?', default='test',
+                              help='File path of the directory containing the test data')
+    cache_parser.add_argument('--repeat', type=int, default=5, help='Number of runs (the fastest is reported)')
+    cache_parser.set_defaults(function=bench_cache)
+
+    sweep_parser = subparsers.add_parser('sweep', help='Hyperparameter sweep versus retraining every setting')
+    sweep_parser.add_argument('train_path', type=str, nargs='?', default='train',
+                              help='File path of the directory containing the training data')
+    sweep_parser.add_argument('test_path', type=str, nargs='?', default='test',
+                              help='File path of the directory containing the test data')
+    sweep_parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of processes')
+    sweep_parser.set_defaults(function=bench_sweep)
+
+    crossval_parser = subparsers.add_parser('crossval', help='Cross-validation by count subtraction versus retraining')
+    crossval_parser.add_argument('paths', type=str, nargs='*', default=['train', 'test'],
+                                 help='File paths of the directories with labeled data')
+    crossval_parser.add_argument('--folds', type=int, default=10, help='Number of folds')
+    crossval_parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of processes')
+    crossval_parser.set_defaults(function=bench_crossval)
+
+    stages_parser = subparsers.add_parser('stages', help='Time and memory of every stage of bayespam.py')
+    stages_parser.add_argument('train_path', type=str, nargs='?', default='train',
+                               help='File path of the directory containing the training data')
+    stages_parser.add_argument('test_path', type=str, nargs='?', default='test',
+                               help='File path of the directory containing the test data')
+    stages_parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100],
+                               help='Sizes of the synthetic corpora as multiples of the shipped corpus')
+    stages_parser.add_argument('--repeat', type=int, default=3, help='Number of runs (the fastest is reported)')
+    stages_parser.add_argument('--output', type=str, default=None, help='Write the results to this JSON file')
+    stages_parser.add_argument('--compare', type=str, default=None,
+                               help='JSON file of an earlier run to compare the stage times with')
+    stages_parser.set_defaults(function=bench_stages)
+
+    selection_parser = subparsers.add_parser('selection', help='Accuracy and latency of top-k feature selection')
+    selection_parser.add_argument('train_path', type=str, nargs='?', default='train',
+                                  help='File path of the directory containing the training data')
+    selection_parser.add_argument('test_path', type=str, nargs='?', default='test',
+                                  help='File path of the directory containing the test data')
+    selection_parser.add_argument('--k', type=int, nargs='+', default=[50, 100, 300, 1000, 3000],
+                                  help='Numbers of terms to keep')
+    selection_parser.add_argument('--methods', type=str, nargs='+', default=['mi', 'chi2', 'log_odds'],
+                                  help='Selection methods to compare')
+    selection_parser.add_argument('--repeat', type=int, default=5, help='Number of runs (the fastest is reported)')
+    selection_parser.set_defaults(function=bench_selection)
+
+    early_exit_parser = subparsers.add_parser('early-exit', help='Early-exit classification versus full scoring')
+    early_exit_parser.add_argument('train_path', type=str, nargs='?', default='train',
+                                   help='File path of the directory containing the training data')
+    early_exit_parser.add_argument('test_path', type=str, nargs='?', default='test',
+                                   help='File path of the directory containing the test data')
+    early_exit_parser.add_argument('--concatenate', type=int, nargs='+', default=[5, 20, 60],
+                                   help='Numbers of test messages concatenated into a large message')
+    early_exit_parser.add_argument('--repeat', type=int, default=5, help='Number of runs (the fastest is reported)')
+    early_exit_parser.set_defaults(function=bench_early_exit)
+
+    dedup_parser = subparsers.add_parser('dedup', help='Classifying repeated messages with the duplicate cache')
+    dedup_parser.add_argument('train_path', type=str, nargs='?', default='train',
+                              help='File path of the directory containing the training data')
+    dedup_parser.add_argument('test_path', type=str, nargs='?', default='test',
+                              help='File path of the directory containing the test data')
+    dedup_parser.add_argument('--n-messages', type=int, default=20000, help='Length of the message stream')
+    dedup_parser.add_argument('--mutated', type=float, default=0.5,
+                              help='Fraction of the stream which are personalised copies')
+    dedup_parser.add_argument('--capacity', type=int, default=65536, help='Capacity of the duplicate cache')
+    dedup_parser.set_defaults(function=bench_dedup)
+
+    vocab_file_parser = subparsers.add_parser('vocab-file', help='Exporting and loading a large vocabulary')
+    vocab_file_parser.add_argument('--n-terms', type=int, default=1000000, help='Size of the synthetic vocabulary')
+    vocab_file_parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[100000],
+                                   help='Numbers of entries sorted in memory at once by the external sort')
+    vocab_file_parser.add_argument('--repeat', type=int, default=1, help='Number of runs (the fastest is reported)')
+    vocab_file_parser.set_defaults(function=bench_vocab_file)
+
+    message_parser = subparsers.add_parser('message', help='Flat versus header/MIME aware tokenizing')
+    message_parser.add_argument('paths', type=str, nargs='*', default=['train', 'test'],
+                                help='File paths of the training and test directories')
+    message_parser.add_argument('--ngrams', type=str, default='1', help='Comma separated n-gram orders')
+    message_parser.add_argument('--attachment-size', type=int, default=200000,
+                                help='Size in bytes of the attachment of the synthetic message')
+    message_parser.add_argument('--repeat', type=int, default=5, help='Number of runs (the fastest is reported)')
+    message_parser.set_defaults(function=bench_message)
+
+    interning_parser = subparsers.add_parser('interning', help='Bigrams as strings versus interned integer ids')
+    interning_parser.add_argument('train_path', type=str, nargs='?', default='train',
+                                  help='File path of the directory containing the training data')
+    interning_parser.add_argument('test_path', type=str, nargs='?', default='test',
+                                  help='File path of the directory containing the test data')
+    interning_parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 50],
+                                  help='Sizes of the synthetic corpora as multiples of the shipped corpus')
+    interning_parser.set_defaults(function=bench_interning)
+
+    prefetch_parser = subparsers.add_parser('prefetch', help='Training on a cold page cache with prefetching threads')
+    prefetch_parser.add_argument('path', type=str, nargs='?', default='train',
+                                 help='File path of the directory containing the data')
+    prefetch_parser.add_argument('--scale', type=int, default=250,
+                                 help='Number of synthetic variants of every message')
+    prefetch_parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8, 16],
+                                 help='Numbers of prefetch threads')
+    prefetch_parser.add_argument('--depth', type=int, default=64, help='Maximum number of messages read ahead')
+    prefetch_parser.add_argument('--latency', type=float, default=1.0,
+                                 help='Simulated latency of every read in milliseconds')
+    prefetch_parser.add_argument('--directory', type=str, default=None,
+                                 help='Directory to write the synthetic corpus in, on the disk to benchmark')
+    prefetch_parser.set_defaults(function=bench_prefetch)
+
+    roc_parser = subparsers.add_parser('roc', help='ROC table of a single sort versus thresholding every score')
+    roc_parser.add_argument('train_path', type=str, nargs='?', default='train',
+                            help='File path of the directory containing the training data')
+    roc_parser.add_argument('test_path', type=str, nargs='?', default='test',
+                            help='File path of the directory containing the test data')
+    roc_parser.add_argument('--messages', type=int, default=1000000, help='Number of synthetic scores')
+    roc_parser.add_argument('--thresholds', type=int, default=20,
+                            help='Number of thresholds checked against thresholding the scores')
+    roc_parser.add_argument('--repeat', type=int, default=3, help='Number of runs (the fastest is reported)')
+    roc_parser.set_defaults(function=bench_roc)
+
+    args = parser.parse_args()
+    args.function(args)
+
+
+if __name__ == "__main__":
+    main()
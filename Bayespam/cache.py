@@ -0,0 +1,205 @@
+"""cache.py -- on-disk cache of tokenized messages.
+
+Repeated runs over the same corpus (and parameter sweeps) spend most of their time reading and tokenizing the
+same files. The cache stores the tokens of every message in a separate entry, keyed by the file path, size and
+modification time of the message and the tokenizer settings, so a changed file or a different setting is simply
+a miss. Entries are integer encoded: the distinct terms of the message once, followed by one index per token.
+
+Layout of an entry (little endian):
+    header   magic, number of distinct terms, number of tokens
+    offsets  uint32[n_terms + 1]   character offsets of the terms in the term data
+    indices  uint32[n_tokens]      term index of every token
+    terms    UTF-8 text            the distinct terms, concatenated
+
+The total size of the cache directory is capped; the least recently used entries are evicted first. Every
+process keeps its own view of the directory, so while several processes fill the same cache (bayespam.py
+--workers) each of them caps the entries it has seen, and the directory can temporarily grow past the cap by the
+entries the other processes added. Rescanning afterwards (TokenCache.scan) evicts down to the cap again."""
+
+import hashlib
+import os
+import struct
+from array import array
+from collections import OrderedDict
+
+MAGIC = b'BSTOKENS'
+HEADER = struct.Struct('<8sII')
+## Part of every key, so entries written by an older tokenizer are never read
+TOKENIZER_VERSION = 1
+
+
+def encode_tokens(tokens):
+    """
+    :param tokens: Iterable of tokens
+    :return: The cache entry of the tokens as bytes
+    """
+    ids = {}
+    indices = array('I')
+    for token in tokens:
+        id = ids.get(token)
+        if id is None:
+            id = ids[token] = len(ids)
+        indices.append(id)
+
+    offsets = array('I', [0])
+    for term in ids:
+        offsets.append(offsets[-1] + len(term))
+    return (HEADER.pack(MAGIC, len(ids), len(indices)) + offsets.tobytes() + indices.tobytes() +
+            "".join(ids).encode('utf-8'))
+
+
+def decode_tokens(data):
+    """
+    :param data: A cache entry as bytes
+    :return: List of tokens
+    """
+    magic, n_terms, n_tokens = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("not a token cache entry")
+    position = HEADER.size
+    offsets = array('I')
+    offsets.frombytes(data[position:position + 4 * (n_terms + 1)])
+    position += 4 * (n_terms + 1)
+    indices = array('I')
+    indices.frombytes(data[position:position + 4 * n_tokens])
+    position += 4 * n_tokens
+
+    text = data[position:].decode('utf-8')
+    if len(text) != offsets[-1]:
+        raise ValueError("truncated token cache entry")
+    terms = [text[offsets[i]:offsets[i + 1]] for i in range(n_terms)]
+    return [terms[i] for i in indices]
+
+
+class TokenCache:
+    def __init__(self, directory, max_bytes=256 << 20):
+        self.directory = directory
+        ## Entries are evicted once the cache holds more than max_bytes
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.entries = OrderedDict()
+        self.n_bytes = 0
+        self.scan()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def scan(self):
+        """
+        Read the size and last use of every entry from the cache directory and evict entries until the cache is no
+        larger than max_bytes. Other processes sharing the directory do not update this process's view of it,
+        so the cap only holds for the entries seen by the last scan.
+
+        :return: None
+        """
+        ## Size of every entry, least recently used first (by modification time, which is refreshed on a hit)
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith('.tok'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    ## Evicted by another process
+                    continue
+                entries.append((stat.st_mtime_ns, entry.name, stat.st_size))
+        self.entries = OrderedDict((name, size) for _, name, size in sorted(entries))
+        self.n_bytes = sum(self.entries.values())
+        ## The cap may have been lowered since the cache was written
+        self.evict()
+
+    def key(self, path, settings):
+        """
+        :param path: File path of a message
+        :param settings: Tuple of the tokenizer settings (any repr-able values)
+        :return: File name of the cache entry of the message
+        """
+        stat = os.stat(path)
+        key = repr((TOKENIZER_VERSION, os.path.abspath(path), stat.st_size, stat.st_mtime_ns, settings))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest() + '.tok'
+
+    def get(self, path, settings):
+        """
+        Look up the tokens of a message.
+
+        :param path: File path of the message
+        :param settings: Tuple of the tokenizer settings
+        :return: List of tokens, or None on a miss
+        """
+        name = self.key(path, settings)
+        entry_path = os.path.join(self.directory, name)
+        try:
+            with open(entry_path, 'rb') as f:
+                tokens = decode_tokens(f.read())
+        except (OSError, ValueError, struct.error):
+            self.misses += 1
+            return None
+        ## Mark the entry as recently used for later runs; a read-only cache is still a hit
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        self.hits += 1
+        if name in self.entries:
+            self.entries.move_to_end(name)
+        return tokens
+
+    def put(self, path, settings, tokens):
+        """
+        Store the tokens of a message, evicting the least recently used entries if the cache grows too large.
+        A cache which can not be written to is not an error; the tokens are simply not cached.
+
+        :param path: File path of the message
+        :param settings: Tuple of the tokenizer settings
+        :param tokens: List of tokens
+        :return: None
+        """
+        name = self.key(path, settings)
+        entry_path = os.path.join(self.directory, name)
+        data = encode_tokens(tokens)
+        try:
+            ## Write next to the entry and rename, so concurrent processes never read a partial entry
+            temporary_path = '%s.%d.tmp' % (entry_path, os.getpid())
+            with open(temporary_path, 'wb') as f:
+                f.write(data)
+            os.replace(temporary_path, entry_path)
+        except OSError:
+            return
+
+        self.n_bytes += len(data) - self.entries.pop(name, 0)
+        self.entries[name] = len(data)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is no larger than max_bytes. The most recent
+        entry is always kept.
+
+        :return: None
+        """
+        while self.n_bytes > self.max_bytes and len(self.entries) > 1:
+            old_name, size = self.entries.popitem(last=False)
+            self.n_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.directory, old_name))
+            except FileNotFoundError:
+                pass
+
+    def tokens(self, path, settings, tokenize):
+        """
+        The tokens of a message, read from the cache or tokenized and added to it.
+
+        :param path: File path of the message
+        :param settings: Tuple of the tokenizer settings
+        :param tokenize: Function tokenizing a message file with these settings
+        :return: List of tokens
+        """
+        tokens = self.get(path, settings)
+        if tokens is None:
+            tokens = list(tokenize(path))
+            self.put(path, settings, tokens)
+        return tokens
@@ -0,0 +1,229 @@
+"""calibration.py -- decision thresholds and calibrated probabilities of log-odds scores.
+
+The classifiers decide by the sign of the log-odds score of a message, log10 P(spam | message) minus
+log10 P(regular | message). Routing messages to more than two tiers (deliver, quarantine, reject) needs other
+thresholds, and every threshold trades missed spam against false alarms. A RocTable holds, for every distinct
+score of a labeled test set, how many spam and regular messages score at least that much, so the rates of any
+threshold are looked up without scoring the messages again. It is built from a single sort of the scores.
+
+The log-odds of naive Bayes are far too confident to be read as probabilities. Platt scaling fits a logistic
+function 1 / (1 + exp(-(a * score + b))) to the labeled scores, which maps scores to calibrated spam
+probabilities.
+
+A ROC table file is a text file with a header line of key=value fields (the class sizes and the Platt
+parameters, if fitted), followed by one line per threshold, highest first:
+    #bayespam-roc version=1 regular=26 spam=68 platt_a=0.00527 platt_b=0.896
+    threshold<TAB>spam messages at or above<TAB>regular messages at or above"""
+
+import math as m
+import os
+
+import numpy
+
+MAGIC = '#bayespam-roc'
+VERSION = 1
+
+
+def log_odds(p_regular, p_spam):
+    """
+    :param p_regular: Log a posteriori probabilities of regular messages (number or NumPy array)
+    :param p_spam: Log a posteriori probabilities of spam messages
+    :return: The log-odds scores of the messages; a message is spam if its score is at least 0
+    """
+    return p_spam - p_regular
+
+
+def sigmoid(z):
+    ## Same as 1 / (1 + exp(-z)), without overflowing for the large scores of naive Bayes
+    return 0.5 * (1 + numpy.tanh(0.5 * z))
+
+
+class RocTable:
+    def __init__(self, thresholds, true_positives, false_positives, n_spam, n_regular, platt=None):
+        ## Distinct scores in decreasing order, the first one +inf (no message is spam)
+        self.thresholds = thresholds
+        ## Number of spam and regular messages scoring at least every threshold
+        self.true_positives = true_positives
+        self.false_positives = false_positives
+        self.n_spam = n_spam
+        self.n_regular = n_regular
+        ## Platt scaling parameters (a, b), or None if no calibration was fitted
+        self.platt = platt
+
+    def __len__(self):
+        return len(self.thresholds)
+
+    @property
+    def true_positive_rates(self):
+        return self.true_positives / max(self.n_spam, 1)
+
+    @property
+    def false_positive_rates(self):
+        return self.false_positives / max(self.n_regular, 1)
+
+    def auc(self):
+        """
+        :return: Area under the ROC curve, the probability that a random spam message scores higher than a
+                 random regular message (ties count half)
+        """
+        tpr, fpr = self.true_positive_rates, self.false_positive_rates
+        return float(numpy.sum(numpy.diff(fpr) * (tpr[1:] + tpr[:-1])) / 2)
+
+    def rates(self, threshold):
+        """
+        :param threshold: Messages scoring at least threshold are spam
+        :return: Tuple of the true positive rate (sensitivity) and false positive rate (1 - specificity)
+        """
+        ## The last row whose threshold is at least the given threshold
+        index = len(self.thresholds) - 1 - int(numpy.searchsorted(self.thresholds[::-1], threshold, side='left'))
+        return (float(self.true_positives[index]) / max(self.n_spam, 1),
+                float(self.false_positives[index]) / max(self.n_regular, 1))
+
+    def threshold_for(self, max_false_positive_rate):
+        """
+        Pick the operating point which catches the most spam without exceeding a false positive rate.
+
+        :param max_false_positive_rate: Highest acceptable fraction of regular messages classified as spam
+        :return: A threshold between the lowest score of the table whose false positive rate is within the limit
+                 and the next lower score, so that rounding differences between scoring the messages in a batch
+                 and one at a time do not move messages across it
+        """
+        index = numpy.flatnonzero(self.false_positive_rates <= max_false_positive_rate)[-1]
+        if index + 1 == len(self.thresholds):
+            return float(self.thresholds[index])
+        return float((self.thresholds[index] + self.thresholds[index + 1]) / 2)
+
+    def probability(self, scores):
+        """
+        :param scores: Log-odds score or NumPy array of scores
+        :return: The calibrated spam probability of every score (see fit_platt)
+        """
+        if self.platt is None:
+            raise ValueError("the ROC table has no calibration")
+        a, b = self.platt
+        return sigmoid(a * numpy.asarray(scores, dtype=numpy.float64) + b)
+
+    def rows(self):
+        """
+        Generate (threshold, true positive rate, false positive rate) rows, highest threshold first.
+        """
+        return zip(self.thresholds.tolist(), self.true_positive_rates.tolist(), self.false_positive_rates.tolist())
+
+
+def roc_table(scores, is_spam, calibrate=False):
+    """
+    Build the ROC table of the scores of a labeled test set with a single sort.
+
+    :param scores: NumPy array of log-odds scores
+    :param is_spam: Boolean NumPy array with the true label of every message
+    :param calibrate: Set to True to also fit Platt scaling to the scores
+    :return: RocTable
+    """
+    scores = numpy.asarray(scores, dtype=numpy.float64)
+    is_spam = numpy.asarray(is_spam, dtype=bool)
+    order = numpy.argsort(-scores, kind='stable')
+    sorted_scores = scores[order]
+    true_positives = numpy.cumsum(is_spam[order], dtype=numpy.int64)
+    false_positives = numpy.arange(1, len(scores) + 1, dtype=numpy.int64) - true_positives
+    ## Messages with equal scores get the same decision, so only the last of every run of equal scores is a row
+    last = numpy.flatnonzero(numpy.append(sorted_scores[1:] != sorted_scores[:-1], True)) if len(scores) else []
+    platt = fit_platt(scores, is_spam) if calibrate else None
+    return RocTable(numpy.concatenate([[numpy.inf], sorted_scores[last]]),
+                    numpy.concatenate([[0], true_positives[last]]).astype(numpy.int64),
+                    numpy.concatenate([[0], false_positives[last]]).astype(numpy.int64),
+                    int(is_spam.sum()), int(len(is_spam) - is_spam.sum()), platt)
+
+
+def fit_platt(scores, is_spam, iterations=100, tolerance=1e-10):
+    """
+    Fit the parameters of Platt scaling by Newton's method with backtracking, minimizing the cross-entropy with
+    Platt's smoothed targets (n_spam + 1) / (n_spam + 2) and 1 / (n_regular + 2) instead of 1 and 0, so that
+    separable scores do not drive the parameters to infinity.
+
+    :param scores: NumPy array of log-odds scores
+    :param is_spam: Boolean NumPy array with the true label of every message
+    :param iterations: Maximum number of Newton steps
+    :param tolerance: Stop when the gradient is smaller than this
+    :return: Tuple (a, b) of the parameters of 1 / (1 + exp(-(a * score + b)))
+    """
+    scores = numpy.asarray(scores, dtype=numpy.float64)
+    is_spam = numpy.asarray(is_spam, dtype=bool)
+    n_spam = int(is_spam.sum())
+    n_regular = len(is_spam) - n_spam
+    targets = numpy.where(is_spam, (n_spam + 1) / (n_spam + 2), 1 / (n_regular + 2))
+
+    def loss(a, b):
+        z = a * scores + b
+        ## log(1 + exp(z)) - t * z, computed without overflow
+        return float(numpy.sum(numpy.logaddexp(0, z) - targets * z))
+
+    a, b = 0.0, m.log((n_spam + 1) / (n_regular + 1))
+    current = loss(a, b)
+    for _ in range(iterations):
+        p = sigmoid(a * scores + b)
+        gradient_a = float(numpy.dot(scores, p - targets))
+        gradient_b = float(numpy.sum(p - targets))
+        if abs(gradient_a) < tolerance and abs(gradient_b) < tolerance:
+            break
+        weights = p * (1 - p)
+        ## Hessian, regularized slightly so that it is always invertible
+        h_aa = float(numpy.dot(scores * scores, weights)) + 1e-12
+        h_ab = float(numpy.dot(scores, weights))
+        h_bb = float(weights.sum()) + 1e-12
+        determinant = h_aa * h_bb - h_ab * h_ab
+        step_a = (h_bb * gradient_a - h_ab * gradient_b) / determinant
+        step_b = (h_aa * gradient_b - h_ab * gradient_a) / determinant
+        step = 1.0
+        while step > 1e-10:
+            candidate = loss(a - step * step_a, b - step * step_b)
+            ## Armijo condition: the loss decreases by a fraction of what the gradient predicts
+            if candidate <= current - 1e-4 * step * (gradient_a * step_a + gradient_b * step_b):
+                break
+            step /= 2
+        else:
+            break
+        a, b, current = a - step * step_a, b - step * step_b, candidate
+    return a, b
+
+
+def save_roc_table(destination_fp, table):
+    """
+    Write a ROC table file. The file is written next to its destination first and then renamed.
+
+    :param destination_fp: Destination file path of the table
+    :param table: RocTable
+    :return: None
+    """
+    header = [MAGIC, 'version=%d' % VERSION, 'regular=%d' % table.n_regular, 'spam=%d' % table.n_spam]
+    if table.platt is not None:
+        header += ['platt_a=%r' % table.platt[0], 'platt_b=%r' % table.platt[1]]
+    temporary_fp = destination_fp + '.tmp'
+    with open(temporary_fp, 'w', encoding='utf-8', newline='\n') as f:
+        f.write(' '.join(header) + '\n')
+        f.writelines("%r\t%d\t%d\n" % row for row in zip(table.thresholds.tolist(), table.true_positives.tolist(),
+                                                            table.false_positives.tolist()))
+    os.replace(temporary_fp, destination_fp)
+
+
+def load_roc_table(source_fp):
+    """
+    :param source_fp: File path of a ROC table file
+    :return: RocTable
+    """
+    with open(source_fp, 'r', encoding='utf-8', newline='\n') as f:
+        fields = f.readline().split()
+        if not fields or fields[0] != MAGIC:
+            raise ValueError("not a ROC table file")
+        settings = dict(field.partition('=')[::2] for field in fields[1:])
+        if settings.get('version') != str(VERSION):
+            raise ValueError("unsupported ROC table file version %s" % settings.get('version'))
+        thresholds, true_positives, false_positives = [], [], []
+        for line in f:
+            threshold, true_positive, false_positive = line.split('\t')
+            thresholds.append(float(threshold))
+            true_positives.append(int(true_positive))
+            false_positives.append(int(false_positive))
+    platt = (float(settings['platt_a']), float(settings['platt_b'])) if 'platt_a' in settings else None
+    return RocTable(numpy.array(thresholds), numpy.array(true_positives, dtype=numpy.int64),
+                    numpy.array(false_positives, dtype=numpy.int64), int(settings['spam']),
+                    int(settings['regular']), platt)
@@ -0,0 +1,163 @@
+"""classify.py -- classify messages with a model saved by bayespam.py --save-model.
+
+Messages are read one at a time from message files, mbox files, maildirs or standard input, and every result is
+printed as soon as the message is classified. With --dedup, copies of a message seen before (e.g. the same
+spam sent to many recipients of a mailbox) get the verdict of the earlier copy; see dedup.DuplicateCache. With
+--scores, a near-duplicate is printed with the score of the earlier copy, not of its own text.
+
+Messages are spam if their log-odds score is at least --threshold (0 by default). With a ROC table written by
+bayespam.py --roc, --max-fpr picks the threshold catching the most spam of the test set at that false positive
+rate, and --scores also prints the calibrated spam probability of every message (see calibration.py).
+
+Usage: python classify.py <model> [<message> ...] [--mbox FILE ...] [--maildir DIR ...]
+       Use - as message to read a single message or an mbox from standard input. Options and messages can be
+       given in any order; the messages are classified first, then the mbox files and then the maildirs, each
+       in the order given."""
+
+import argparse
+import sys
+
+from calibration import load_roc_table
+from dedup import DuplicateCache, exact_key
+from mail_sources import read_maildir, read_mbox, read_message_file, read_stdin
+from message import message_tokens
+from model import Model
+from tokenizer import ngrams, tokenize_lines
+
+
+def tokenize_message(model, lines):
+    """
+    :param model: Model
+    :param lines: List of the lines of a message
+    :return: List of the tokens of the message, with the tokenizer settings of the model
+    """
+    if model.parse_mime:
+        return list(message_tokens("".join(lines), model.orders, model.min_word_size, model.min_ngram_size))
+    return list(ngrams(tokenize_lines(lines, 1), model.orders, model.min_word_size, model.min_ngram_size))
+
+
+def cached_verdict(lines, tokenize, decide, dedup=None):
+    """
+    :param lines: List of the lines of a message
+    :param tokenize: Function mapping the lines of a message to its tokens
+    :param decide: Function mapping the tokens of a message to its verdict
+    :param dedup: DuplicateCache of the verdicts of earlier messages, or None
+    :return: The verdict of the message, or of an earlier (near-)duplicate of it
+    """
+    if dedup is None:
+        return decide(tokenize(lines))
+    message_key = exact_key("".join(lines))
+    verdict = dedup.get_exact(message_key)
+    if verdict is not None:
+        return verdict
+
+    tokens = tokenize(lines)
+    fingerprint = dedup.fingerprint(tokens)
+    verdict = dedup.get_similar(fingerprint)
+    if verdict is not None:
+        ## Cached without a fingerprint, so that copies of this near-duplicate are exact hits
+        dedup.put(message_key, None, verdict)
+        return verdict
+    verdict = decide(tokens)
+    dedup.put(message_key, fingerprint, verdict)
+    return verdict
+
+
+def classify_message(model, lines, dedup=None, threshold=0.0):
+    """
+    :param model: Model
+    :param lines: List of the lines of a message
+    :param dedup: DuplicateCache of the verdicts of earlier messages, or None
+    :param threshold: Messages whose log-odds score is at least threshold are spam
+    :return: Whether the message is spam
+    """
+    return cached_verdict(lines, lambda lines: tokenize_message(model, lines),
+                          lambda tokens: model.classify(tokens, threshold=threshold)[0], dedup)
+
+
+def score_message(model, lines, dedup=None):
+    """
+    :param model: Model
+    :param lines: List of the lines of a message
+    :param dedup: DuplicateCache of the scores of earlier messages, or None
+    :return: The log-odds score of the message (see Model.log_odds)
+    """
+    return cached_verdict(lines, lambda lines: tokenize_message(model, lines), model.log_odds, dedup)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_path', type=str,
+                        help='File path of the trained model')
+    parser.add_argument('messages', type=str, nargs='*',
+                        help='File paths of the messages to classify (- for standard input)')
+    parser.add_argument('--mbox', type=str, action='append', default=[],
+                        help='File path of an mbox file to classify')
+    parser.add_argument('--maildir', type=str, action='append', default=[],
+                        help='File path of a maildir to classify')
+    parser.add_argument('--dedup', action='store_true',
+                        help='Reuse the verdicts of identical and nearly identical messages')
+    parser.add_argument('--dedup-size', type=int, default=65536,
+                        help='Number of recent verdicts kept for duplicate messages')
+    parser.add_argument('--dedup-distance', type=int, default=3,
+                        help='Maximum number of differing SimHash bits of near-duplicates (-1 for exact duplicates only)')
+    parser.add_argument('--threshold', type=float, default=0.0,
+                        help='Classify messages whose log-odds score is at least this as spam')
+    parser.add_argument('--roc', type=str, default=None,
+                        help='File path of a ROC table written by bayespam.py --roc')
+    parser.add_argument('--max-fpr', type=float, default=None,
+                        help='Pick the threshold of the ROC table with at most this false positive rate')
+    parser.add_argument('--scores', action='store_true',
+                        help='Also print the log-odds score (and calibrated probability, with --roc) of every message')
+    ## Messages may also follow the options, e.g. classify.py model a.eml --threshold 0 b.eml
+    args = parser.parse_intermixed_args()
+
+    try:
+        model = Model(args.model_path)
+    except Exception as e:
+        print("Error while opening model %s: " % args.model_path, e)
+        exit()
+
+    roc = None
+    if args.roc is not None:
+        try:
+            roc = load_roc_table(args.roc)
+        except Exception as e:
+            print("Error while reading ROC table %s: " % args.roc, e)
+            exit()
+    threshold = args.threshold
+    if args.max_fpr is not None:
+        if roc is None:
+            print("Error: --max-fpr needs the ROC table of --roc")
+            exit()
+        threshold = roc.threshold_for(args.max_fpr)
+
+    dedup = None
+    if args.dedup:
+        dedup = DuplicateCache(args.dedup_size, args.dedup_distance if args.dedup_distance >= 0 else None)
+
+    sources = [read_stdin() if msg == '-' else read_message_file(msg) for msg in args.messages]
+    sources += [read_mbox(path) for path in args.mbox]
+    sources += [read_maildir(path) for path in args.maildir]
+
+    for source in sources:
+        try:
+            for key, lines in source:
+                if not args.scores:
+                    is_spam = classify_message(model, lines, dedup, threshold)
+                    print("%s\t%s" % (key, "spam" if is_spam else "regular"))
+                elif roc is None or roc.platt is None:
+                    score = score_message(model, lines, dedup)
+                    print("%s\t%s\t%.6g" % (key, "spam" if score >= threshold else "regular", score))
+                else:
+                    score = score_message(model, lines, dedup)
+                    print("%s\t%s\t%.6g\t%.6f" % (key, "spam" if score >= threshold else "regular", score,
+                                                  roc.probability(score)))
+                sys.stdout.flush()
+        except Exception as e:
+            print("Error while reading messages: ", e)
+            exit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""crossval.py -- k-fold cross-validation of the spam filter.
+
+All labeled messages of the given data directories are pooled, shuffled and split into k folds with the same
+ratio of regular and spam messages. Every message is tokenized only once. Instead of training k classifiers
+from scratch, the term counts of each fold are subtracted from the counts of all messages, after which the
+held-out fold is scored with the remaining counts. The folds are evaluated in parallel.
+
+The error rates are reported as in bayespam.py's assignment:
+    FAR  false accept rate: the fraction of spam messages classified as regular (misses)
+    FRR  false reject rate: the fraction of regular messages classified as spam (false alarms)
+
+Usage: python crossval.py <data> [<data> ...] [--folds 10] [--workers N]"""
+
+import argparse
+import multiprocessing
+import random
+import sys
+import time
+
+import numpy
+
+from bayespam import Bayespam
+from cache import TokenCache
+from scoring import term_matrix
+from vocabulary import log_likelihoods
+
+## The folds of the cross-validation, set in every worker process by init_worker
+folds_data = None
+
+
+class Fold:
+    """The term-count matrix of the messages of a single fold, with their labels."""
+
+    def __init__(self, matrix, is_spam):
+        self.matrix = matrix
+        self.is_spam = is_spam
+        self.n_spam = int(is_spam.sum())
+        self.n_regular = len(is_spam) - self.n_spam
+        self.counts_regular = matrix.column_sums(~is_spam)
+        self.counts_spam = matrix.column_sums(is_spam)
+
+
+class FoldsData:
+    """All folds, together with the total counts of every term over all folds."""
+
+    def __init__(self, folds, minimum_frequency=1, epsilon=sys.float_info.epsilon):
+        self.folds = folds
+        self.minimum_frequency = minimum_frequency
+        self.epsilon = epsilon
+        self.counts_regular = sum(fold.counts_regular for fold in folds)
+        self.counts_spam = sum(fold.counts_spam for fold in folds)
+        self.n_regular = sum(fold.n_regular for fold in folds)
+        self.n_spam = sum(fold.n_spam for fold in folds)
+
+
+def split_folds(labels, k, seed=0):
+    """
+    Assign the messages to k folds with (almost) the same number of regular and spam messages each.
+
+    :param labels: List with for every message whether it is spam
+    :param k: Number of folds
+    :param seed: Seed of the shuffle
+    :return: List of k lists of message indices
+    """
+    rng = random.Random(seed)
+    folds = [[] for _ in range(k)]
+    n_assigned = 0
+    for label in (False, True):
+        indices = [i for i, is_spam in enumerate(labels) if is_spam == label]
+        rng.shuffle(indices)
+        ## Continue where the previous class stopped, so the folds also have the same total size
+        for i, index in enumerate(indices):
+            folds[(n_assigned + i) % k].append(index)
+        n_assigned += len(indices)
+    return [sorted(fold) for fold in folds]
+
+
+def build_folds(messages, labels, k, seed=0, minimum_frequency=1, epsilon=sys.float_info.epsilon):
+    """
+    Map the tokens of all messages to term ids and build the term-count matrix of every fold.
+
+    :param messages: List of messages, each a list of tokens
+    :param labels: List with for every message whether it is spam
+    :param k: Number of folds
+    :return: FoldsData
+    """
+    ids = {}
+    for tokens in messages:
+        for token in tokens:
+            if token not in ids:
+                ids[token] = len(ids)
+
+    folds = []
+    for indices in split_folds(labels, k, seed):
+        matrix = term_matrix([messages[i] for i in indices], ids.__getitem__, len(ids))
+        folds.append(Fold(matrix, numpy.array([labels[i] for i in indices], dtype=bool)))
+    return FoldsData(folds, minimum_frequency, epsilon)
+
+
+def init_worker(data):
+    global folds_data
+    folds_data = data
+
+
+def evaluate_fold(index):
+    """
+    Train on all folds except one by subtracting its counts from the totals, and classify the held-out fold.
+
+    :param index: Index of the held-out fold
+    :return: Tuple of the number of regular and spam messages, the number of false rejects (regular classified
+             as spam) and false accepts (spam classified as regular), and the time taken in seconds
+    """
+    start = time.perf_counter()
+    data = folds_data
+    fold = data.folds[index]
+    counts_regular = data.counts_regular - fold.counts_regular
+    counts_spam = data.counts_spam - fold.counts_spam
+    with numpy.errstate(divide='ignore'):
+        numerators_regular = numpy.log10(counts_regular)
+        numerators_spam = numpy.log10(counts_spam)
+    unused = counts_regular + counts_spam < max(data.minimum_frequency, 1)
+    p_regular, p_spam = log_likelihoods(counts_regular, counts_spam, numerators_regular, numerators_spam, unused,
+                                        data.epsilon)
+
+    n_train_regular = data.n_regular - fold.n_regular
+    n_train_spam = data.n_spam - fold.n_spam
+    prior_regular = numpy.log10(n_train_regular / (n_train_regular + n_train_spam))
+    prior_spam = numpy.log10(n_train_spam / (n_train_regular + n_train_spam))
+    is_spam = ~(prior_regular + fold.matrix.dot(p_regular) > prior_spam + fold.matrix.dot(p_spam))
+
+    false_rejects = int((is_spam & ~fold.is_spam).sum())
+    false_accepts = int((~is_spam & fold.is_spam).sum())
+    return fold.n_regular, fold.n_spam, false_rejects, false_accepts, time.perf_counter() - start
+
+
+def cross_validate(data, workers=1):
+    """
+    Evaluate every fold, in parallel if workers > 1.
+
+    :param data: FoldsData
+    :param workers: Number of processes
+    :return: List with the result of evaluate_fold for every fold
+    """
+    if workers <= 1:
+        init_worker(data)
+        return [evaluate_fold(index) for index in range(len(data.folds))]
+    with multiprocessing.Pool(workers, init_worker, (data,)) as pool:
+        return pool.map(evaluate_fold, range(len(data.folds)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('data_paths', type=str, nargs='+',
+                        help='File paths of the directories with labeled data (e.g. train test)')
+    parser.add_argument('--folds', type=int, default=10,
+                        help='Number of folds')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the random assignment of messages to folds')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='Number of processes evaluating the folds')
+    parser.add_argument('--ngrams', type=str, default='1',
+                        help='Comma separated n-gram orders to train on, e.g. 1,2 for words and bigrams')
+    parser.add_argument('--min-word-size', type=int, default=4,
+                        help='Minimum length of a word')
+    parser.add_argument('--min-frequency', type=int, default=1,
+                        help='Ignore terms which occur less often in the training folds')
+    parser.add_argument('--epsilon', type=float, default=sys.float_info.epsilon,
+                        help='Smoothing value of the zero probabilities')
+    parser.add_argument('--cache', type=str, default=None,
+                        help='Directory of a cache of tokenized messages, reused by later runs')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    bayespam = Bayespam(tuple(int(n) for n in args.ngrams.split(',')), args.min_word_size)
+    if args.cache is not None:
+        bayespam.cache = TokenCache(args.cache)
+
+    messages = []
+    labels = []
+    for path in args.data_paths:
+        bayespam.list_dirs(path)
+        try:
+            for message_list, is_spam in ((bayespam.regular_list, False), (bayespam.spam_list, True)):
+                for msg in message_list:
+                    messages.append(list(bayespam.read_file(msg)))
+                    labels.append(is_spam)
+        except Exception as e:
+            print("Error while reading messages: ", e)
+            exit()
+    if args.folds < 2 or args.folds > min(labels.count(False), labels.count(True)):
+        print("Error: --folds should be at least 2 and at most the number of messages of each type.")
+        exit()
+    tokenize_time = time.perf_counter() - start
+
+    data = build_folds(messages, labels, args.folds, args.seed, args.min_frequency, args.epsilon)
+    results = cross_validate(data, args.workers)
+    total_time = time.perf_counter() - start
+
+    print("fold   regular   spam        FAR        FRR   time (ms)")
+    for index, (n_regular, n_spam, false_rejects, false_accepts, seconds) in enumerate(results):
+        print("%4d %9d %6d %10.4f %10.4f %11.3f" %
+              (index, n_regular, n_spam, false_accepts / n_spam, false_rejects / n_regular, seconds * 1e3))
+
+    far = numpy.array([false_accepts / n_spam for _, n_spam, _, false_accepts, _ in results])
+    frr = numpy.array([false_rejects / n_regular for n_regular, _, false_rejects, _, _ in results])
+    print("mean FAR %.4f (std %.4f), mean FRR %.4f (std %.4f)" % (far.mean(), far.std(), frr.mean(), frr.std()))
+    ## The pooled rates weigh every message equally, regardless of the fold sizes
+    print("pooled FAR %.4f, pooled FRR %.4f" % (sum(result[3] for result in results) / data.n_spam,
+                                                sum(result[2] for result in results) / data.n_regular))
+    print("%d messages, %d folds: tokenizing %.3f s, total %.3f s" %
+          (len(messages), args.folds, tokenize_time, total_time))
+
+
+if __name__ == "__main__":
+    main()
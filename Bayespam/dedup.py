@@ -0,0 +1,157 @@
+"""dedup.py -- cache of the verdicts of recently classified messages.
+
+Spam campaigns send many identical or nearly identical messages. Identical messages are found with a hash of
+their raw text, before they are tokenized. Nearly identical messages (e.g. with a different recipient name or
+tracking code) are found by the SimHash fingerprint of their tokens: similar token multisets give fingerprints
+which differ in only a few bits. The fingerprints are split into max_distance + 1 bands, so any fingerprint
+within max_distance bits of a cached one shares at least one band with it (pigeonhole principle) and is found
+with a few dictionary lookups.
+
+The cache holds at most capacity messages, and evicts the least recently used one first. Token hashes use
+hash(), so fingerprints are only comparable within a single process."""
+
+import hashlib
+from collections import OrderedDict
+
+import numpy
+
+## Number of bits of a SimHash fingerprint (the size of hash())
+FINGERPRINT_BITS = 64
+
+
+def exact_key(text):
+    """
+    :param text: The raw message
+    :return: Digest identifying the message
+    """
+    return hashlib.blake2b(text.encode('utf-8', 'surrogateescape'), digest_size=16).digest()
+
+
+def simhash(tokens):
+    """
+    Compute the SimHash fingerprint of a message: every bit is set if the tokens whose hash has that bit set
+    outnumber the tokens whose hash does not.
+
+    :param tokens: Iterable of the message's tokens
+    :return: Fingerprint as an int of FINGERPRINT_BITS bits
+    """
+    counts = {}
+    for token in tokens:
+        counts[token] = counts.get(token, 0) + 1
+    if not counts:
+        return 0
+    hashes = numpy.fromiter(map(hash, counts), dtype=numpy.int64, count=len(counts))
+    weights = numpy.fromiter(counts.values(), dtype=numpy.float64, count=len(counts))
+    ## Row i holds the bits of hash i, least significant bit first
+    bits = numpy.unpackbits(hashes.view(numpy.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    ## Weighted number of tokens with every bit set, which is a majority if it exceeds half of all tokens
+    votes = weights @ bits
+    return int.from_bytes(numpy.packbits(2 * votes > weights.sum(), bitorder='little').tobytes(), 'little')
+
+
+class DuplicateCache:
+    def __init__(self, capacity=65536, max_distance=3):
+        self.capacity = capacity
+        ## Fingerprints at most max_distance bits apart are near-duplicates (None to only find exact duplicates)
+        self.max_distance = max_distance
+
+        ## Maps the key of every cached message to its fingerprint and verdict, least recently used first
+        self.entries = OrderedDict()
+        ## For every band of the fingerprints, maps the value of the band to the keys of the cached messages
+        n_bands = max_distance + 1 if max_distance is not None else 0
+        self.bands = [(i * FINGERPRINT_BITS // n_bands, (i + 1) * FINGERPRINT_BITS // n_bands)
+                      for i in range(n_bands)]
+        self.index = [{} for _ in self.bands]
+
+        self.lookups = 0
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def band_values(self, fingerprint):
+        return [(fingerprint >> start) & ((1 << (end - start)) - 1) for start, end in self.bands]
+
+    def fingerprint(self, tokens):
+        """
+        :param tokens: List of the message's tokens
+        :return: The SimHash fingerprint of the message, or 0 if the cache only finds exact duplicates
+        """
+        return simhash(tokens) if self.bands else 0
+
+    def get_exact(self, key):
+        """
+        Look up the verdict of an identical message. Counts as a lookup: a miss should be followed by
+        get_similar.
+
+        :param key: Key of the message (see exact_key)
+        :return: The cached verdict, or None
+        """
+        self.lookups += 1
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        self.exact_hits += 1
+        return entry[1]
+
+    def get_similar(self, fingerprint):
+        """
+        Look up the verdict of a message whose fingerprint is at most max_distance bits away.
+
+        :param fingerprint: Fingerprint of the message (see simhash)
+        :return: The verdict of the closest cached message, or None
+        """
+        best_key, best_distance = None, None
+        for values, value in zip(self.index, self.band_values(fingerprint)):
+            for key in values.get(value, ()):
+                distance = bin(self.entries[key][0] ^ fingerprint).count('1')
+                if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                    best_key, best_distance = key, distance
+        if best_key is None:
+            return None
+        self.entries.move_to_end(best_key)
+        self.near_hits += 1
+        return self.entries[best_key][1]
+
+    def put(self, key, fingerprint, verdict):
+        """
+        Cache the verdict of a message, evicting the least recently used message if the cache is full.
+
+        :param key: Key of the message (see exact_key)
+        :param fingerprint: Fingerprint of the message (see simhash), or None to only find exact duplicates of it
+                            (e.g. for a near-duplicate of a cached message, which would only crowd the index)
+        :param verdict: The verdict to return for duplicates of the message
+        :return: None
+        """
+        if key in self.entries:
+            self.remove(key)
+        self.entries[key] = (fingerprint, verdict)
+        if fingerprint is not None:
+            for values, value in zip(self.index, self.band_values(fingerprint)):
+                values.setdefault(value, set()).add(key)
+        while len(self.entries) > self.capacity:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def remove(self, key):
+        fingerprint, _ = self.entries.pop(key)
+        if fingerprint is None:
+            return
+        for values, value in zip(self.index, self.band_values(fingerprint)):
+            keys = values[value]
+            keys.discard(key)
+            if not keys:
+                del values[value]
+
+    def as_dict(self):
+        """
+        :return: Dictionary with the size of the cache, the number of lookups, hits and evictions, and the
+                 hit rates
+        """
+        return {'size': len(self.entries), 'capacity': self.capacity, 'lookups': self.lookups,
+                'exact_hits': self.exact_hits, 'near_hits': self.near_hits, 'evictions': self.evictions,
+                'exact_hit_rate': self.exact_hits / self.lookups if self.lookups else 0.0,
+                'hit_rate': (self.exact_hits + self.near_hits) / self.lookups if self.lookups else 0.0}
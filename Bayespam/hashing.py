@@ -0,0 +1,157 @@
+"""hashing.py -- hashed-feature vocabulary for the spam filters.
+
+Instead of storing every term, terms are hashed into a fixed number of buckets and only the counts of the
+buckets are kept. The memory of the model is therefore constant regardless of the size of the corpus, and
+lookups are integer-indexed. Terms which share a bucket also share their counts."""
+
+import sys
+import zlib
+from array import array
+
+import numpy
+
+from vocabulary import VocabEntry
+
+
+class HashedVocabulary:
+    def __init__(self, size, minimum_frequency=1):
+        ## Number of buckets
+        self.size = size
+        ## Buckets with a lower total count than minimum_frequency are not part of the vocabulary
+        self.minimum_frequency = minimum_frequency
+        ## Smoothing value of the zero probabilities
+        self.epsilon = sys.float_info.epsilon
+
+        ## Number of words and messages of each class
+        self.n_words_regular = 0
+        self.n_words_spam = 0
+        self.n_messages_regular = 0
+        self.n_messages_spam = 0
+
+        ## Frequency counts in regular and spam messages, indexed by bucket
+        self.counts_regular = array('q', bytes(8 * size))
+        self.counts_spam = array('q', bytes(8 * size))
+
+        ## Class conditional log-probabilities, indexed by bucket (set by compute_probabilities)
+        self.p_regular = None
+        self.p_spam = None
+        ## Whether each bucket is part of the vocabulary (set by compute_probabilities)
+        self.in_vocab = None
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, term):
+        return self.lookup(term) >= 0
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the count and probability arrays in bytes.
+        """
+        nbytes = 16 * self.size
+        if self.p_regular is not None:
+            nbytes += self.p_regular.nbytes + self.p_spam.nbytes + self.in_vocab.nbytes
+        return nbytes
+
+    def bucket(self, term):
+        """
+        :param term: A term
+        :return: The bucket of the term
+        """
+        return zlib.crc32(term.encode('utf-8')) % self.size
+
+    def lookup(self, term):
+        """
+        :param term: The term to look up
+        :return: Bucket of the term, or -1 if the bucket is not part of the vocabulary
+        """
+        bucket = self.bucket(term)
+        if self.in_vocab is None:
+            return bucket if self.counts_regular[bucket] + self.counts_spam[bucket] >= self.minimum_frequency else -1
+        return bucket if self.in_vocab[bucket] else -1
+
+    def get(self, term, default=None):
+        """
+        Look up a term in the vocabulary.
+
+        :param term: The term to look up
+        :param default: Value returned if the term is not in the vocabulary
+        :return: VocabEntry of the term's bucket, or default
+        """
+        bucket = self.lookup(term)
+        if bucket < 0:
+            return default
+        return VocabEntry(self, bucket)
+
+    def add(self, term, spam=False, count=1):
+        """
+        Increment the frequency count of a term's bucket, depending on whether it occurred in a regular or spam
+        message.
+
+        :param term: The term to count
+        :param spam: Set to True if the term occurred in a spam message
+        :param count: Number of occurrences to add
+        :return: The bucket of the term
+        """
+        bucket = self.bucket(term)
+        if spam:
+            self.counts_spam[bucket] += count
+            self.n_words_spam += count
+        else:
+            self.counts_regular[bucket] += count
+            self.n_words_regular += count
+        self.p_regular = self.p_spam = self.in_vocab = None
+        return bucket
+
+    def add_tokens(self, tokens, spam=False):
+        """
+        Count every token of a stream of tokens which occurred in a regular or spam message.
+
+        :param tokens: Iterable of tokens
+        :param spam: Set to True if the tokens occurred in a spam message
+        :return: None
+        """
+        counts = self.counts_spam if spam else self.counts_regular
+        size = self.size
+        crc32 = zlib.crc32
+        n_tokens = 0
+        for token in tokens:
+            counts[crc32(token.encode('utf-8')) % size] += 1
+            n_tokens += 1
+        if spam:
+            self.n_words_spam += n_tokens
+        else:
+            self.n_words_regular += n_tokens
+        self.p_regular = self.p_spam = self.in_vocab = None
+
+    def compute_probabilities(self):
+        """
+        Compute the class conditional log-probabilities (base 10) of every bucket in the vocabulary. Zero
+        probabilities are replaced by a small estimated value, and buckets outside of the vocabulary get a
+        log-probability of zero.
+
+        :return: None
+        """
+        counts_regular = numpy.frombuffer(self.counts_regular, dtype=numpy.int64)
+        counts_spam = numpy.frombuffer(self.counts_spam, dtype=numpy.int64)
+        self.in_vocab = counts_regular + counts_spam >= max(self.minimum_frequency, 1)
+
+        ## Count total number of words in the vocabulary contained in regular/spam mail
+        n_words_regular = int(counts_regular[self.in_vocab].sum())
+        n_words_spam = int(counts_spam[self.in_vocab].sum())
+        p_zero = numpy.log10(self.epsilon / max(n_words_regular + n_words_spam, 1))
+
+        with numpy.errstate(divide='ignore'):
+            self.p_regular = numpy.where(counts_regular > 0, numpy.log10(counts_regular / max(n_words_regular, 1)),
+                                         p_zero)
+            self.p_spam = numpy.where(counts_spam > 0, numpy.log10(counts_spam / max(n_words_spam, 1)), p_zero)
+        self.p_regular[~self.in_vocab] = 0
+        self.p_spam[~self.in_vocab] = 0
+
+    def priors(self):
+        """
+        :return: Tuple of the log a priori probabilities (base 10) of a regular and a spam message
+        """
+        n_messages = self.n_messages_regular + self.n_messages_spam
+        return numpy.log10(self.n_messages_regular / n_messages), numpy.log10(self.n_messages_spam / n_messages)
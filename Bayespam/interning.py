@@ -0,0 +1,314 @@
+"""interning.py -- integer id pipeline for the bigram spam filter.
+
+Every distinct word is interned once in a TokenTable, which maps it to an integer id, so a message becomes an
+array of word ids. A bigram is the pair of its word ids packed into a single int64 (the first id in the high 32
+bits), so pairing the words, filtering the bigrams by length, counting them (numpy.unique), looking them up in
+the vocabulary (numpy.searchsorted) and scoring messages all operate on integer arrays. Bigram strings are only
+built again to write the vocabulary.
+
+InternedBigrams is the vocabulary of bayespam.Bayespam when it pairs words into non-overlapping bigrams with
+interned ids (bayespam.py --ngrams pairs --interned); the tokens of a message are then its packed bigrams."""
+
+import io
+import sys
+from array import array
+
+import numpy
+
+from tokenizer import tokenize_lines
+
+## Number of bits of the second word id of a packed bigram
+ID_BITS = 32
+ID_MASK = (1 << ID_BITS) - 1
+
+
+class TokenTable:
+    def __init__(self):
+        ## Maps each word to its id
+        self.ids = {}
+        ## Maps each id back to its word
+        self.tokens = []
+        ## Length of every word, and whether it is empty or whitespace only, indexed by id
+        self.lengths = array('q')
+        self.blank = array('b')
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def intern(self, tokens):
+        """
+        Map a stream of words to their ids, adding the words which are not in the table yet.
+
+        :param tokens: Iterable of words
+        :return: NumPy int64 array of word ids
+        """
+        tokens = tokens if isinstance(tokens, list) else list(tokens)
+        ## Look up all words at once, and only add the new ones one at a time
+        word_ids = list(map(self.ids.get, tokens))
+        if None in word_ids:
+            for i, id in enumerate(word_ids):
+                if id is None:
+                    word_ids[i] = self.add(tokens[i])
+        return numpy.array(word_ids, dtype=numpy.int64)
+
+    def add(self, token):
+        """
+        :param token: A word
+        :return: Id of the word, which is added to the table if it is not in it yet
+        """
+        id = self.ids.get(token)
+        if id is None:
+            if len(self.tokens) > ID_MASK:
+                raise OverflowError("more than %d distinct words" % (ID_MASK + 1))
+            id = self.ids[token] = len(self.tokens)
+            self.tokens.append(token)
+            self.lengths.append(len(token))
+            self.blank.append(token == "" or token.isspace())
+        return id
+
+    def bigram(self, key):
+        """
+        :param key: Packed bigram
+        :return: The bigram as a string
+        """
+        return self.tokens[key >> ID_BITS] + " " + self.tokens[key & ID_MASK]
+
+
+def pack_bigrams(word_ids, table, min_length=6, skip_empty=True):
+    """
+    Group the words of a message into non-overlapping bigrams, like tokenizer.pair_tokens, and pack them.
+
+    :param word_ids: NumPy int64 array of the word ids of a message
+    :param table: TokenTable of the word ids
+    :param min_length: Minimum length of a bigram (including the separating space)
+    :param skip_empty: Set to False to also pair empty and whitespace-only words
+    :return: NumPy int64 array of packed bigrams
+    """
+    if skip_empty and len(word_ids):
+        word_ids = word_ids[numpy.frombuffer(table.blank, dtype=numpy.int8)[word_ids] == 0]
+    n = len(word_ids) // 2 * 2
+    first, second = word_ids[0:n:2], word_ids[1:n:2]
+    lengths = numpy.frombuffer(table.lengths, dtype=numpy.int64) if len(table) else numpy.zeros(0, numpy.int64)
+    keep = lengths[first] + lengths[second] + 1 >= min_length
+    return (first[keep] << ID_BITS) | second[keep]
+
+
+class BigramCounts:
+    """The counts of packed bigrams in regular and spam messages. The bigrams of the messages are collected in
+    arrays, and counted and merged into the sorted counts in batches of at least batch_size bigrams."""
+
+    def __init__(self, batch_size=1 << 20):
+        self.batch_size = batch_size
+        ## Sorted distinct bigrams with their counts in regular and spam messages
+        self.keys = numpy.zeros(0, dtype=numpy.int64)
+        self.counts_regular = numpy.zeros(0, dtype=numpy.int64)
+        self.counts_spam = numpy.zeros(0, dtype=numpy.int64)
+        ## Bigrams not merged yet, per message type
+        self.pending = {False: [], True: []}
+        self.n_pending = 0
+
+    def add(self, keys, spam=False):
+        """
+        :param keys: NumPy array of the packed bigrams of a message
+        :param spam: Set to True if the message is spam
+        :return: None
+        """
+        self.pending[spam].append(keys)
+        self.n_pending += len(keys)
+        if self.n_pending >= self.batch_size:
+            self.merge()
+
+    def merge(self):
+        """
+        Merge the pending bigrams into the sorted counts.
+
+        :return: None
+        """
+        if not self.n_pending:
+            return
+        for spam in (False, True):
+            if self.pending[spam]:
+                keys, counts = numpy.unique(numpy.concatenate(self.pending[spam]), return_counts=True)
+                self.insert(keys, counts.astype(numpy.int64), spam)
+                self.pending[spam] = []
+        self.n_pending = 0
+
+    def insert(self, keys, counts, spam):
+        """
+        Add counts to the sorted counts in place, inserting the bigrams which are new. Only a few arrays of the
+        size of the vocabulary are allocated, unlike sorting all bigrams again.
+
+        :param keys: Sorted NumPy array of distinct packed bigrams
+        :param counts: NumPy int64 array with the count of every bigram
+        :param spam: Set to True if the counts are of spam messages
+        :return: None
+        """
+        index = numpy.searchsorted(self.keys, keys)
+        found = index < len(self.keys)
+        found[found] = self.keys[index[found]] == keys[found]
+        (self.counts_spam if spam else self.counts_regular)[index[found]] += counts[found]
+
+        missing = ~found
+        index, keys, counts = index[missing], keys[missing], counts[missing]
+        zeros = numpy.zeros(len(keys), dtype=numpy.int64)
+        self.keys = numpy.insert(self.keys, index, keys)
+        self.counts_regular = numpy.insert(self.counts_regular, index, zeros if spam else counts)
+        self.counts_spam = numpy.insert(self.counts_spam, index, counts if spam else zeros)
+
+
+class InternedBigrams:
+    """Counts and scores packed bigrams. The vocabulary holds the bigrams which occur at least minimum_frequency
+    times, with the same log-probabilities as vocabulary.Vocabulary."""
+
+    def __init__(self, min_length=6, minimum_frequency=5):
+        self.min_length = min_length
+        self.minimum_frequency = minimum_frequency
+        ## Smoothing value of the zero probabilities
+        self.epsilon = sys.float_info.epsilon
+        self.table = TokenTable()
+        self.counts = BigramCounts()
+
+        ## Number of bigrams and messages of each class
+        self.n_words_regular = 0
+        self.n_words_spam = 0
+        self.n_messages_regular = 0
+        self.n_messages_spam = 0
+
+        ## Sorted bigrams of the vocabulary, with their counts and log-probabilities (set by compute_probabilities)
+        self.keys = None
+        self.counts_regular = None
+        self.counts_spam = None
+        self.p_regular = None
+        self.p_spam = None
+
+    def __len__(self):
+        return 0 if self.keys is None else len(self.keys)
+
+    def read_words(self, file):
+        """
+        :param file: File path of a message
+        :return: List of the words of the message, the tokens which are paired into bigrams
+        """
+        ## Make sure to use latin1 encoding, otherwise it will be unable to read some of the messages
+        with open(file, 'r', encoding='latin1') as f:
+            return list(tokenize_lines(f, 0))
+
+    def text_words(self, text):
+        """
+        :param text: A message which is already in memory, with '\\n' line endings
+        :return: List of the words of the message, split into lines like read_words splits the file
+        """
+        return list(tokenize_lines(io.StringIO(text), 0))
+
+    def read_file(self, file, skip_empty=True, words=None):
+        """
+        :param file: File path of the message
+        :param skip_empty: Set to False to also pair empty and whitespace-only words
+        :param words: The words of the message if they were already read (e.g. from a token cache)
+        :return: NumPy array of the packed bigrams of the message
+        """
+        return self.pack(self.read_words(file) if words is None else words, skip_empty)
+
+    def pack(self, words, skip_empty=True):
+        """
+        :param words: List of the words of a message
+        :param skip_empty: Set to False to also pair empty and whitespace-only words
+        :return: NumPy array of the packed bigrams of the message
+        """
+        return pack_bigrams(self.table.intern(words), self.table, self.min_length, skip_empty)
+
+    def add_tokens(self, keys, spam=False):
+        """
+        Count the packed bigrams of a training message.
+
+        :param keys: NumPy array of packed bigrams
+        :param spam: Set to True if the message is spam
+        :return: None
+        """
+        self.counts.add(keys, spam)
+        if spam:
+            self.n_words_spam += len(keys)
+        else:
+            self.n_words_regular += len(keys)
+
+    def select(self):
+        """
+        Select the bigrams which occur at least minimum_frequency times into the vocabulary.
+
+        :return: None
+        """
+        counts = self.counts
+        counts.merge()
+        frequent = counts.counts_regular + counts.counts_spam >= self.minimum_frequency
+        self.keys = counts.keys[frequent]
+        self.counts_regular = counts.counts_regular[frequent]
+        self.counts_spam = counts.counts_spam[frequent]
+
+    def compute_probabilities(self):
+        """
+        Select the frequent bigrams and compute their class conditional log-probabilities. Zero probabilities are
+        replaced by a small estimated value.
+
+        :return: None
+        """
+        self.select()
+
+        n_words_regular = int(self.counts_regular.sum())
+        n_words_spam = int(self.counts_spam.sum())
+        zero = numpy.log10(self.epsilon / max(n_words_regular + n_words_spam, 1))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            self.p_regular = numpy.where(self.counts_regular > 0,
+                                         numpy.log10(self.counts_regular / max(n_words_regular, 1)), zero)
+            self.p_spam = numpy.where(self.counts_spam > 0, numpy.log10(self.counts_spam / max(n_words_spam, 1)),
+                                      zero)
+
+    def lookup(self, keys):
+        """
+        :param keys: NumPy array of packed bigrams
+        :return: NumPy array of the vocabulary index of every bigram which is in the vocabulary
+        """
+        if not len(self.keys):
+            return numpy.zeros(0, dtype=numpy.int64)
+        index = numpy.searchsorted(self.keys, keys)
+        index[index == len(self.keys)] = 0
+        return index[self.keys[index] == keys]
+
+    def score(self, keys):
+        """
+        :param keys: NumPy array of the packed bigrams of a message
+        :return: Tuple of the sums of the regular and spam log-probabilities of the bigrams in the vocabulary
+        """
+        index = self.lookup(keys)
+        return float(self.p_regular[index].sum()), float(self.p_spam[index].sum())
+
+    def classify_batch(self, messages, prior_regular, prior_spam):
+        """
+        Classify a batch of messages, like scoring.classify_batch.
+
+        :param messages: Iterable of messages, each a NumPy array of packed bigrams
+        :param prior_regular: Log a priori probability of a regular message
+        :param prior_spam: Log a priori probability of a spam message
+        :return: Tuple of NumPy arrays: regular and spam log probabilities, and whether each message is spam
+        """
+        scores = numpy.array([self.score(keys) for keys in messages], dtype=numpy.float64).reshape(-1, 2)
+        p_regular = prior_regular + scores[:, 0]
+        p_spam = prior_spam + scores[:, 1]
+        return p_regular, p_spam, ~(p_regular > p_spam)
+
+    def priors(self):
+        """
+        :return: Tuple of the log a priori probabilities (base 10) of a regular and a spam message
+        """
+        n_messages = self.n_messages_regular + self.n_messages_spam
+        return numpy.log10(self.n_messages_regular / n_messages), numpy.log10(self.n_messages_spam / n_messages)
+
+    def items(self):
+        """
+        Generate (bigram, regular count, spam count) entries of the vocabulary, sorted by packed bigram.
+        """
+        if self.keys is None or self.counts.n_pending:
+            self.select()
+        bigram = self.table.bigram
+        for key, count_regular, count_spam in zip(self.keys.tolist(), self.counts_regular.tolist(),
+                                                  self.counts_spam.tolist()):
+            yield bigram(key), count_regular, count_spam
@@ -0,0 +1,101 @@
+"""loadgen.py -- load generator for the classification daemon (server.py).
+
+Sends the messages of a data directory to a running server from a number of concurrent connections, and
+reports the client-side p50/p99 latency and throughput, followed by the statistics of the server.
+
+Usage: python loadgen.py [<path>] [--unix PATH | --port PORT] [--connections N] [--requests N]"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import numpy
+
+
+async def request(reader, writer, method, path, body=b''):
+    """
+    Send a single HTTP request over an open connection and read the JSON response.
+    """
+    writer.write(b'%s %s HTTP/1.1\r\nHost: localhost\r\nContent-Length: %d\r\n\r\n'
+                 % (method.encode('latin1'), path.encode('latin1'), len(body)) + body)
+    await writer.drain()
+    await reader.readline()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin1').partition(":")
+        if name.lower() == 'content-length':
+            length = int(value)
+    return json.loads(await reader.readexactly(length))
+
+
+async def connect(args):
+    if args.unix is not None:
+        return await asyncio.open_unix_connection(args.unix)
+    return await asyncio.open_connection('127.0.0.1', args.port)
+
+
+async def client(args, messages, offset, latencies, labels):
+    """
+    Send messages round-robin over one connection until args.requests requests have been sent in total.
+    """
+    reader, writer = await connect(args)
+    for i in range(offset, args.requests, args.connections):
+        msg, body = messages[i % len(messages)]
+        start = time.perf_counter()
+        response = await request(reader, writer, 'POST', '/classify', body)
+        latencies.append(time.perf_counter() - start)
+        labels[msg] = response['label']
+    writer.close()
+
+
+async def run(args, messages):
+    latencies = []
+    labels = {}
+    start = time.perf_counter()
+    await asyncio.gather(*(client(args, messages, i, latencies, labels) for i in range(args.connections)))
+    elapsed = time.perf_counter() - start
+
+    p50, p99 = numpy.percentile(numpy.array(latencies) * 1e3, [50, 99])
+    print("%d requests over %d connections in %.3f s" % (len(latencies), args.connections, elapsed))
+    print("throughput %10.1f requests/sec" % (len(latencies) / elapsed))
+    print("latency    p50 %.3f ms   p99 %.3f ms" % (p50, p99))
+
+    n_spam = sum(label == 'spam' for label in labels.values())
+    print("%d distinct messages: %d regular, %d spam" % (len(labels), len(labels) - n_spam, n_spam))
+
+    reader, writer = await connect(args)
+    print("server:", json.dumps(await request(reader, writer, 'GET', '/stats')))
+    writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', type=str, nargs='?', default='test',
+                        help='File path of the directory containing the regular and spam messages to send')
+    parser.add_argument('--unix', type=str, default=None,
+                        help='Unix domain socket of the server')
+    parser.add_argument('--port', type=int, default=8025,
+                        help='Port of the server on localhost')
+    parser.add_argument('--connections', type=int, default=16,
+                        help='Number of concurrent connections')
+    parser.add_argument('--requests', type=int, default=2000,
+                        help='Total number of requests')
+    args = parser.parse_args()
+
+    messages = []
+    for folder in ('regular', 'spam'):
+        folder_path = os.path.join(args.path, folder)
+        for msg in sorted(os.listdir(folder_path)):
+            with open(os.path.join(folder_path, msg), 'rb') as f:
+                messages.append((os.path.join(folder_path, msg), f.read()))
+
+    asyncio.run(run(args, messages))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""mail_sources.py -- streaming readers for the message sources understood by classify.py.
+
+Every reader is a generator of (key, lines) pairs, one per message, where key identifies the message in the
+output and lines is the list of lines of that message. Only a single message is held in memory at a time, so
+multi-GB mbox files and large maildirs are processed with constant memory."""
+
+import itertools
+import os
+import re
+import sys
+
+## Quoted "From " lines in the body of an mbox message (mboxrd format)
+QUOTED_FROM = re.compile(r'^>+From ')
+
+
+def split_mbox(lines, name):
+    """
+    Split the lines of an mbox stream into messages. Every line starting with "From " starts a new message
+    (such lines in a message body are quoted as ">From "). Like the .msg files of the data sets, every message
+    includes its "From " line.
+
+    :param lines: Iterable of lines
+    :param name: Name of the mbox used in the keys of the messages
+    :return: Generator of (key, lines) pairs
+    """
+    message = None
+    n_messages = 0
+    for line in lines:
+        if line.startswith("From "):
+            if message is not None:
+                yield "%s:%d" % (name, n_messages), message
+            n_messages += 1
+            message = [line]
+        elif message is not None:
+            message.append(line[1:] if QUOTED_FROM.match(line) else line)
+    if message is not None:
+        yield "%s:%d" % (name, n_messages), message
+
+
+def read_mbox(path):
+    """
+    Stream the messages of an mbox file.
+
+    :param path: File path of the mbox
+    :return: Generator of (key, lines) pairs
+    """
+    ## Make sure to use latin1 encoding, otherwise it will be unable to read some of the messages
+    with open(path, 'r', encoding='latin1') as f:
+        yield from split_mbox(f, path)
+
+
+def read_message_file(path):
+    """
+    Read a single message file.
+
+    :param path: File path of the message
+    :return: Generator of a single (key, lines) pair
+    """
+    with open(path, 'r', encoding='latin1') as f:
+        yield path, f.readlines()
+
+
+def read_maildir(path):
+    """
+    Stream the messages in the 'new' and 'cur' folders of a maildir, in order of file name.
+
+    :param path: File path of the maildir
+    :return: Generator of (key, lines) pairs
+    """
+    for folder in ('new', 'cur'):
+        folder_path = os.path.join(path, folder)
+        if not os.path.isdir(folder_path):
+            continue
+        for msg in sorted(entry.name for entry in os.scandir(folder_path) if entry.is_file()):
+            yield from read_message_file(os.path.join(folder_path, msg))
+
+
+def read_stdin():
+    """
+    Stream the messages on standard input: an mbox if the input starts with a "From " line, and a single
+    message otherwise.
+
+    :return: Generator of (key, lines) pairs
+    """
+    stdin = open(sys.stdin.fileno(), 'r', encoding='latin1', closefd=False)
+    first_line = stdin.readline()
+    if first_line.startswith("From "):
+        yield from split_mbox(itertools.chain([first_line], stdin), '<stdin>')
+    elif first_line:
+        yield '<stdin>', [first_line] + stdin.readlines()
+
@@ -0,0 +1,226 @@
+"""message.py -- header and MIME aware tokenizing of messages.
+
+The tokenizers of tokenizer.py treat a message as flat text, so routing headers, base64 attachments and HTML
+markup are tokenized like the words of the message. Here a message is split into its header fields and body
+first (folded header lines are joined), and multipart bodies are split into their parts:
+    header fields   only the fields in HEADER_FIELDS are tokenized, and every token is prefixed with the lower case
+                    field name ("subject:viagra"), so it is counted separately from the same word in the body
+    text parts      text/plain and text/html parts are decoded (quoted-printable, base64) only when they are
+                    tokenized; HTML tags are removed, but the link targets in them are kept
+    other parts     attachments, images, etc. are never decoded; only their content type is counted as a token
+                    ("content-type:application/pdf")
+
+The n-grams of every header field and of every text part are formed separately."""
+
+import binascii
+import html
+import re
+
+from tokenizer import text_ngrams
+
+## Header fields whose values are tokenized
+HEADER_FIELDS = frozenset(['from', 'to', 'cc', 'reply-to', 'subject', 'x-mailer', 'user-agent'])
+## Content types of which the text is tokenized
+TEXT_TYPES = frozenset(['text/plain', 'text/html', 'text/enriched'])
+
+BOUNDARY = re.compile(r'boundary\s*=\s*"?([^";]+)"?', re.IGNORECASE)
+CHARSET = re.compile(r'charset\s*=\s*"?([^";\s]+)"?', re.IGNORECASE)
+## HTML comments, and style and script elements together with their contents
+HTML_NOISE = re.compile(r'<!--.*?-->|<(style|script)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+HTML_TAG = re.compile(r'<[^>]*>')
+LINK = re.compile(r'''(?:href|src)\s*=\s*["']?([^"'\s>]+)''', re.IGNORECASE)
+
+
+def parse_headers(text):
+    """
+    :param text: The header section of a message or part
+    :return: List of (lower case field name, value) pairs, in order
+    """
+    headers = []
+    for line in text.split('\n'):
+        if line[:1] in (' ', '\t'):
+            ## A folded line continues the value of the previous field
+            if headers:
+                name, value = headers[-1]
+                headers[-1] = (name, value + ' ' + line.strip())
+        else:
+            name, colon, value = line.partition(':')
+            name = name.strip()
+            ## Skips the "From " line of mbox messages, whose "name" contains spaces
+            if colon and name and ' ' not in name:
+                headers.append((name.lower(), value.strip()))
+    return headers
+
+
+def split_headers(text):
+    """
+    :param text: A message or part, with '\\n' line endings
+    :return: Tuple of the parsed header fields and the body
+    """
+    if text.startswith('\n'):
+        return [], text[1:]
+    header_text, _, body = text.partition('\n\n')
+    return parse_headers(header_text), body
+
+
+class Part:
+    """A leaf part of a message (or a whole single part message). Its body is decoded on first use of text."""
+
+    def __init__(self, headers, body):
+        self.headers = headers
+        self.raw_body = body
+        content_type = header_value(headers, 'content-type', 'text/plain')
+        self.content_type = content_type.split(';', 1)[0].strip().lower()
+        match = CHARSET.search(content_type)
+        self.charset = match.group(1).lower() if match else 'latin1'
+        self.encoding = header_value(headers, 'content-transfer-encoding', '7bit').strip().lower()
+        self._text = None
+
+    @property
+    def is_text(self):
+        return self.content_type in TEXT_TYPES
+
+    @property
+    def text(self):
+        """
+        The decoded text of the part, with the HTML markup removed.
+        """
+        if self._text is None:
+            self._text = self.decode()
+        return self._text
+
+    def decode(self):
+        body = self.raw_body
+        if self.encoding in ('quoted-printable', 'base64'):
+            data = body.encode('latin1', 'replace')
+            try:
+                data = binascii.a2b_qp(data) if self.encoding == 'quoted-printable' else binascii.a2b_base64(data)
+            except (binascii.Error, ValueError):
+                return ""
+            try:
+                body = data.decode(self.charset, 'replace')
+            except (LookupError, UnicodeError):
+                ## Unknown charsets, and codecs such as idna which fail even with errors='replace'
+                body = data.decode('latin1')
+            body = body.replace('\r\n', '\n')
+        if self.content_type == 'text/html':
+            body = HTML_NOISE.sub(' ', body)
+            body = HTML_TAG.sub(lambda match: ' %s ' % ' '.join(LINK.findall(match.group())), body)
+            body = html.unescape(body)
+        return body
+
+
+def header_value(headers, name, default=None):
+    for field, value in headers:
+        if field == name:
+            return value
+    return default
+
+
+def split_multipart(body, boundary):
+    """
+    Split a multipart body at its delimiter lines ("--boundary"). Everything before the first delimiter (the
+    preamble) and after the closing delimiter ("--boundary--", the epilogue) is dropped. The delimiters are found
+    with str.find, which is much faster than a multiline regular expression on bodies with large attachments.
+
+    :param body: The body of a multipart message or part
+    :param boundary: The boundary parameter of its content type
+    :return: List of the sections between the delimiters
+    """
+    text = '\n' + body
+    delimiter = '\n--' + boundary
+    sections = []
+    start = None
+    position = text.find(delimiter)
+    while position >= 0:
+        end = text.find('\n', position + 1)
+        if end < 0:
+            end = len(text)
+        ## Only the rest of a delimiter line is blank (or -- for the closing delimiter)
+        rest = text[position + len(delimiter):end].strip(' \t')
+        if rest in ('', '--'):
+            if start is not None:
+                sections.append(text[start:position])
+            if rest == '--':
+                return sections
+            start = end + 1
+        position = text.find(delimiter, end)
+    ## A missing closing delimiter ends the last section at the end of the body
+    if start is not None:
+        sections.append(text[start:])
+    return sections
+
+
+def parse_parts(headers, body, parts, depth=0):
+    """
+    Split a body into its leaf parts, recursively.
+
+    :param headers: The header fields belonging to the body
+    :param body: The body
+    :param parts: List the parts are appended to
+    :param depth: Nesting level, which is limited to avoid runaway recursion on malformed messages
+    :return: None
+    """
+    content_type = header_value(headers, 'content-type', 'text/plain')
+    media_type = content_type.split(';', 1)[0].strip().lower()
+    if media_type.startswith('multipart/') and depth < 10:
+        match = BOUNDARY.search(content_type)
+        if match is not None:
+            for section in split_multipart(body, match.group(1).strip()):
+                parse_parts(*split_headers(section), parts, depth + 1)
+            return
+    if media_type == 'message/rfc822' and depth < 10:
+        parse_parts(*split_headers(body), parts, depth + 1)
+        return
+    parts.append(Part(headers, body))
+
+
+def parse_message(text):
+    """
+    :param text: A complete message
+    :return: Tuple of the header fields of the message and the list of its leaf parts
+    """
+    headers, body = split_headers(text.replace('\r\n', '\n'))
+    parts = []
+    parse_parts(headers, body, parts)
+    return headers, parts
+
+
+def message_tokens(text, orders=(1,), min_word_size=4, min_ngram_size=6, header_fields=HEADER_FIELDS):
+    """
+    Generate the n-grams of the header fields and text parts of a message.
+
+    :param text: A complete message
+    :param orders: The n-gram orders to generate (see tokenizer.ngrams)
+    :param min_word_size: Minimum length of a unigram (excluding the field name prefix)
+    :param min_ngram_size: Minimum length of a higher order n-gram
+    :param header_fields: Names of the header fields to tokenize
+    :return: Generator of n-grams
+    """
+    headers, parts = parse_message(text)
+    for name, value in headers:
+        if name in header_fields:
+            prefix = name + ':'
+            for ngram in text_ngrams(value, orders, min_word_size, min_ngram_size):
+                yield prefix + ngram
+    for part in parts:
+        if part.is_text:
+            yield from text_ngrams(part.text, orders, min_word_size, min_ngram_size)
+        else:
+            yield 'content-type:' + part.content_type
+
+
+def read_message_tokens(file, orders=(1,), min_word_size=4, min_ngram_size=6):
+    """
+    Stream the n-grams of the header fields and text parts of a message file.
+
+    :param file: File path of the message
+    :param orders: The n-gram orders to generate
+    :param min_word_size: Minimum length of a unigram
+    :param min_ngram_size: Minimum length of a higher order n-gram
+    :return: Generator of n-grams
+    """
+    ## Make sure to use latin1 encoding, otherwise it will be unable to read some of the messages
+    with open(file, 'r', encoding='latin1') as f:
+        text = f.read()
+    return message_tokens(text, orders, min_word_size, min_ngram_size)
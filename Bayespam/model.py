@@ -0,0 +1,284 @@
+"""model.py -- binary, memory-mappable file format for trained spam filter models.
+
+A model file contains the a priori class probabilities, the term table and the class conditional
+log-likelihoods of every term. It is opened with mmap, so a scoring process starts without re-reading the
+training corpus and processes opening the same model share a single copy of it in the page cache.
+
+Layout (little endian, every section aligned to 8 bytes):
+    header       magic, version, n-gram orders (bit n set for order n), minimum word size, minimum n-gram size,
+                 number of terms, number of hash slots, log prior regular, log prior spam, flags (FLAG_PARSE_MIME)
+    likelihoods  float64[2][n_terms]   log-likelihoods of every term (regular row, spam row)
+    counts       int64[2][n_terms]     frequency counts of every term (regular row, spam row)
+    slots        int64[n_slots]        open addressing hash table of term ids (-1 for an empty slot)
+    offsets      int64[n_terms + 1]    start of every term in the term data
+    terms        bytes                 UTF-8 encoded terms, concatenated"""
+
+import mmap
+import os
+import struct
+import sys
+import zlib
+from collections import Counter
+from itertools import accumulate
+
+import numpy
+
+MAGIC = b'BAYESPAM'
+VERSION = 2
+HEADER = struct.Struct('<8sIHBBQQddI4x')
+## Version 1 headers have no flags
+HEADER_V1 = struct.Struct('<8sIHBBQQdd')
+## Set if the messages are tokenized by message.py, as separate header fields and MIME parts
+FLAG_PARSE_MIME = 1
+
+
+def term_hash(term):
+    """
+    Hash function of the term table. Unlike hash(), it does not change between Python processes.
+
+    :param term: UTF-8 encoded term
+    :return: Unsigned 32-bit hash
+    """
+    return zlib.crc32(term)
+
+
+def save_model(destination_fp, vocab, prior_regular, prior_spam, orders=(1,), min_word_size=4, min_ngram_size=6,
+               parse_mime=False):
+    """
+    Write a trained vocabulary to a model file. The file is written next to its destination first and then
+    renamed, so processes never open a partially written model.
+
+    :param destination_fp: Destination file path of the model
+    :param vocab: Vocabulary with computed probabilities
+    :param prior_regular: Log a priori probability of a regular message
+    :param prior_spam: Log a priori probability of a spam message
+    :param orders: The n-gram orders of the vocabulary
+    :param min_word_size: Minimum length of a unigram
+    :param min_ngram_size: Minimum length of a higher order n-gram
+    :param parse_mime: Set to True if the vocabulary was tokenized by message.py
+    :return: None
+    """
+    n_terms = len(vocab)
+    terms = [term.encode('utf-8') for term in vocab.terms]
+
+    ## Keep the hash table at most half full
+    n_slots = 1
+    while n_slots < 2 * n_terms:
+        n_slots *= 2
+    slots = [-1] * n_slots
+    for id, term in enumerate(terms):
+        slot = term_hash(term) & (n_slots - 1)
+        while slots[slot] >= 0:
+            slot = (slot + 1) & (n_slots - 1)
+        slots[slot] = id
+    slots = numpy.array(slots, dtype='<i8')
+
+    offsets = numpy.zeros(n_terms + 1, dtype='<i8')
+    offsets[1:] = numpy.cumsum([len(term) for term in terms])
+    likelihoods = numpy.array([vocab.p_regular, vocab.p_spam], dtype='<f8').reshape(2, n_terms)
+    counts = numpy.array([numpy.asarray(vocab.counts_regular), numpy.asarray(vocab.counts_spam)],
+                         dtype='<i8').reshape(2, n_terms)
+
+    temporary_fp = destination_fp + '.tmp'
+    with open(temporary_fp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, sum(1 << n for n in orders), min_word_size, min_ngram_size,
+                            n_terms, n_slots, prior_regular, prior_spam, FLAG_PARSE_MIME if parse_mime else 0))
+        f.write(likelihoods.tobytes())
+        f.write(counts.tobytes())
+        f.write(slots.tobytes())
+        f.write(offsets.tobytes())
+        f.write(b''.join(terms))
+    os.replace(temporary_fp, destination_fp)
+
+
+class Model:
+    """A trained model opened from a model file with mmap. Scalar lookups go through memoryviews of the
+    mapped file, while the likelihood and count arrays are exposed as NumPy arrays for vectorized scoring."""
+
+    def __init__(self, model_fp):
+        with open(model_fp, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version = struct.unpack_from('<8sI', self.mm)
+        if magic != MAGIC or version not in (1, VERSION):
+            self.mm.close()
+            raise ValueError("%s is not a version 1 or %d Bayespam model file" % (model_fp, VERSION))
+        header = HEADER if version == VERSION else HEADER_V1
+        (_, _, orders, min_word_size, min_ngram_size, n_terms, n_slots, self.prior_regular, self.prior_spam,
+         *flags) = header.unpack_from(self.mm)
+        flags = flags[0] if flags else 0
+        ## The tokenizer settings of the vocabulary (models without them were trained on words of length >= 4)
+        self.orders = tuple(n for n in range(1, 16) if orders >> n & 1) or (1,)
+        self.min_word_size = min_word_size or 4
+        self.min_ngram_size = min_ngram_size or 6
+        ## Whether messages are tokenized by message.py instead of as flat text
+        self.parse_mime = bool(flags & FLAG_PARSE_MIME)
+        self.n_terms = n_terms
+        self.n_slots = n_slots
+
+        offset = header.size
+        self.likelihoods = numpy.frombuffer(self.mm, dtype='<f8', count=2 * n_terms, offset=offset).reshape(2, n_terms)
+        self.p_regular, self.p_spam = self.likelihoods
+        offset += 16 * n_terms
+        self.counts = numpy.frombuffer(self.mm, dtype='<i8', count=2 * n_terms, offset=offset).reshape(2, n_terms)
+        offset += 16 * n_terms
+
+        view = memoryview(self.mm)
+        self.likelihood_view = view[header.size:header.size + 16 * n_terms].cast('d')
+        self.slots = view[offset:offset + 8 * n_slots].cast('q')
+        offset += 8 * n_slots
+        self.offsets = view[offset:offset + 8 * (n_terms + 1)].cast('q')
+        offset += 8 * (n_terms + 1)
+        self.term_data = view[offset:]
+
+        ## Ids of the n_heavy terms with the largest |log-odds| by term, and bounds on the contribution of a single
+        ## token, used by classify (computed on first use)
+        self.n_heavy = 65536
+        self.heavy = None
+        self.light_delta = None
+        self.max_magnitude = None
+
+    def __len__(self):
+        return self.n_terms
+
+    def __contains__(self, term):
+        return self.lookup(term) >= 0
+
+    def close(self):
+        """
+        Release the memory mapping. The model can not be used afterwards.
+
+        :return: None
+        """
+        self.likelihoods = self.p_regular = self.p_spam = self.counts = None
+        for view in (self.likelihood_view, self.slots, self.offsets, self.term_data):
+            view.release()
+        self.mm.close()
+
+    def term(self, id):
+        """
+        :param id: Id of a term
+        :return: The term with the given id
+        """
+        return bytes(self.term_data[self.offsets[id]:self.offsets[id + 1]]).decode('utf-8')
+
+    def lookup(self, term):
+        """
+        Find the id of a term in the hash table.
+
+        :param term: The term to look up
+        :return: Id of the term, or -1 if it is not in the model
+        """
+        term = term.encode('utf-8')
+        mask = self.n_slots - 1
+        slot = term_hash(term) & mask
+        while True:
+            id = self.slots[slot]
+            if id < 0 or self.term_data[self.offsets[id]:self.offsets[id + 1]] == term:
+                return id
+            slot = (slot + 1) & mask
+
+    def score(self, tokens):
+        """
+        Compute the log a posteriori probabilities of a message (up to the same constant).
+
+        :param tokens: Iterable of the message's tokens
+        :return: Tuple of the regular and spam log probabilities
+        """
+        p_regular = self.prior_regular
+        p_spam = self.prior_spam
+        likelihoods = self.likelihood_view
+        for token in tokens:
+            id = self.lookup(token)
+            if id >= 0:
+                p_regular += likelihoods[id]
+                p_spam += likelihoods[self.n_terms + id]
+        return p_regular, p_spam
+
+    def log_odds(self, tokens):
+        """
+        :param tokens: Iterable of the message's tokens
+        :return: The log-odds score of the message, log10 P(spam | message) - log10 P(regular | message)
+        """
+        p_regular, p_spam = self.score(tokens)
+        return p_spam - p_regular
+
+    def classify(self, tokens, check_every=32, threshold=0.0):
+        """
+        Decide whether a message is spam, with the same decision as comparing the log-odds score of the message
+        to threshold, but stopping as soon as the remaining tokens can no longer change it.
+
+        Repeated tokens are looked up once. The tokens of the n_heavy terms with the largest |log-odds| are
+        scored first, in order of decreasing count times |log-odds|, and every other token changes the score by
+        at most light_delta, the largest |log-odds| of the remaining terms. Once the distance of the score to
+        the threshold exceeds the contributions of the remaining heavy tokens plus the number of other tokens
+        times light_delta (plus a bound on the rounding errors), the decision is final. If the score ends up too
+        close to the threshold, the message is scored again in the order of its tokens, like score does.
+
+        :param tokens: List of the message's tokens
+        :param check_every: Number of other tokens looked up between two checks of the bound
+        :param threshold: Messages whose log-odds score is at least threshold are spam (see calibration.py)
+        :return: Tuple of whether the message is spam and the number of tokens which were scored
+        """
+        if self.heavy is None:
+            delta = numpy.abs(self.p_spam - self.p_regular)
+            order = numpy.argsort(-delta, kind='stable')
+            self.heavy = {self.term(int(id)): int(id) for id in order[:self.n_heavy]}
+            self.light_delta = float(delta[order[self.n_heavy]]) if self.n_terms > self.n_heavy else 0.0
+            self.max_magnitude = float(numpy.abs(self.likelihoods).max(initial=0))
+        heavy = self.heavy
+        likelihoods = self.likelihood_view
+        n_terms = self.n_terms
+        n_tokens = len(tokens)
+        ## Both this sum and the one of score round every addition (and here every multiplication) by at most eps
+        ## times the magnitude of the sums, and the final subtractions by at most eps times their results
+        magnitude = abs(self.prior_regular) + abs(self.prior_spam) + abs(threshold) + \
+            2 * n_tokens * self.max_magnitude
+        rounding = 3 * (n_tokens + 2) * sys.float_info.epsilon * magnitude
+
+        weighted = []
+        light = []
+        n_light = 0
+        for token, count in Counter(tokens).items():
+            id = heavy.get(token)
+            if id is None:
+                light.append((count, token))
+                n_light += count
+            else:
+                weighted.append((count * abs(likelihoods[n_terms + id] - likelihoods[id]), id, count))
+        weighted.sort(reverse=True)
+        ## Largest possible change of the score by the heavy tokens from the i-th on
+        remaining_heavy = list(accumulate(weight for weight, _, _ in reversed(weighted)))[::-1] + [0.0]
+        light_delta = self.light_delta
+
+        p_regular = self.prior_regular
+        p_spam = self.prior_spam
+        n_scored = 0
+        for i, (_, id, count) in enumerate(weighted):
+            margin = p_spam - p_regular - threshold
+            if abs(margin) > remaining_heavy[i] + n_light * light_delta + rounding:
+                return margin >= 0, n_scored
+            p_regular += count * likelihoods[id]
+            p_spam += count * likelihoods[n_terms + id]
+            n_scored += count
+
+        ## The most frequent other tokens lower the bound the most
+        light.sort(key=lambda item: item[0], reverse=True)
+        lookup = self.lookup
+        for start in range(0, len(light), check_every):
+            margin = p_spam - p_regular - threshold
+            if abs(margin) > n_light * light_delta + rounding:
+                return margin >= 0, n_scored
+            for count, token in light[start:start + check_every]:
+                id = lookup(token)
+                if id >= 0:
+                    p_regular += count * likelihoods[id]
+                    p_spam += count * likelihoods[n_terms + id]
+                n_light -= count
+                n_scored += count
+
+        margin = p_spam - p_regular - threshold
+        if abs(margin) > rounding:
+            return margin >= 0, n_tokens
+        p_regular, p_spam = self.score(tokens)
+        return p_spam - p_regular >= threshold, n_tokens
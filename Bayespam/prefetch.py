@@ -0,0 +1,53 @@
+"""prefetch.py -- reading message files ahead of the tokenizer.
+
+Training and testing read every message file in turn, so on a cold page cache the tokenizer waits for the disk
+on every message. prefetch_files reads the next files with a pool of threads while the caller tokenizes the
+current one: reading a file releases the GIL, so the reads of several files and the tokenizing overlap. At most
+depth files are read ahead, which caps the memory held by the prefetched messages to depth messages, and the
+files are generated in their original order, so a vocabulary built from prefetched files is identical to one
+built by reading them one at a time."""
+
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def read_text(file):
+    """
+    :param file: File path of a message
+    :return: The text of the message, read like the tokenizers read it (latin1, universal newlines)
+    """
+    ## Make sure to use latin1 encoding, otherwise it will be unable to read some of the messages
+    with open(file, 'r', encoding='latin1') as f:
+        return f.read()
+
+
+def prefetch_files(files, threads=4, depth=64, read=read_text):
+    """
+    Read a list of files with a pool of threads, at most depth files ahead of the caller.
+
+    :param files: Iterable of file paths
+    :param threads: Number of reading threads
+    :param depth: Maximum number of files read but not yet consumed (at least 1)
+    :param read: Function reading a file path
+    :return: Generator of (file path, content) pairs, in the order of files
+    """
+    files = iter(files)
+    executor = ThreadPoolExecutor(max(1, threads), thread_name_prefix='prefetch')
+    pending = deque()
+    try:
+        for file in itertools.islice(files, max(1, depth)):
+            pending.append((file, executor.submit(read, file)))
+        while pending:
+            file, future = pending.popleft()
+            try:
+                content = future.result()
+            except Exception as e:
+                raise IOError("Error while reading message %s: %s" % (file, e)) from e
+            ## Keep the queue full before handing the content to the caller
+            for next_file in itertools.islice(files, 1):
+                pending.append((next_file, executor.submit(read, next_file)))
+            yield file, content
+    finally:
+        ## Files queued when the caller stops early (or an error occurs) are not read anymore
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,170 @@
+"""profiling.py -- stage timing and profiling for the spam filter command line tools.
+
+A StageTimer records the wall time, number of calls, messages and tokens of every stage of a run, and reports
+them as a dictionary (as_dict) or as a table (format). The profile context manager runs a block under cProfile
+(writing a pstats file) or under a sampling profiler which writes collapsed stacks, the input format of
+flamegraph.pl and speedscope."""
+
+import cProfile
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+def peak_rss():
+    """
+    :return: The peak resident set size of the process in bytes
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ## ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class Stage:
+    """The totals of a single stage."""
+    __slots__ = ('seconds', 'calls', 'messages', 'tokens')
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.messages = 0
+        self.tokens = 0
+
+
+class StageTimer:
+    def __init__(self):
+        ## Stages in order of first use
+        self.stages = {}
+        self.start_time = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a block as (part of) a stage. The block can add the messages and tokens it processed to the
+        yielded Stage.
+
+        :param name: Name of the stage
+        :return: Context manager yielding the Stage
+        """
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage()
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.seconds += time.perf_counter() - start
+            stage.calls += 1
+
+    def as_dict(self):
+        """
+        :return: Dictionary with the totals and rates of every stage, the total wall time and the peak RSS
+        """
+        stages = {}
+        for name, stage in self.stages.items():
+            stages[name] = {'seconds': stage.seconds, 'calls': stage.calls, 'messages': stage.messages,
+                            'tokens': stage.tokens,
+                            'messages_per_sec': stage.messages / stage.seconds if stage.seconds > 0 else 0.0,
+                            'tokens_per_sec': stage.tokens / stage.seconds if stage.seconds > 0 else 0.0}
+        return {'stages': stages, 'total_seconds': time.perf_counter() - self.start_time,
+                'peak_rss_bytes': peak_rss()}
+
+    def format(self):
+        """
+        :return: The stages as a table
+        """
+        timings = self.as_dict()
+        lines = ["stage             seconds   messages   messages/sec      tokens     tokens/sec"]
+        for name, stage in timings['stages'].items():
+            lines.append("%-14s %10.4f %10d %14.1f %11d %14.1f" %
+                         (name, stage['seconds'], stage['messages'], stage['messages_per_sec'], stage['tokens'],
+                          stage['tokens_per_sec']))
+        lines.append("total %.4f s, peak RSS %.1f MB" % (timings['total_seconds'], timings['peak_rss_bytes'] / 1e6))
+        return "\n".join(lines)
+
+
+class SamplingProfiler:
+    """Samples the stack of a thread at a fixed interval and counts the collapsed stacks. It has the same
+    enable/disable/dump_stats interface as cProfile.Profile. Unlike cProfile it hardly slows down the profiled
+    code, but the sampling thread also needs the GIL, so in practice samples are taken about once per switch
+    interval (sys.getswitchinterval(), 5 ms by default) while the profiled thread is busy."""
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        ## Maps every collapsed stack ("outer;...;inner") to its number of samples
+        self.counts = {}
+        self.thread_id = None
+        self.stopped = threading.Event()
+        self.sampler = None
+
+    def enable(self):
+        self.thread_id = threading.get_ident()
+        self.stopped.clear()
+        self.sampler = threading.Thread(target=self.run, daemon=True)
+        self.sampler.start()
+
+    def disable(self):
+        self.stopped.set()
+        self.sampler.join()
+
+    def run(self):
+        counts = self.counts
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("%s (%s:%d)" % (code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                counts[key] = counts.get(key, 0) + 1
+
+    def dump_stats(self, path):
+        """
+        Write the collapsed stacks, one "stack count" line per distinct stack.
+
+        :param path: Destination file path
+        :return: None
+        """
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write("%s %d\n" % (stack, count))
+
+
+@contextmanager
+def profile(path=None, format='pstats'):
+    """
+    Profile a block and write the result when it ends (also when it exits early).
+
+    :param path: Destination file path, or None to not profile
+    :param format: 'pstats' for a cProfile statistics file, or 'collapsed' for collapsed stacks
+    :return: Context manager
+    """
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile() if format == 'pstats' else SamplingProfiler()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+
+def add_arguments(parser):
+    """
+    Add the --timings, --profile and --profile-format options to a command line parser.
+
+    :param parser: argparse.ArgumentParser
+    :return: None
+    """
+    parser.add_argument('--timings', action='store_true',
+                        help='Print the wall time, messages, tokens/sec of every stage and the peak RSS')
+    parser.add_argument('--profile', type=str, default=None,
+                        help='Profile the run and write the result to this file')
+    parser.add_argument('--profile-format', choices=['pstats', 'collapsed'], default='pstats',
+                        help='Write a cProfile/pstats file, or collapsed stacks for flame graphs')
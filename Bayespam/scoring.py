@@ -0,0 +1,102 @@
+"""scoring.py -- batch classification of messages.
+
+A batch of messages is turned into a sparse term-count matrix, after which the log a posteriori probabilities
+of all messages are computed with one sparse matrix-vector product per class."""
+
+import numpy
+
+
+class TermMatrix:
+    """A sparse (compressed sparse row) matrix of term counts, with one row per message and one column per
+    term of the vocabulary."""
+
+    def __init__(self, indptr, indices, data, shape):
+        ## The counts of message i are data[indptr[i]:indptr[i + 1]], for the terms indices[indptr[i]:indptr[i + 1]]
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.shape = shape
+
+    def dot(self, vector):
+        """
+        Multiply the matrix with a vector of per-term values.
+
+        :param vector: NumPy array with one value per term
+        :return: NumPy array with one value per message
+        """
+        rows = numpy.repeat(numpy.arange(self.shape[0]), numpy.diff(self.indptr))
+        return numpy.bincount(rows, weights=self.data * vector[self.indices], minlength=self.shape[0])
+
+    def column_sums(self, selected=None):
+        """
+        Sum the rows of the matrix, e.g. to get the term counts of a set of messages.
+
+        :param selected: Boolean NumPy array with one value per row, or None to sum all rows
+        :return: NumPy int64 array with one sum per term
+        """
+        indices, data = self.indices, self.data
+        if selected is not None:
+            rows = numpy.repeat(numpy.arange(self.shape[0]), numpy.diff(self.indptr))
+            indices, data = indices[selected[rows]], data[selected[rows]]
+        return numpy.bincount(indices, weights=data, minlength=self.shape[1]).astype(numpy.int64)
+
+
+def term_matrix(messages, lookup, n_terms):
+    """
+    Build the term-count matrix of a batch of messages. Tokens which are not in the vocabulary are ignored.
+
+    :param messages: Iterable of messages, each an iterable of tokens
+    :param lookup: Function mapping a token to its id, or to -1 if it is not in the vocabulary
+    :param n_terms: Number of terms in the vocabulary
+    :return: TermMatrix
+    """
+    ids = []
+    lengths = []
+    for tokens in messages:
+        start = len(ids)
+        ids.extend(map(lookup, tokens))
+        lengths.append(len(ids) - start)
+    n_messages = len(lengths)
+
+    ## Drop the unknown tokens and sum the occurrences of every (message, term) pair,
+    ## encoded as a single integer key
+    ids = numpy.array(ids, dtype=numpy.int64)
+    known = ids >= 0
+    n_columns = max(n_terms, 1)
+    rows = numpy.repeat(numpy.arange(n_messages, dtype=numpy.int64), lengths)
+    keys, counts = numpy.unique(rows[known] * n_columns + ids[known], return_counts=True)
+    indptr = numpy.zeros(n_messages + 1, dtype=numpy.int64)
+    indptr[1:] = numpy.cumsum(numpy.bincount(keys // n_columns, minlength=n_messages))
+    return TermMatrix(indptr, keys % n_columns, counts.astype(numpy.float64), (n_messages, n_terms))
+
+
+def classify_batch(messages, vocab, prior_regular, prior_spam):
+    """
+    Classify a batch of messages.
+
+    :param messages: Iterable of messages, each an iterable of tokens
+    :param vocab: Vocabulary or Model with computed probabilities
+    :param prior_regular: Log a priori probability of a regular message
+    :param prior_spam: Log a priori probability of a spam message
+    :return: Tuple of NumPy arrays: regular and spam log probabilities, and whether each message is spam
+    """
+    matrix = term_matrix(messages, vocab.lookup, len(vocab))
+    p_regular = prior_regular + matrix.dot(vocab.p_regular)
+    p_spam = prior_spam + matrix.dot(vocab.p_spam)
+    return p_regular, p_spam, ~(p_regular > p_spam)
+
+
+def evaluate(is_spam, n_regular):
+    """
+    Compute the sensitivity, specificity and accuracy of the decisions on a test set which lists the regular
+    messages first.
+
+    :param is_spam: Sequence with for every test message whether it was classified as spam
+    :param n_regular: Number of regular messages in the test set
+    :return: Tuple of sensitivity, specificity and accuracy
+    """
+    is_spam = numpy.asarray(is_spam, dtype=bool)
+    correct_regular = n_regular - int(is_spam[:n_regular].sum())
+    correct_spam = int(is_spam[n_regular:].sum())
+    return (correct_regular / n_regular, correct_spam / (len(is_spam) - n_regular),
+            (correct_regular + correct_spam) / len(is_spam))
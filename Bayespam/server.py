@@ -0,0 +1,304 @@
+"""server.py -- long-running classification daemon for models saved by bayespam.py --save-model.
+
+The model is opened once, after which messages are classified over a small HTTP/1.1 API on a Unix domain
+socket or on localhost:
+    POST /classify   request body: the raw message, response: {"label": ..., "score": ..., "p_regular": ...,
+                     "p_spam": ...}, where score is the log-odds score and the label is spam if it is at least
+                     --threshold; with a calibrated ROC table (--roc) also the spam "probability"
+    GET  /stats      latency percentiles (p50, p99) and throughput of the requests served so far, the
+                     time spent tokenizing and scoring (see profiling.StageTimer) and the duplicate cache hits;
+                     the throughput is measured over the time during which requests were in flight, so idle
+                     time between bursts does not lower it
+
+Messages are tokenized on a worker thread, so that a large message does not stall the other connections, and
+concurrent requests are collected into batches, so that bursts of mail are scored together with classify_batch.
+With --dedup-size, identical and nearly identical copies of recently classified messages get the verdict of the
+earlier copy without being scored (see dedup.DuplicateCache). The response to a near-duplicate then carries the
+label, score, p_regular and p_spam of the earlier message, not of its own text, so the cache is off by default.
+
+Usage: python server.py <model> [--unix PATH | --port PORT]"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+from calibration import load_roc_table, log_odds
+from dedup import DuplicateCache, exact_key
+from message import message_tokens
+from model import Model
+from profiling import StageTimer
+from scoring import classify_batch
+from tokenizer import ngrams, tokenize_text
+
+
+class LatencyStats:
+    """Keeps the latencies of the most recent requests, the number of requests served and the busy time, during
+    which at least one request was in flight."""
+
+    def __init__(self, window=10000):
+        self.latencies = deque(maxlen=window)
+        self.n_requests = 0
+        self.n_batches = 0
+        self.busy_time = 0.0
+        ## Time at which the last batch was scored
+        self.last_end = None
+
+    def add_batch(self, starts, end):
+        """
+        :param starts: Arrival times of the requests of the batch (time.perf_counter)
+        :param end: Time at which the batch was scored
+        :return: None
+        """
+        self.latencies.extend(end - start for start in starts)
+        self.n_requests += len(starts)
+        self.n_batches += 1
+        ## Batches are scored one after the other, so the busy time of this batch starts at its first arrival,
+        ## or at the end of the previous batch if this batch arrived while that one was still in flight
+        first = min(starts)
+        if self.last_end is not None and first < self.last_end:
+            first = self.last_end
+        self.busy_time += end - first
+        self.last_end = end
+
+    def as_dict(self):
+        """
+        :return: Dictionary with the number of requests and batches, the throughput in requests per second of
+                 busy time and the p50/p99 latency in milliseconds
+        """
+        stats = {'requests': self.n_requests, 'batches': self.n_batches, 'busy_seconds': self.busy_time,
+                 'throughput': self.n_requests / self.busy_time if self.busy_time > 0 else 0.0}
+        if self.latencies:
+            p50, p99 = numpy.percentile(numpy.array(self.latencies) * 1e3, [50, 99])
+            stats['p50_ms'] = float(p50)
+            stats['p99_ms'] = float(p99)
+        return stats
+
+
+class ClassificationServer:
+    def __init__(self, model, max_batch=64, max_delay=0.002, dedup=None, threshold=0.0, roc=None):
+        self.model = model
+        ## Messages whose log-odds score is at least threshold are labeled spam
+        self.threshold = threshold
+        ## RocTable with the calibration of the scores, or None
+        self.roc = roc
+        ## DuplicateCache of the verdicts of recent messages, or None to score every message
+        self.dedup = dedup
+        ## A batch is scored as soon as it holds max_batch messages, or max_delay seconds after its first message
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = None
+        self.stats = LatencyStats()
+        self.timer = StageTimer()
+        ## Tokenizing is pure Python and holds the GIL, so a single thread keeps the event loop responsive
+        ## without extra threads competing for it; it also means the tokenize stage is only updated from there
+        self.tokenizer = ThreadPoolExecutor(max_workers=1)
+
+    def tokenize(self, text):
+        """
+        Tokenize a message like the model was trained (runs on the tokenizer thread).
+
+        :param text: The raw message
+        :return: List of the tokens
+        """
+        model = self.model
+        with self.timer.stage('tokenize') as stage:
+            if model.parse_mime:
+                tokens = list(message_tokens(text, model.orders, model.min_word_size, model.min_ngram_size))
+            else:
+                tokens = list(ngrams(tokenize_text(text, 1), model.orders, model.min_word_size,
+                                     model.min_ngram_size))
+            stage.messages += 1
+            stage.tokens += len(tokens)
+        return tokens
+
+    async def classify(self, text):
+        """
+        Queue a message for classification and wait for its batch to be scored.
+
+        :param text: The raw message
+        :return: Tuple of the regular and spam log probabilities
+        """
+        arrival = time.perf_counter()
+        dedup = self.dedup
+        if dedup is not None:
+            key = exact_key(text)
+            verdict = dedup.get_exact(key)
+            if verdict is not None:
+                return verdict
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        tokens = await loop.run_in_executor(self.tokenizer, self.tokenize, text)
+        if dedup is not None:
+            fingerprint = dedup.fingerprint(tokens)
+            verdict = dedup.get_similar(fingerprint)
+            if verdict is not None:
+                ## Cached without a fingerprint, so that copies of this near-duplicate are exact hits
+                dedup.put(key, None, verdict)
+                return verdict
+            await self.queue.put((tokens, future, arrival))
+            verdict = await future
+            dedup.put(key, fingerprint, verdict)
+            return verdict
+        await self.queue.put((tokens, future, arrival))
+        return await future
+
+    async def run_batches(self):
+        """
+        Collect queued messages into batches and score them.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                with self.timer.stage('score') as stage:
+                    p_regular, p_spam, _ = classify_batch([tokens for tokens, _, _ in batch], self.model,
+                                                          self.model.prior_regular, self.model.prior_spam)
+                    stage.messages += len(batch)
+                    stage.tokens += sum(len(tokens) for tokens, _, _ in batch)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.cancelled():
+                        future.set_exception(e)
+                continue
+            now = time.perf_counter()
+            for (_, future, start), p_reg_msg, p_spam_msg in zip(batch, p_regular, p_spam):
+                if not future.cancelled():
+                    future.set_result((float(p_reg_msg), float(p_spam_msg)))
+            self.stats.add_batch([start for _, _, start in batch], now)
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serve the HTTP requests of a single (keep-alive) connection.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin1').split(" ", 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin1').partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                if method == 'POST' and path == '/classify':
+                    p_regular, p_spam = await self.classify(body.decode('latin1'))
+                    score = log_odds(p_regular, p_spam)
+                    status, response = '200 OK', {'label': 'spam' if score >= self.threshold else 'regular',
+                                                  'score': score, 'p_regular': p_regular, 'p_spam': p_spam}
+                    if self.roc is not None and self.roc.platt is not None:
+                        response['probability'] = float(self.roc.probability(score))
+                elif method == 'GET' and path == '/stats':
+                    status, response = '200 OK', dict(self.stats.as_dict(), timings=self.timer.as_dict())
+                    if self.dedup is not None:
+                        response['dedup'] = self.dedup.as_dict()
+                else:
+                    status, response = '404 Not Found', {'error': 'unknown request %s %s' % (method, path)}
+
+                content = json.dumps(response).encode('latin1')
+                writer.write(b'HTTP/1.1 %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n'
+                             % (status.encode('latin1'), len(content)) + content)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, unix_path=None, host='127.0.0.1', port=8025):
+        self.queue = asyncio.Queue()
+        batches = asyncio.create_task(self.run_batches())
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_path)
+            print("Listening on unix socket %s" % unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            print("Listening on http://%s:%d" % (host, port))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batches.cancel()
+            self.tokenizer.shutdown(wait=False)
+            if unix_path is not None and os.path.exists(unix_path):
+                os.remove(unix_path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_path', type=str,
+                        help='File path of the trained model')
+    parser.add_argument('--unix', type=str, default=None,
+                        help='Listen on this Unix domain socket instead of localhost')
+    parser.add_argument('--port', type=int, default=8025,
+                        help='Port to listen on (localhost)')
+    parser.add_argument('--max-batch', type=int, default=64,
+                        help='Maximum number of messages scored in a single batch')
+    parser.add_argument('--max-delay', type=float, default=2.0,
+                        help='Maximum time in milliseconds a message waits for its batch to fill up')
+    parser.add_argument('--dedup-size', type=int, default=0,
+                        help='Number of recent verdicts kept for duplicate messages, e.g. 65536 (0, the default, to '
+                             'score every message)')
+    parser.add_argument('--dedup-distance', type=int, default=3,
+                        help='Maximum number of differing SimHash bits of near-duplicates (-1 for exact duplicates only)')
+    parser.add_argument('--threshold', type=float, default=0.0,
+                        help='Label messages whose log-odds score is at least this as spam')
+    parser.add_argument('--roc', type=str, default=None,
+                        help='File path of a ROC table written by bayespam.py --roc, to add calibrated probabilities')
+    parser.add_argument('--max-fpr', type=float, default=None,
+                        help='Pick the threshold of the ROC table with at most this false positive rate')
+    args = parser.parse_args()
+
+    try:
+        model = Model(args.model_path)
+    except Exception as e:
+        print("Error while opening model %s: " % args.model_path, e)
+        exit()
+
+    roc = None
+    if args.roc is not None:
+        try:
+            roc = load_roc_table(args.roc)
+        except Exception as e:
+            print("Error while reading ROC table %s: " % args.roc, e)
+            exit()
+    threshold = args.threshold
+    if args.max_fpr is not None:
+        if roc is None:
+            print("Error: --max-fpr needs the ROC table of --roc")
+            exit()
+        threshold = roc.threshold_for(args.max_fpr)
+
+    dedup = None
+    if args.dedup_size > 0:
+        dedup = DuplicateCache(args.dedup_size, args.dedup_distance if args.dedup_distance >= 0 else None)
+    server = ClassificationServer(model, args.max_batch, args.max_delay / 1e3, dedup, threshold, roc)
+    try:
+        asyncio.run(server.serve(args.unix, port=args.port))
+    except KeyboardInterrupt:
+        print(json.dumps(server.stats.as_dict()))
+
+
+if __name__ == "__main__":
+    main()
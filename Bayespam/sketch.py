@@ -0,0 +1,137 @@
+"""sketch.py -- count-min sketch for approximate frequency counts.
+
+A count-min sketch estimates the frequency of every item with a fixed amount of memory. Estimates are never
+too low, and with probability 1 - delta they are at most epsilon * (total count) too high. Items are hashed with
+a seeded BLAKE2b, so the estimates of a sketch are the same in every run and every process.
+
+A SketchVocabulary only stores the terms which are frequent enough to be used: the counts of the other
+candidate terms are estimated with a count-min sketch per message type, and a term is added to the vocabulary
+once its estimated total count reaches the minimum frequency."""
+
+import hashlib
+import math
+from array import array
+
+from vocabulary import Vocabulary
+
+
+class CountMinSketch:
+    def __init__(self, epsilon=1e-4, delta=0.01, seed=0):
+        self.epsilon = epsilon
+        self.delta = delta
+        ## Salt of the hash function, sketches with different seeds make independent errors
+        self.salt = seed.to_bytes(hashlib.blake2b.SALT_SIZE, 'little')
+        ## Number of counters per row and number of rows (hash functions)
+        self.width = math.ceil(math.e / epsilon)
+        self.depth = math.ceil(math.log(1 / delta))
+        self.counts = array('I', bytes(4 * self.width * self.depth))
+        self.total = 0
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the counters in bytes.
+        """
+        return self.counts.itemsize * len(self.counts)
+
+    def indices(self, item):
+        """
+        The counter of an item in every row, derived from two halves of its hash (Kirsch-Mitzenmacher).
+
+        :param item: A string or bytes
+        :return: List of indices into self.counts
+        """
+        if isinstance(item, str):
+            item = item.encode('utf-8')
+        h = int.from_bytes(hashlib.blake2b(item, digest_size=8, salt=self.salt).digest(), 'little')
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in range(self.depth)]
+
+    def add(self, item, count=1):
+        """
+        Count an item with a conservative update: counters are only raised as far as needed for the new estimate.
+
+        :param item: A string or bytes
+        :param count: Number of occurrences to add
+        :return: The new frequency estimate of the item
+        """
+        counts = self.counts
+        indices = self.indices(item)
+        estimate = min(counts[index] for index in indices) + count
+        for index in indices:
+            if counts[index] < estimate:
+                counts[index] = estimate
+        self.total += count
+        return estimate
+
+    def estimate(self, item):
+        """
+        :param item: A string or bytes
+        :return: Estimated frequency of the item (never lower than the true frequency)
+        """
+        counts = self.counts
+        return min(counts[index] for index in self.indices(item))
+
+
+class SketchVocabulary(Vocabulary):
+    def __init__(self, epsilon=1e-4, delta=0.01):
+        super().__init__()
+        ## Estimated counts of the terms which are not in the vocabulary yet, per message type
+        self.sketch_regular = CountMinSketch(epsilon, delta)
+        self.sketch_spam = CountMinSketch(epsilon, delta)
+
+    def add(self, term, spam=False, count=1):
+        """
+        Count a term exactly if it is in the vocabulary, and in the sketch of its message type otherwise. A term
+        is added to the vocabulary with its estimated counts (which are at least its true counts) once their
+        total reaches minimum_frequency.
+
+        :param term: The term to count
+        :param spam: Set to True if the term occurred in a spam message
+        :param count: Number of occurrences to add
+        :return: The id of the term, or -1 if it is not in the vocabulary
+        """
+        if term in self.ids:
+            return super().add(term, spam, count)
+        sketch, other_sketch = (self.sketch_spam, self.sketch_regular) if spam else \
+            (self.sketch_regular, self.sketch_spam)
+        estimate = sketch.add(term, count)
+        other_estimate = other_sketch.estimate(term)
+        if spam:
+            self.n_words_spam += count
+        else:
+            self.n_words_regular += count
+        if estimate + other_estimate < self.minimum_frequency:
+            return -1
+        id = self.new_term(term)
+        self.counts_spam[id], self.counts_regular[id] = (estimate, other_estimate) if spam else \
+            (other_estimate, estimate)
+        self.invalidate()
+        return id
+
+    def add_tokens(self, tokens, spam=False):
+        """
+        Count every token of a stream of tokens which occurred in a regular or spam message (see add).
+
+        :param tokens: Iterable of tokens
+        :param spam: Set to True if the tokens occurred in a spam message
+        :return: None
+        """
+        ids = self.ids
+        counts = self.counts_spam if spam else self.counts_regular
+        n_tokens = 0
+        for token in tokens:
+            id = ids.get(token)
+            if id is None:
+                self.add(token, spam)
+            else:
+                ## Terms in the vocabulary are counted exactly
+                counts[id] += 1
+                n_tokens += 1
+        if spam:
+            self.n_words_spam += n_tokens
+        else:
+            self.n_words_regular += n_tokens
+        self.invalidate()
@@ -0,0 +1,179 @@
+"""sweep.py -- hyperparameter sweep for the spam filters.
+
+The training set is counted and the test set is tokenized only once, with the smallest minimum word size of the
+grid. Every setting of the grid then only filters the count tables, recomputes the log-probabilities and scores
+the test set with a sparse matrix product, which gives the same decisions as training with that setting:
+    min word size    terms which are shorter are ignored (unigrams only, unless --bigram is used)
+    min frequency    terms with a lower total count are ignored
+    epsilon          smoothing value of the zero probabilities
+
+Usage: python sweep.py <train> <test> [--min-word-sizes 3 4 5] [--min-frequencies 1 2 5] [--epsilons 1e-16 1e-8]"""
+
+import argparse
+import itertools
+import multiprocessing
+import sys
+
+import numpy
+
+import bigram_bayespam
+from bayespam import Bayespam, MessageType
+from cache import TokenCache
+from scoring import evaluate, term_matrix
+from vocabulary import log_likelihoods
+
+## The count tables and test set of the sweep, set in every worker process by init_worker
+sweep_data = None
+
+
+class SweepData:
+    """The raw counts of a training set and the term-count matrix of a test set, shared by every setting."""
+
+    def __init__(self, terms, counts_regular, counts_spam, prior_regular, prior_spam, matrix, n_regular,
+                 size_filtered):
+        self.counts_regular = counts_regular
+        self.counts_spam = counts_spam
+        self.prior_regular = prior_regular
+        self.prior_spam = prior_spam
+        ## Term-count matrix of the test set, which lists the regular messages first
+        self.matrix = matrix
+        self.n_regular = n_regular
+
+        with numpy.errstate(divide='ignore'):
+            self.numerators_regular = numpy.log10(counts_regular)
+            self.numerators_spam = numpy.log10(counts_spam)
+        self.totals = counts_regular + counts_spam
+        ## Length of every term to which the minimum word size applies (the others get a length of infinity)
+        self.lengths = numpy.array([len(term) if size_filtered(term) else numpy.inf for term in terms])
+
+
+def count_unigrams(train_path, test_path, orders, min_word_size, workers=1, cache=None):
+    """
+    Count the terms of a training set with the n-gram classifier of bayespam.py, and tokenize a test set.
+
+    :return: SweepData
+    """
+    bayespam = Bayespam(orders, min_word_size)
+    bayespam.cache = cache
+    bayespam.list_dirs(train_path)
+    bayespam.read_messages(MessageType.REGULAR, workers)
+    bayespam.read_messages(MessageType.SPAM, workers)
+    vocab = bayespam.vocab
+    prior_regular, prior_spam = vocab.priors()
+
+    bayespam.list_dirs(test_path)
+    messages = [bayespam.read_file(msg) for msg in bayespam.regular_list + bayespam.spam_list]
+    matrix = term_matrix(messages, vocab.lookup, len(vocab))
+    return SweepData(vocab.terms, numpy.array(vocab.counts_regular, dtype=numpy.int64),
+                     numpy.array(vocab.counts_spam, dtype=numpy.int64), prior_regular, prior_spam, matrix,
+                     len(bayespam.regular_list), lambda term: " " not in term)
+
+
+def count_bigrams(train_path, test_path, min_word_size, cache=None):
+    """
+    Count the bigrams of a training set with the classifier of bigram_bayespam.py, and tokenize a test set.
+
+    :return: SweepData
+    """
+    ## Every bigram is kept, the minimum frequency is applied by the sweep
+    bayespam = bigram_bayespam.bigram_bayespam(min_bigram_size=min_word_size, minimum_frequency=1)
+    bayespam.cache = cache
+    bayespam.list_dirs(train_path)
+    bayespam.read_messages(MessageType.REGULAR)
+    bayespam.read_messages(MessageType.SPAM)
+    vocab = bayespam.vocab
+    prior_regular, prior_spam = vocab.priors()
+
+    bayespam.list_dirs(test_path)
+    ## Like bigram_bayespam.py, the empty tokens of the test messages are paired as well
+    bayespam.skip_empty = False
+    messages = [bayespam.read_file(msg) for msg in bayespam.regular_list + bayespam.spam_list]
+    matrix = term_matrix(messages, vocab.lookup, len(vocab))
+    return SweepData(vocab.terms, numpy.array(vocab.counts_regular, dtype=numpy.int64),
+                     numpy.array(vocab.counts_spam, dtype=numpy.int64), prior_regular, prior_spam, matrix,
+                     len(bayespam.regular_list), lambda term: True)
+
+
+def init_worker(data):
+    global sweep_data
+    sweep_data = data
+
+
+def evaluate_setting(setting):
+    """
+    Evaluate a single setting of the grid on the test set.
+
+    :param setting: Tuple of the minimum word size, minimum frequency and epsilon
+    :return: Tuple of the number of terms used, sensitivity, specificity and accuracy
+    """
+    min_word_size, min_frequency, epsilon = setting
+    data = sweep_data
+    unused = (data.totals < max(min_frequency, 1)) | (data.lengths < min_word_size)
+    p_regular, p_spam = log_likelihoods(data.counts_regular, data.counts_spam, data.numerators_regular,
+                                        data.numerators_spam, unused, epsilon)
+    is_spam = ~(data.prior_regular + data.matrix.dot(p_regular) > data.prior_spam + data.matrix.dot(p_spam))
+    return (int(len(unused) - unused.sum()),) + evaluate(is_spam, data.n_regular)
+
+
+def sweep(data, grid, workers=1):
+    """
+    Evaluate every setting of a grid, in parallel if workers > 1.
+
+    :param data: SweepData
+    :param grid: List of (minimum word size, minimum frequency, epsilon) tuples
+    :param workers: Number of processes
+    :return: List with the result of evaluate_setting for every setting
+    """
+    if workers <= 1:
+        init_worker(data)
+        return [evaluate_setting(setting) for setting in grid]
+    with multiprocessing.Pool(workers, init_worker, (data,)) as pool:
+        return pool.map(evaluate_setting, grid, chunksize=max(1, len(grid) // (workers * 4)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('train_path', type=str,
+                        help='File path of the directory containing the training data')
+    parser.add_argument('test_path', type=str,
+                        help='File path of the directory containing the test data')
+    parser.add_argument('--bigram', action='store_true',
+                        help='Sweep the non-overlapping bigram classifier of bigram_bayespam.py')
+    parser.add_argument('--ngrams', type=str, default='1',
+                        help='Comma separated n-gram orders of the classifier of bayespam.py')
+    parser.add_argument('--min-word-sizes', type=int, nargs='+', default=None,
+                        help='Minimum word sizes to test (default 2..6, or 4..10 with --bigram)')
+    parser.add_argument('--min-frequencies', type=int, nargs='+', default=[1, 2, 3, 5, 10],
+                        help='Minimum term frequencies to test')
+    parser.add_argument('--epsilons', type=float, nargs='+', default=[sys.float_info.epsilon, 1e-12, 1e-8, 1e-4],
+                        help='Smoothing values of the zero probabilities to test')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='Number of processes used to count and to evaluate the grid')
+    parser.add_argument('--cache', type=str, default=None,
+                        help='Directory of a cache of tokenized messages, reused by later runs')
+    args = parser.parse_args()
+
+    min_word_sizes = args.min_word_sizes or (list(range(4, 11)) if args.bigram else list(range(2, 7)))
+    cache = TokenCache(args.cache) if args.cache is not None else None
+    try:
+        if args.bigram:
+            data = count_bigrams(args.train_path, args.test_path, min(min_word_sizes), cache)
+        else:
+            orders = tuple(int(n) for n in args.ngrams.split(','))
+            data = count_unigrams(args.train_path, args.test_path, orders, min(min_word_sizes), args.workers, cache)
+    except Exception as e:
+        print("Error while counting the messages: ", e)
+        exit()
+
+    grid = list(itertools.product(min_word_sizes, args.min_frequencies, args.epsilons))
+    results = sweep(data, grid, args.workers)
+
+    print("min word size   min frequency     epsilon     terms   sensitivity   specificity   accuracy")
+    for (min_word_size, min_frequency, epsilon), result in zip(grid, results):
+        print("%13d %15d %11.3g %9d %13.4f %13.4f %10.4f" % ((min_word_size, min_frequency, epsilon) + result))
+    best = max(range(len(grid)), key=lambda i: results[i][3])
+    print("best accuracy: min word size %d, min frequency %d, epsilon %g" % grid[best])
+
+
+if __name__ == "__main__":
+    main()
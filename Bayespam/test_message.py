@@ -0,0 +1,40 @@
+"""test_message.py -- tests of the header and MIME aware tokenizing of message.py.
+
+Usage: python -m pytest test_message.py"""
+
+import base64
+
+from message import message_tokens, parse_message
+
+
+def mime_message(charset, body):
+    """
+    :param charset: Charset of the text part
+    :param body: Bytes of the text part, which is base64 encoded
+    :return: A multipart message with a single text/plain part
+    """
+    return ("From: sender@example.com\n"
+            "Subject: invoice attached\n"
+            "Content-Type: multipart/mixed; boundary=\"frontier\"\n"
+            "\n"
+            "--frontier\n"
+            "Content-Type: text/plain; charset=%s\n"
+            "Content-Transfer-Encoding: base64\n"
+            "\n"
+            "%s\n"
+            "--frontier--\n" % (charset, base64.b64encode(body).decode('ascii')))
+
+
+def test_unknown_charset_falls_back_to_latin1():
+    _, parts = parse_message(mime_message('x-no-such-charset', b'payment overdue'))
+    assert parts[0].text == 'payment overdue'
+
+
+def test_failing_codec_falls_back_to_latin1():
+    ## The idna codec does not support errors='replace', so decoding fails with a UnicodeError
+    body = 'héllo wörld payment overdue'.encode('utf-8')
+    _, parts = parse_message(mime_message('idna', body))
+    assert parts[0].text == body.decode('latin1')
+    tokens = list(message_tokens(mime_message('idna', body)))
+    assert 'subject:invoice' in tokens
+    assert 'payment' in tokens and 'overdue' in tokens
@@ -0,0 +1,218 @@
+"""tokenizer.py -- the tokenizer shared by the unigram and bigram spam filters.
+
+Punctuation and digits are stripped with a single precompiled translation table
+instead of checking every character against a string, and tokens are streamed
+from the message files as generators. n-grams of several orders are formed
+from the same token stream, so a file is read only once for all of them."""
+
+import io
+
+## punctuation to remove
+PUNCTUATIONS = '''|=!()-[]{};:'"\,<>./?@##$%^&*_~1234567890\n\t'''
+
+## Translation table deleting every punctuation character from a string
+STRIP_TABLE = str.maketrans('', '', PUNCTUATIONS)
+
+## Same as STRIP_TABLE, but replaces newlines by spaces so that whole blocks of text can be split at once
+BLOCK_TABLE = str.maketrans({**{char: None for char in PUNCTUATIONS}, '\n': ' '})
+
+## Number of characters read from a message file at a time
+BLOCK_SIZE = 1 << 16
+
+
+def tokenize_line(line):
+    """
+    Split a line on the space character and strip punctuation and digits from every token (converted to lower case).
+    Empty tokens are kept, so the result lines up with line.split(" ").
+
+    :param line: A single line of a message
+    :return: List of cleaned tokens
+    """
+    return line.translate(STRIP_TABLE).lower().split(" ")
+
+
+def tokenize_lines(lines, min_length=4):
+    """
+    Generate the cleaned tokens of an iterable of lines which are at least min_length characters long.
+
+    :param lines: Iterable of lines (e.g. an open file)
+    :param min_length: Minimum length of a token
+    :return: Generator of tokens
+    """
+    for line in lines:
+        for token in tokenize_line(line):
+            if len(token) >= min_length:
+                yield token
+
+
+def pair_tokens(tokens, min_length=6, skip_empty=True):
+    """
+    Group a stream of tokens into non-overlapping bigrams. Only bigrams of at least min_length characters
+    (including the separating space) are generated.
+
+    :param tokens: Iterable of cleaned tokens
+    :param min_length: Minimum length of a bigram
+    :param skip_empty: Set to False to also pair empty and whitespace-only tokens
+    :return: Generator of bigrams
+    """
+    first = None
+    for token in tokens:
+        if skip_empty and (token == "" or token.isspace()):
+            continue
+        if first is None:
+            first = token
+        else:
+            bigram = first + " " + token
+            first = None
+            if len(bigram) >= min_length:
+                yield bigram
+
+
+def tokenize_blocks(blocks, min_length=4):
+    """
+    Generate the cleaned tokens of an iterable of text blocks which are at least min_length characters long.
+    A token may be split over two consecutive blocks.
+
+    :param blocks: Iterable of strings
+    :param min_length: Minimum length of a token
+    :return: Generator of tokens
+    """
+    tail = ""
+    for block in blocks:
+        tokens = block.translate(BLOCK_TABLE).lower().split(" ")
+        ## The last token may continue in the next block
+        tokens[0] = tail + tokens[0]
+        tail = tokens.pop()
+        yield from [token for token in tokens if len(token) >= min_length]
+    if len(tail) >= min_length:
+        yield tail
+
+
+def tokenize_text(text, min_length=4):
+    """
+    Generate the cleaned tokens of a complete message which is already in memory.
+
+    :param text: The message
+    :param min_length: Minimum length of a token
+    :return: Generator of tokens
+    """
+    ## Files are read with universal newlines, so convert the line endings in the same way
+    return tokenize_blocks([text.replace('\r\n', '\n').replace('\r', '\n')], min_length)
+
+
+def read_blocks(f):
+    """
+    Read an open file in blocks of BLOCK_SIZE characters.
+
+    :param f: Open file
+    :return: Generator of strings
+    """
+    return iter(lambda: f.read(BLOCK_SIZE), "")
+
+
+def ngrams(tokens, orders=(1,), min_word_size=4, min_ngram_size=6):
+    """
+    Form the overlapping n-grams of several orders from a single stream of tokens. Unigrams are the tokens of at
+    least min_word_size characters. Higher order n-grams join consecutive non-empty, non-whitespace tokens with a
+    space, and must be at least min_ngram_size characters long.
+
+    :param tokens: Iterable of cleaned tokens (including short ones)
+    :param orders: The n-gram orders to generate, e.g. (1,), (2,) or (1, 2, 3)
+    :param min_word_size: Minimum length of a unigram
+    :param min_ngram_size: Minimum length of a higher order n-gram
+    :return: Generator of n-grams
+    """
+    unigrams = 1 in orders
+    higher_orders = {n for n in orders if n > 1}
+    max_order = max(higher_orders, default=1)
+    ## The last max_order - 1 tokens, most recent last
+    history = []
+    for token in tokens:
+        if unigrams and len(token) >= min_word_size:
+            yield token
+        if max_order == 1 or token == "" or token.isspace():
+            continue
+        ## Extend the n-gram ending at this token one token to the left at a time
+        ngram = token
+        for n in range(2, min(len(history) + 2, max_order + 1)):
+            ngram = history[-n + 1] + " " + ngram
+            if n in higher_orders and len(ngram) >= min_ngram_size:
+                yield ngram
+        history.append(token)
+        if len(history) == max_order:
+            del history[0]
+
+
+def text_ngrams(text, orders=(1,), min_word_size=4, min_ngram_size=6):
+    """
+    Generate the overlapping n-grams of several orders of a text which is already in memory.
+
+    :param text: The text, e.g. a message or one of its header fields or MIME parts
+    :param orders: The n-gram orders to generate
+    :param min_word_size: Minimum length of a unigram
+    :param min_ngram_size: Minimum length of a higher order n-gram
+    :return: Generator of n-grams
+    """
+    ## Unigrams only do not need the n-gram generator, which is the slowest step
+    if tuple(orders) == (1,):
+        return tokenize_text(text, min_word_size)
+    return ngrams(tokenize_text(text, 1), orders, min_word_size, min_ngram_size)
+
+
+def read_tokens(file, min_length=4):
+    """
+    Stream the cleaned tokens of a message file.
+
+    :param file: File path of the message
+    :param min_length: Minimum length of a token
+    :return: Generator of tokens
+    """
+    ## Make sure to use latin1 encoding, otherwise it will be unable to read some of the messages
+    with open(file, 'r', encoding='latin1') as f:
+        yield from tokenize_blocks(read_blocks(f), min_length)
+
+
+def read_bigrams(file, min_length=6, skip_empty=True):
+    """
+    Stream the non-overlapping bigrams of a message file.
+
+    :param file: File path of the message
+    :param min_length: Minimum length of a bigram
+    :param skip_empty: Set to False to also pair empty and whitespace-only tokens
+    :return: Generator of bigrams
+    """
+    with open(file, 'r', encoding='latin1') as f:
+        yield from pair_tokens(tokenize_lines(f, 0), min_length, skip_empty)
+
+
+def text_bigrams(text, min_length=6, skip_empty=True):
+    """
+    Generate the non-overlapping bigrams of a message which is already in memory, like read_bigrams.
+
+    :param text: The message, with '\\n' line endings
+    :param min_length: Minimum length of a bigram
+    :param skip_empty: Set to False to also pair empty and whitespace-only tokens
+    :return: Generator of bigrams
+    """
+    ## Split into lines like reading the file does, so that the empty tokens line up with read_bigrams
+    return pair_tokens(tokenize_lines(io.StringIO(text), 0), min_length, skip_empty)
+
+
+def read_ngrams(file, orders=(1,), min_word_size=4, min_ngram_size=6):
+    """
+    Stream the overlapping n-grams of several orders of a message file, reading the file once.
+
+    :param file: File path of the message
+    :param orders: The n-gram orders to generate
+    :param min_word_size: Minimum length of a unigram
+    :param min_ngram_size: Minimum length of a higher order n-gram
+    :return: Generator of n-grams
+    """
+    if tuple(orders) == (1,):
+        return read_tokens(file, min_word_size)
+    return _read_ngrams(file, orders, min_word_size, min_ngram_size)
+
+
+def _read_ngrams(file, orders, min_word_size, min_ngram_size):
+    with open(file, 'r', encoding='latin1') as f:
+        yield from ngrams(tokenize_blocks(read_blocks(f), 1), orders, min_word_size, min_ngram_size)
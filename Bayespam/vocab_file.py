@@ -0,0 +1,204 @@
+"""vocab_file.py -- streaming export and import of trained vocabularies.
+
+A vocabulary file is a UTF-8 text file with a header line of key=value settings and totals, followed by one
+line per term:
+    #bayespam-vocabulary version=1 orders=1,2 min_word_size=4 ... messages_regular=... words_spam=...
+    term<TAB>regular count<TAB>spam count
+
+The terms are sorted by term, or by descending total frequency. Vocabularies which do not fit in memory twice
+are sorted externally: the entries are sorted in runs of at most chunk_size entries, every run is spilled to a
+temporary file, and the runs are merged with heapq.merge, so only a single run is held in memory at a time.
+Reading a vocabulary file streams it line by line.
+
+Backslashes, tabs and newlines in terms are escaped as \\\\, \\t and \\n."""
+
+import heapq
+import os
+import re
+import tempfile
+from array import array
+
+from vocabulary import Vocabulary
+
+MAGIC = '#bayespam-vocabulary'
+VERSION = 1
+
+ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n'})
+UNESCAPES = {'\\': '\\', 't': '\t', 'n': '\n'}
+ESCAPE_PATTERN = re.compile(r'\\(.)')
+
+## Sort keys of the entries (term, regular count, spam count)
+SORT_KEYS = {'term': lambda entry: entry[0],
+             'frequency': lambda entry: (-(entry[1] + entry[2]), entry[0])}
+
+
+def format_entry(entry):
+    term, count_regular, count_spam = entry
+    ## Checking first is much faster than translating every term, and almost no term needs escaping
+    if '\\' in term or '\t' in term or '\n' in term:
+        return "%s\t%d\t%d\n" % (term.translate(ESCAPES), count_regular, count_spam)
+    return "%s\t%d\t%d\n" % entry
+
+
+def parse_entry(line):
+    term, count_regular, count_spam = line.rstrip('\n').split('\t')
+    if '\\' in term:
+        term = ESCAPE_PATTERN.sub(lambda match: UNESCAPES[match.group(1)], term)
+    return term, int(count_regular), int(count_spam)
+
+
+def read_run(f):
+    for line in f:
+        yield parse_entry(line)
+
+
+def sort_entries(entries, sort_by='term', chunk_size=1 << 20):
+    """
+    Sort vocabulary entries with an external merge sort if there are more than chunk_size of them.
+
+    :param entries: Iterable of (term, regular count, spam count) tuples
+    :param sort_by: 'term', or 'frequency' for descending total frequency (ties sorted by term)
+    :param chunk_size: Maximum number of entries sorted in memory at once
+    :return: Generator of the sorted entries
+    """
+    key = SORT_KEYS[sort_by]
+    runs = []
+    entries = iter(entries)
+    with tempfile.TemporaryDirectory() as directory:
+        while True:
+            chunk = [entry for _, entry in zip(range(chunk_size), entries)]
+            chunk.sort(key=key)
+            if len(chunk) < chunk_size and not runs:
+                ## Everything fits in a single run, which does not have to be spilled
+                yield from chunk
+                return
+            if chunk:
+                run = open(os.path.join(directory, 'run%d' % len(runs)), 'w+', encoding='utf-8', newline='\n')
+                run.writelines(map(format_entry, chunk))
+                run.seek(0)
+                runs.append(run)
+            if len(chunk) < chunk_size:
+                break
+        del chunk
+
+        try:
+            yield from heapq.merge(*map(read_run, runs), key=key)
+        finally:
+            for run in runs:
+                run.close()
+
+
+def vocab_entries(vocab):
+    """
+    :param vocab: Vocabulary
+    :return: Generator of the (term, regular count, spam count) entries of the vocabulary, in order of id
+    """
+    return zip(vocab.terms, vocab.counts_regular, vocab.counts_spam)
+
+
+def write_vocabulary(destination_fp, entries, settings, sort_by='term', chunk_size=1 << 20):
+    """
+    Write a vocabulary file. The file is written next to its destination first and then renamed, so readers
+    never open a partially written vocabulary.
+
+    :param destination_fp: Destination file path of the vocabulary
+    :param entries: Iterable of (term, regular count, spam count) tuples
+    :param settings: Dictionary of the settings and totals stored in the header (int or tuple of int values)
+    :param sort_by: 'term', or 'frequency' for descending total frequency
+    :param chunk_size: Maximum number of entries sorted in memory at once
+    :return: None
+    """
+    header = [MAGIC, 'version=%d' % VERSION]
+    for name, value in settings.items():
+        value = ','.join(map(str, value)) if isinstance(value, tuple) else str(value)
+        header.append('%s=%s' % (name, value))
+
+    temporary_fp = destination_fp + '.tmp'
+    with open(temporary_fp, 'w', encoding='utf-8', newline='\n') as f:
+        f.write(' '.join(header) + '\n')
+        f.writelines(map(format_entry, sort_entries(entries, sort_by, chunk_size)))
+    os.replace(temporary_fp, destination_fp)
+
+
+def read_header(f):
+    """
+    :param f: Vocabulary file opened for reading
+    :return: Dictionary of the settings and totals of the header, as int or tuple of int values
+    """
+    fields = f.readline().split()
+    if not fields or fields[0] != MAGIC:
+        raise ValueError("not a vocabulary file")
+    settings = {}
+    for field in fields[1:]:
+        name, _, value = field.partition('=')
+        settings[name] = tuple(map(int, value.split(','))) if ',' in value else int(value)
+    if settings.get('version') != VERSION:
+        raise ValueError("unsupported vocabulary file version %s" % settings.get('version'))
+    if 'orders' in settings and isinstance(settings['orders'], int):
+        settings['orders'] = (settings['orders'],)
+    return settings
+
+
+def read_vocabulary(source_fp):
+    """
+    Stream the entries of a vocabulary file.
+
+    :param source_fp: File path of the vocabulary
+    :return: Generator of (term, regular count, spam count) tuples
+    """
+    with open(source_fp, 'r', encoding='utf-8', newline='\n') as f:
+        read_header(f)
+        yield from read_run(f)
+
+
+def save_vocabulary(destination_fp, vocab, orders=(1,), min_word_size=4, min_ngram_size=6, parse_mime=False,
+                    sort_by='term', chunk_size=1 << 20):
+    """
+    Write the counts and totals of a trained Vocabulary, together with the tokenizer settings it was trained
+    with, to a vocabulary file.
+
+    :param destination_fp: Destination file path of the vocabulary
+    :param vocab: Vocabulary
+    :param orders: The n-gram orders of the vocabulary
+    :param min_word_size: Minimum length of a unigram
+    :param min_ngram_size: Minimum length of a higher order n-gram
+    :param parse_mime: Set to True if the vocabulary was tokenized by message.py
+    :param sort_by: 'term', or 'frequency' for descending total frequency
+    :param chunk_size: Maximum number of entries sorted in memory at once
+    :return: None
+    """
+    settings = {'orders': tuple(orders), 'min_word_size': min_word_size, 'min_ngram_size': min_ngram_size,
+                'parse_mime': int(parse_mime),
+                'messages_regular': vocab.n_messages_regular, 'messages_spam': vocab.n_messages_spam,
+                'words_regular': vocab.n_words_regular, 'words_spam': vocab.n_words_spam}
+    write_vocabulary(destination_fp, vocab_entries(vocab), settings, sort_by, chunk_size)
+
+
+def load_vocabulary(source_fp):
+    """
+    Rebuild a Vocabulary from a vocabulary file. The terms get their ids in the order of the file.
+
+    :param source_fp: File path of the vocabulary
+    :return: Tuple of the Vocabulary and the dictionary of settings of the header
+    """
+    vocab = Vocabulary()
+    ids, terms = vocab.ids, vocab.terms
+    counts_regular, counts_spam = array('q'), array('q')
+    with open(source_fp, 'r', encoding='utf-8', newline='\n') as f:
+        settings = read_header(f)
+        for term, count_regular, count_spam in read_run(f):
+            if term in ids:
+                raise ValueError("duplicate term %s in vocabulary file" % repr(term))
+            ids[term] = len(terms)
+            terms.append(term)
+            counts_regular.append(count_regular)
+            counts_spam.append(count_spam)
+
+    vocab.counts_regular = counts_regular
+    vocab.counts_spam = counts_spam
+    vocab.n_messages_regular = settings.get('messages_regular', 0)
+    vocab.n_messages_spam = settings.get('messages_spam', 0)
+    vocab.n_words_regular = settings.get('words_regular', sum(counts_regular))
+    vocab.n_words_spam = settings.get('words_spam', sum(counts_spam))
+    vocab.invalidate()
+    return vocab, settings
@@ -0,0 +1,397 @@
+"""vocabulary.py -- compact vocabulary for the spam filters.
+
+Terms are mapped to integer ids, and the frequency counts and log-probabilities of all terms are kept in
+contiguous arrays indexed by id instead of in one Counter object per term.
+
+The log-probabilities are computed lazily. A log-probability log10(count / n_words) is stored as its numerator
+log10(count) per term and the class total log10(n_words), so that after update() or forget() only the
+numerators of the affected terms have to be recomputed."""
+
+import sys
+from array import array
+
+import numpy
+
+
+def log_likelihoods(counts_regular, counts_spam, numerators_regular, numerators_spam, unused,
+                    epsilon=sys.float_info.epsilon):
+    """
+    Compute the class conditional log-probabilities (base 10) of a table of terms. Only the counts of the used
+    terms count towards the class totals. Zero probabilities are replaced by log10(epsilon / total number of
+    words), and unused terms get a log-probability of zero.
+
+    :param counts_regular: NumPy array of the frequency counts in regular messages
+    :param counts_spam: NumPy array of the frequency counts in spam messages
+    :param numerators_regular: NumPy array of log10(counts_regular)
+    :param numerators_spam: NumPy array of log10(counts_spam)
+    :param unused: Boolean NumPy array, True for the terms which are ignored
+    :param epsilon: Smoothing value of the zero probabilities
+    :return: Tuple of NumPy arrays of the regular and spam log-probabilities
+    """
+    n_words_regular = int(counts_regular[~unused].sum())
+    n_words_spam = int(counts_spam[~unused].sum())
+    p_zero = numpy.log10(epsilon) - numpy.log10(max(n_words_regular + n_words_spam, 1))
+
+    p_regular = numpy.where(counts_regular > 0, numerators_regular - numpy.log10(max(n_words_regular, 1)), p_zero)
+    p_spam = numpy.where(counts_spam > 0, numerators_spam - numpy.log10(max(n_words_spam, 1)), p_zero)
+    p_regular[unused] = 0
+    p_spam[unused] = 0
+    return p_regular, p_spam
+
+
+def feature_scores(counts_regular, counts_spam, p_regular, p_spam, method='mi'):
+    """
+    Score how well every term discriminates between regular and spam messages. The mutual information and
+    chi-square scores are computed on the 2x2 table of (term, other terms) x (regular, spam) token counts.
+
+    :param counts_regular: NumPy array of the frequency counts in regular messages
+    :param counts_spam: NumPy array of the frequency counts in spam messages
+    :param p_regular: NumPy array of the regular log-probabilities (zero for unused terms)
+    :param p_spam: NumPy array of the spam log-probabilities (zero for unused terms)
+    :param method: 'mi' (mutual information), 'chi2' (chi-square) or 'log_odds' (absolute log odds ratio)
+    :return: NumPy array with a score per term, higher is more discriminative (-inf for unused terms)
+    """
+    if method == 'log_odds':
+        scores = numpy.abs(p_spam - p_regular)
+    else:
+        ## Cells of the table: the term in regular/spam messages, and all other terms in regular/spam messages
+        a = counts_regular.astype(numpy.float64)
+        b = counts_spam.astype(numpy.float64)
+        c = a.sum() - a
+        d = b.sum() - b
+        n = a + b + c + d
+        if method == 'chi2':
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                scores = n * (a * d - b * c) ** 2 / ((a + b) * (c + d) * (a + c) * (b + d))
+            scores = numpy.nan_to_num(scores)
+        elif method == 'mi':
+            scores = numpy.zeros(len(a))
+            term, other = a + b, c + d
+            regular, spam = a + c, b + d
+            for cell, row, column in ((a, term, regular), (b, term, spam), (c, other, regular), (d, other, spam)):
+                with numpy.errstate(divide='ignore', invalid='ignore'):
+                    contribution = cell / n * numpy.log(cell * n / (row * column))
+                ## 0 log 0 = 0
+                scores += numpy.where(cell > 0, contribution, 0)
+        else:
+            raise ValueError("Unknown feature selection method %s" % repr(method))
+    return numpy.where((p_regular == 0) & (p_spam == 0), -numpy.inf, scores)
+
+
+class VocabEntry:
+    """A lightweight view of a single term in a Vocabulary. It offers the same attributes as a Counter
+    (counter_regular, counter_spam, pRegular and pSpam), read from the vocabulary's arrays."""
+    __slots__ = ('vocab', 'id')
+
+    def __init__(self, vocab, id):
+        self.vocab = vocab
+        self.id = id
+
+    @property
+    def counter_regular(self):
+        return self.vocab.counts_regular[self.id]
+
+    @property
+    def counter_spam(self):
+        return self.vocab.counts_spam[self.id]
+
+    @property
+    def pRegular(self):
+        return self.vocab.p_regular[self.id]
+
+    @property
+    def pSpam(self):
+        return self.vocab.p_spam[self.id]
+
+
+class Vocabulary:
+    def __init__(self):
+        ## Maps each term to its id
+        self.ids = {}
+        ## Maps each id back to its term
+        self.terms = []
+
+        ## Frequency counts in regular and spam messages, indexed by id
+        self.counts_regular = array('q')
+        self.counts_spam = array('q')
+
+        ## Terms with a lower total count are ignored when scoring
+        self.minimum_frequency = 1
+        ## Smoothing value of the zero probabilities
+        self.epsilon = sys.float_info.epsilon
+
+        ## Number of words and messages of each class
+        self.n_words_regular = 0
+        self.n_words_spam = 0
+        self.n_messages_regular = 0
+        self.n_messages_spam = 0
+
+        ## Numerators log10(count) of the log-probabilities, indexed by id
+        self.numerators_regular = numpy.zeros(0)
+        self.numerators_spam = numpy.zeros(0)
+        ## Ids whose numerators are out of date, or None if all numerators are out of date
+        self.dirty = None
+
+        ## Cached class conditional log-probabilities, indexed by id (None if out of date)
+        self.probabilities = None
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        return term in self.ids
+
+    def __iter__(self):
+        return iter(self.terms)
+
+    def __getitem__(self, term):
+        return VocabEntry(self, self.ids[term])
+
+    def get(self, term, default=None):
+        """
+        Look up a term in the vocabulary.
+
+        :param term: The term to look up
+        :param default: Value returned if the term is not in the vocabulary
+        :return: VocabEntry of the term, or default
+        """
+        id = self.ids.get(term)
+        if id is None:
+            return default
+        return VocabEntry(self, id)
+
+    def lookup(self, term):
+        """
+        :param term: The term to look up
+        :return: Id of the term, or -1 if it is not in the vocabulary
+        """
+        return self.ids.get(term, -1)
+
+    def items(self):
+        """
+        Generate (term, VocabEntry) pairs in order of insertion.
+        """
+        for id, term in enumerate(self.terms):
+            yield term, VocabEntry(self, id)
+
+    @property
+    def p_regular(self):
+        """
+        Class conditional log-probabilities (base 10) of every term in regular messages, indexed by id.
+        """
+        if self.probabilities is None:
+            self.compute_probabilities()
+        return self.probabilities[0]
+
+    @property
+    def p_spam(self):
+        """
+        Class conditional log-probabilities (base 10) of every term in spam messages, indexed by id.
+        """
+        if self.probabilities is None:
+            self.compute_probabilities()
+        return self.probabilities[1]
+
+    def new_term(self, term):
+        """
+        Add a term with zero counts to the vocabulary.
+
+        :param term: A term which is not in the vocabulary yet
+        :return: The id of the term
+        """
+        id = len(self.terms)
+        self.ids[term] = id
+        self.terms.append(term)
+        self.counts_regular.append(0)
+        self.counts_spam.append(0)
+        return id
+
+    def invalidate(self):
+        """
+        Mark all log-probabilities as out of date after the counts were changed in bulk.
+
+        :return: None
+        """
+        self.dirty = None
+        self.probabilities = None
+
+    def add(self, term, spam=False, count=1):
+        """
+        Increment the frequency count of a term, depending on whether it occurred in a regular or spam message.
+
+        :param term: The term to count
+        :param spam: Set to True if the term occurred in a spam message
+        :param count: Number of occurrences to add
+        :return: The id of the term
+        """
+        id = self.ids.get(term)
+        if id is None:
+            id = self.new_term(term)
+        if spam:
+            self.counts_spam[id] += count
+            self.n_words_spam += count
+        else:
+            self.counts_regular[id] += count
+            self.n_words_regular += count
+        self.invalidate()
+        return id
+
+    def add_tokens(self, tokens, spam=False):
+        """
+        Count every token of a stream of tokens which occurred in a regular or spam message.
+
+        :param tokens: Iterable of tokens
+        :param spam: Set to True if the tokens occurred in a spam message
+        :return: None
+        """
+        ids = self.ids
+        counts = self.counts_spam if spam else self.counts_regular
+        n_tokens = 0
+        for token in tokens:
+            id = ids.get(token)
+            if id is None:
+                id = self.new_term(token)
+            counts[id] += 1
+            n_tokens += 1
+        if spam:
+            self.n_words_spam += n_tokens
+        else:
+            self.n_words_regular += n_tokens
+        self.invalidate()
+
+    def update(self, messages, spam=False, sign=1):
+        """
+        Add the counts of new messages to a trained vocabulary. Only the log-probabilities of the terms occurring
+        in the messages are recomputed, together with the class totals.
+
+        :param messages: Iterable of messages, each an iterable of tokens
+        :param spam: Set to True if the messages are spam
+        :param sign: Set to -1 to subtract the counts instead (see forget)
+        :return: None
+        """
+        ## Sum the occurrences of every token first, so that the vocabulary is left unchanged if forgetting fails
+        deltas = {}
+        n_messages = 0
+        for tokens in messages:
+            for token in tokens:
+                deltas[token] = deltas.get(token, 0) + sign
+            n_messages += 1
+
+        counts = self.counts_spam if spam else self.counts_regular
+        if sign < 0:
+            for token, delta in deltas.items():
+                id = self.ids.get(token)
+                if id is None or counts[id] + delta < 0:
+                    raise ValueError("Can not forget more occurrences of %s than were counted" % repr(token))
+
+        n_tokens = 0
+        for token, delta in deltas.items():
+            id = self.ids.get(token)
+            if id is None:
+                id = self.new_term(token)
+            counts[id] += delta
+            n_tokens += delta
+            if self.dirty is not None:
+                self.dirty.add(id)
+
+        if spam:
+            self.n_words_spam += n_tokens
+            self.n_messages_spam += sign * n_messages
+        else:
+            self.n_words_regular += n_tokens
+            self.n_messages_regular += sign * n_messages
+        self.probabilities = None
+
+    def forget(self, messages, spam=False):
+        """
+        Subtract the counts of previously added messages, e.g. messages which were mislabeled. The result is the
+        same as training without these messages; terms which no longer occur at all are ignored when scoring.
+
+        :param messages: Iterable of messages, each an iterable of tokens
+        :param spam: Set to True if the messages were added as spam
+        :return: None
+        """
+        self.update(messages, spam, -1)
+
+    def refresh_numerators(self):
+        """
+        Recompute the numerators log10(count) of the terms whose counts changed.
+
+        :return: None
+        """
+        counts_regular = numpy.frombuffer(self.counts_regular, dtype=numpy.int64) if len(self) else numpy.zeros(0)
+        counts_spam = numpy.frombuffer(self.counts_spam, dtype=numpy.int64) if len(self) else numpy.zeros(0)
+
+        if self.dirty is None:
+            ids = slice(None)
+            self.numerators_regular = numpy.zeros(len(self))
+            self.numerators_spam = numpy.zeros(len(self))
+        else:
+            ## Terms added since the last refresh are out of date as well
+            n_old = len(self.numerators_regular)
+            self.numerators_regular = numpy.resize(self.numerators_regular, len(self))
+            self.numerators_spam = numpy.resize(self.numerators_spam, len(self))
+            ids = numpy.fromiter(self.dirty.union(range(n_old, len(self))), dtype=numpy.int64)
+
+        with numpy.errstate(divide='ignore'):
+            self.numerators_regular[ids] = numpy.log10(counts_regular[ids])
+            self.numerators_spam[ids] = numpy.log10(counts_spam[ids])
+        self.dirty = set()
+
+    def compute_probabilities(self):
+        """
+        Compute the class conditional log-probabilities (base 10) of every term. Zero probabilities are replaced
+        by a small estimated value (see log_likelihoods), and terms which occur less than minimum_frequency times
+        (or not at all) get a log-probability of zero.
+
+        :return: None
+        """
+        if self.dirty is None or self.dirty or len(self.numerators_regular) < len(self):
+            self.refresh_numerators()
+
+        counts_regular = numpy.frombuffer(self.counts_regular, dtype=numpy.int64) if len(self) else numpy.zeros(0)
+        counts_spam = numpy.frombuffer(self.counts_spam, dtype=numpy.int64) if len(self) else numpy.zeros(0)
+        unused = counts_regular + counts_spam < max(self.minimum_frequency, 1)
+        self.probabilities = log_likelihoods(counts_regular, counts_spam, self.numerators_regular,
+                                             self.numerators_spam, unused, self.epsilon)
+
+    def select(self, k, method='mi'):
+        """
+        Select the k most discriminative terms (see feature_scores) into a new, smaller vocabulary for scoring.
+        The terms keep their log-probabilities and counts, and their order; the log-probabilities are not
+        renormalized over the selected terms.
+
+        :param k: Number of terms to keep
+        :param method: 'mi', 'chi2' or 'log_odds'
+        :return: Vocabulary
+        """
+        counts_regular = numpy.frombuffer(self.counts_regular, dtype=numpy.int64) if len(self) else numpy.zeros(0)
+        counts_spam = numpy.frombuffer(self.counts_spam, dtype=numpy.int64) if len(self) else numpy.zeros(0)
+        p_regular, p_spam = self.p_regular, self.p_spam
+        scores = feature_scores(counts_regular, counts_spam, p_regular, p_spam, method)
+        k = min(k, int(numpy.isfinite(scores).sum()))
+        ids = numpy.sort(numpy.argsort(-scores, kind='stable')[:k])
+
+        selected = Vocabulary()
+        for id in ids:
+            selected.new_term(self.terms[id])
+        selected.counts_regular = array('q', counts_regular[ids].tobytes())
+        selected.counts_spam = array('q', counts_spam[ids].tobytes())
+        selected.minimum_frequency = self.minimum_frequency
+        selected.epsilon = self.epsilon
+        selected.n_words_regular = self.n_words_regular
+        selected.n_words_spam = self.n_words_spam
+        selected.n_messages_regular = self.n_messages_regular
+        selected.n_messages_spam = self.n_messages_spam
+        selected.numerators_regular = self.numerators_regular[ids]
+        selected.numerators_spam = self.numerators_spam[ids]
+        selected.dirty = set()
+        selected.probabilities = (p_regular[ids], p_spam[ids])
+        return selected
+
+    def priors(self):
+        """
+        :return: Tuple of the log a priori probabilities (base 10) of a regular and a spam message
+        """
+        n_messages = self.n_messages_regular + self.n_messages_spam
+        return numpy.log10(self.n_messages_regular / n_messages), numpy.log10(self.n_messages_spam / n_messages)
@@ -0,0 +1,168 @@
+"""benchmark_kmeans.py -- the vectorized k-means versus the loops over every client, cluster and dimension.
+
+Synthetic clients are variants of the clients in the data files, with a few requests flipped. Both
+implementations are trained from the same random partition and must give the same clusters and the same
+hitrate and accuracy. The reference loops compute every prototype as the mean of its members and stop once no
+client changes cluster; with --legacy both implementations reproduce the quirks of the original loops instead
+(see kmeans.py). The loops are only run up to --loops-max clients.
+
+Usage: python benchmark_kmeans.py [--k 2 5 10 20 50] [--clients 70 1000 10000 100000 1000000] [--legacy]"""
+
+import argparse
+import math
+import random
+import sys
+import time
+
+import numpy
+
+from kmeans import KMeans
+from run_clustering import read_data
+
+
+class LoopKMeans(KMeans):
+    """The k-means loops over every client, cluster and dimension of the original code, kept as the benchmark
+    baseline. Unless legacy is set, the prototypes are reset before summing their members and every cluster
+    must be stable."""
+
+    def train(self):
+        self.iterations = 0
+        for i in range(len(self.traindata)):
+            self.clusters[random.randint(0, len(self.clusters)-1)].current_members.add(i)
+
+        converged = False
+        while not converged:
+            self.calcPrototype()
+            self.calcDistance()
+            self.iterations += 1
+            if self.legacy:
+                for cluster in self.clusters:
+                    converged = cluster.current_members == cluster.previous_members
+            else:
+                converged = all(cluster.current_members == cluster.previous_members for cluster in self.clusters)
+
+    def calcPrototype(self):
+        for cluster in self.clusters:
+            if not self.legacy and len(cluster.current_members) > 0:
+                cluster.prototype = [0.0 for _ in range(self.dim)]
+            for member in cluster.current_members:
+                for j in range(self.dim):
+                    cluster.prototype[j] += self.traindata[member][j]
+            for j in range(self.dim):
+                if len(cluster.current_members) > 0:
+                    cluster.prototype[j] /= len(cluster.current_members)
+            cluster.previous_members.clear()
+            cluster.previous_members.update(cluster.current_members)
+            cluster.current_members.clear()
+
+    def calcDistance(self):
+        for i in range(len(self.traindata)):
+            minDistance = float('inf')
+            minCluster = 0
+            for k in range(len(self.clusters)):
+                distance = 0
+                for j in range(self.dim):
+                    distance += math.pow(self.traindata[i][j] - self.clusters[k].prototype[j], 2)
+                distance = math.sqrt(distance)
+                if distance < minDistance:
+                    minCluster = k
+                    minDistance = distance
+            self.clusters[minCluster].current_members.add(i)
+
+    def test(self):
+        hits = 0
+        requests = 0
+        prefetch = 0
+        for cluster in self.clusters:
+            for member in cluster.current_members:
+                for i in range(self.dim):
+                    if cluster.prototype[i] > self.prefetch_threshold and \
+                            self.testdata[member][i] > self.prefetch_threshold:
+                        hits += 1
+                    if self.testdata[member][i] > self.prefetch_threshold:
+                        requests += 1
+                    if cluster.prototype[i] > self.prefetch_threshold:
+                        prefetch += 1
+        self.accuracy = hits/prefetch
+        self.hitrate = hits/requests
+
+
+def synthesize_clients(train, test, n_clients, flip=0.05, seed=0):
+    """
+    :param train: Training vectors of the clients in the data files
+    :param test: Test vectors of the clients in the data files
+    :param n_clients: Number of clients to generate
+    :param flip: Fraction of the requests which are flipped
+    :param seed: Seed of the variants
+    :return: Tuple of the training and test arrays of the synthetic clients
+    """
+    rng = numpy.random.default_rng(seed)
+    train, test = numpy.asarray(train), numpy.asarray(test)
+    if n_clients == len(train):
+        return train, test
+    new_train = numpy.empty((n_clients, train.shape[1]))
+    new_test = numpy.empty((n_clients, test.shape[1]), dtype=numpy.float32)
+    ## In chunks, so that the random numbers of a million clients are never held at once
+    for start in range(0, n_clients, 1 << 16):
+        source = rng.integers(0, len(train), min(1 << 16, n_clients - start))
+        end = start + len(source)
+        new_train[start:end] = numpy.abs(train[source] - (rng.random((len(source), train.shape[1])) < flip))
+        new_test[start:end] = numpy.abs(test[source] - (rng.random((len(source), test.shape[1])) < flip))
+    return new_train, new_test
+
+
+def run(kmeans_class, k, train, test, dim, seed, legacy):
+    random.seed(seed)
+    kmeans = kmeans_class(k, train, test, dim, legacy=legacy)
+    start = time.perf_counter()
+    kmeans.train()
+    seconds = time.perf_counter() - start
+    kmeans.test()
+    return kmeans, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--k', type=int, nargs='+', default=[2, 5, 10, 20, 50], help='Numbers of clusters')
+    parser.add_argument('--clients', type=int, nargs='+', default=[70, 1000, 10000, 100000, 1000000],
+                        help='Numbers of clients')
+    parser.add_argument('--loops-max', type=int, default=1000,
+                        help='Largest number of clients trained with the loops')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the initial partition')
+    parser.add_argument('--legacy', action='store_true',
+                        help='Reproduce the prototypes and convergence check of the original loops')
+    args = parser.parse_args()
+
+    train, test, _, _, dim = read_data()
+    print("clients    k   iterations      loops (s)   vectorized (s)   per iteration (ms)   speedup   hitrate"
+          "   accuracy")
+    for n_clients in args.clients:
+        clients_train, clients_test = synthesize_clients(train, test, n_clients)
+        for k in args.k:
+            kmeans, seconds = run(KMeans, k, clients_train, clients_test, dim, args.seed, args.legacy)
+            if n_clients > args.loops_max:
+                print("%7d %4d %12d %14s %16.3f %20.1f %9s %9.4f %10.4f" %
+                      (n_clients, k, kmeans.iterations, "-", seconds, seconds / kmeans.iterations * 1e3, "-",
+                       kmeans.hitrate, kmeans.accuracy))
+                continue
+            loops, loops_seconds = run(LoopKMeans, k, clients_train.tolist(), clients_test.tolist(), dim, args.seed,
+                                       args.legacy)
+            for cluster, loops_cluster in zip(kmeans.clusters, loops.clusters):
+                if cluster.current_members != loops_cluster.current_members or \
+                        not numpy.allclose(cluster.prototype, loops_cluster.prototype, rtol=1e-12, atol=0):
+                    print("Error: the vectorized k-means gives different clusters (%d clients, k = %d)" %
+                          (n_clients, k))
+                    sys.exit(1)
+            if (kmeans.hitrate, kmeans.accuracy) != (loops.hitrate, loops.accuracy):
+                print("Error: the vectorized k-means gives a different hitrate or accuracy (%d clients, k = %d)" %
+                      (n_clients, k))
+                sys.exit(1)
+            print("%7d %4d %12d %14.3f %16.3f %20.1f %8.1fx %9.4f %10.4f" %
+                  (n_clients, k, kmeans.iterations, loops_seconds, seconds, seconds / kmeans.iterations * 1e3,
+                   loops_seconds / seconds, kmeans.hitrate, kmeans.accuracy))
+    print("the vectorized k-means gives the same clusters as the %s loops" %
+          ("original" if args.legacy else "reference"))
+
+
+if __name__ == "__main__":
+    main()
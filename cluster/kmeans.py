@@ -1,6 +1,26 @@
 import random
 import math
-"""kmeans.py"""
+
+import numpy
+"""kmeans.py -- k-means clustering of the clients by the htmls they requested.
+
+The clients are kept in a NumPy array, and the cluster of every client in an array of cluster indices. All
+client-to-prototype distances are computed at once from ||x||^2 - 2 x.c + ||c||^2 (one matrix product), and
+the prototypes are updated with the sums of the members of every cluster (another matrix product). The
+clients are processed in chunks of chunk_size rows, so the distance matrix never holds more than chunk_size
+rows. The Cluster objects are filled in when training finishes.
+
+Every prototype is the mean of the members of its cluster, and training stops once no client changes cluster.
+With legacy=True the quirks of the original loops are reproduced instead: the sum of the members is added to
+the previous prototype before dividing by their number, and only the members of the last cluster decide
+whether the clusters are stable."""
+
+## Number of clients whose distances are computed at once
+CHUNK_SIZE = 1 << 16
+
+## Clients whose two closest prototypes are closer together than this (relative to the squared norms) are
+## assigned with the exact distances, as rounding in ||x||^2 - 2 x.c + ||c||^2 could break the tie differently
+TIE_TOLERANCE = 1e-9
 
 class Cluster:
     """This class represents the clusters, it contains the
@@ -14,10 +34,13 @@ class Cluster:
         self.previous_members = set()
 
 class KMeans:
-    def __init__(self, k, traindata, testdata, dim):
+    def __init__(self, k, traindata, testdata, dim, chunk_size=CHUNK_SIZE, legacy=False):
         self.traindata = traindata
         self.testdata = testdata
         self.dim = dim
+        self.chunk_size = chunk_size
+        ## Set to True to train like the original loops (see the module docstring)
+        self.legacy = legacy
 
         ## Threshold above which the corresponding html is prefetched
         self.prefetch_threshold = 0.5
@@ -25,78 +48,113 @@ class KMeans:
         ## An initialized list of k clusters
         self.clusters = [Cluster(dim) for _ in range(k)]
 
+        ## The training data as an array (a list of client vectors is converted once), with the squared norm
+        ## of every client
+        self.data = numpy.asarray(traindata, dtype=numpy.float64).reshape(-1, dim)
+        self.squared_norms = numpy.einsum('ij,ij->i', self.data, self.data)
+        ## The prototype of every cluster, and the cluster of every client now and before the last update
+        self.prototypes = numpy.zeros((k, dim))
+        self.members = numpy.zeros(len(self.data), dtype=numpy.int64)
+        self.previous = numpy.zeros(len(self.data), dtype=numpy.int64)
+
+        ## Number of prototype updates until the clusters were stable
+        self.iterations = 0
+
         ## The accuracy and hitrate are the performance metrics (i.e. the results)
         self.accuracy = 0
         self.hitrate = 0
 
-    def setCurrentMembers(self, cluster):
-        ## Set previous_members to current_members and clear current_members
-        cluster.previous_members.clear() 
-        cluster.previous_members.update(cluster.current_members)
-        cluster.current_members.clear()
+    def setClusters(self):
+        ## Set the members and prototypes of the Cluster objects from the arrays
+        order = numpy.argsort(self.members, kind='stable')
+        previous_order = numpy.argsort(self.previous, kind='stable')
+        bounds = numpy.searchsorted(self.members[order], numpy.arange(len(self.clusters) + 1))
+        previous_bounds = numpy.searchsorted(self.previous[previous_order], numpy.arange(len(self.clusters) + 1))
+        for k, cluster in enumerate(self.clusters):
+            cluster.prototype = self.prototypes[k].tolist()
+            cluster.current_members = set(order[bounds[k]:bounds[k + 1]].tolist())
+            cluster.previous_members = set(previous_order[previous_bounds[k]:previous_bounds[k + 1]].tolist())
 
     def calcPrototype(self):
-        for cluster in (self.clusters): ## Loop through each cluster
-            for member in (cluster.current_members): ## Loop through each member in each cluster
-                for j in range(200): 
-                    cluster.prototype[j] += self.traindata[member][j] ## Add all member vector values to prototype                
-            for j in range(200):
-                if (len(cluster.current_members) > 0):
-                    cluster.prototype[j] /= len(cluster.current_members) ## Take the average for each prototype
-            
-            self.setCurrentMembers(cluster)
+        ## Sum the members of every cluster, a chunk of clients at a time, as the product of the cluster
+        ## membership matrix (one row per cluster, one column per client) with the client vectors
+        sums = numpy.zeros_like(self.prototypes)
+        clusters = numpy.arange(len(self.clusters))[:, None]
+        for start in range(0, len(self.data), self.chunk_size):
+            membership = (self.members[None, start:start + self.chunk_size] == clusters).astype(numpy.float64)
+            sums += membership @ self.data[start:start + self.chunk_size]
+        counts = numpy.bincount(self.members, minlength=len(self.clusters))
+
+        ## A cluster without members keeps its prototype (the original loop also added the sum to it)
+        filled = counts > 0
+        if self.legacy:
+            sums[filled] += self.prototypes[filled]
+        self.prototypes[filled] = sums[filled] / counts[filled, None]
+        self.previous = self.members.copy()
 
     def calcDistance(self):
-        ## Loop through each input vector
-        for i in range(len(self.traindata)):
-            minDistance = float('inf')
-            minCluster = 0
-            ## Loop through each cluster
-            for k in range (len(self.clusters)):
-                distance = 0
-                ## Calculate distance from input vector to cluster
-                for j in range(self.dim):
-                    distance += math.pow(self.traindata[i][j] - self.clusters[k].prototype[j], 2)
-                distance = math.sqrt(distance)
-                ## Select cluster with smallest distance from input vector
-                if (distance < minDistance):
-                    minCluster = k
-                    minDistance = distance
-            self.clusters[minCluster].current_members.add(i) ## Set cluster accordingly
+        ## Assign every client to its closest prototype (the first one on ties)
+        prototype_norms = numpy.einsum('ij,ij->i', self.prototypes, self.prototypes)
+        for start in range(0, len(self.data), self.chunk_size):
+            data = self.data[start:start + self.chunk_size]
+            distances = self.squared_norms[start:start + self.chunk_size, None] - 2 * (data @ self.prototypes.T)
+            distances += prototype_norms
+            closest = numpy.argmin(distances, axis=1)
+            if len(self.clusters) > 1:
+                ## Clients with (nearly) tied prototypes get the distances of the original loop
+                smallest = numpy.partition(distances, 1, axis=1)
+                scale = self.squared_norms[start:start + self.chunk_size] + prototype_norms.max()
+                for i in numpy.flatnonzero(smallest[:, 1] - smallest[:, 0] <= TIE_TOLERANCE * (scale + 1)):
+                    closest[i] = self.closestPrototype(data[i])
+            self.members[start:start + self.chunk_size] = closest
+
+    def closestPrototype(self, vector):
+        ## The distance computation of the original loop over every cluster and dimension
+        minDistance = float('inf')
+        minCluster = 0
+        for k, prototype in enumerate(self.prototypes.tolist()):
+            distance = 0
+            for j in range(self.dim):
+                distance += math.pow(vector[j] - prototype[j], 2)
+            distance = math.sqrt(distance)
+            if (distance < minDistance):
+                minCluster = k
+                minDistance = distance
+        return minCluster
 
     def train(self):
         ## Select an initial random partioning with k clusters
-        for i in range(len(self.traindata)):
-            self.clusters[random.randint(0, len(self.clusters)-1)].current_members.add(i)
+        for i in range(len(self.data)):
+            self.members[i] = random.randint(0, len(self.clusters)-1)
 
         ## Calculate prototype and previousMembers for each cluster
         converged = False
+        self.iterations = 0
         while not converged:
             self.calcPrototype()
-            self.calcDistance()       
-            ## Check if converged
-            for cluster in self.clusters:
-                if(cluster.current_members == cluster.previous_members):
-                    converged = True
-                else:
-                    converged = False
-        pass
+            self.calcDistance()
+            self.iterations += 1
+            ## Check if converged (in the original loop, the members of the last cluster decided)
+            if self.legacy:
+                last = len(self.clusters) - 1
+                converged = numpy.array_equal(self.members == last, self.previous == last)
+            else:
+                converged = numpy.array_equal(self.members, self.previous)
+        self.setClusters()
 
     def test(self):
-        hits = 0
-        requests = 0
-        prefetch = 0
         ## Iterate along all clients. Assumption: the same clients are in the same order as in the testData
-        for cluster in self.clusters:
-            for member in cluster.current_members:
-                for i in range (self.dim): ## Iterate along all dimensions
-                    if ((cluster.prototype[i] > self.prefetch_threshold) ## count number of hits
-                        and (self.testdata[member][i] > self.prefetch_threshold)):
-                        hits += 1 
-                    if (self.testdata[member][i] > self.prefetch_threshold): ## count number of requests
-                        requests += 1 
-                    if (cluster.prototype[i] > self.prefetch_threshold): ## count prefetched htmls
-                        prefetch += 1
+        requested = numpy.asarray(self.testdata).reshape(-1, self.dim)[:len(self.members)] > self.prefetch_threshold
+        prefetched = self.prototypes > self.prefetch_threshold
+
+        ## count number of hits, requests and prefetched htmls
+        hits = 0
+        for start in range(0, len(requested), self.chunk_size):
+            hits += int(numpy.count_nonzero(requested[start:start + self.chunk_size] &
+                                            prefetched[self.members[start:start + self.chunk_size]]))
+        requests = int(numpy.count_nonzero(requested))
+        prefetch = int(numpy.dot(numpy.bincount(self.members, minlength=len(self.clusters)),
+                                 prefetched.sum(axis=1)))
 
         ## set the global variables hitrate and accuracy to their appropriate value
         self.accuracy = hits/prefetch
@@ -115,4 +173,4 @@ class KMeans:
 
     def print_prototypes(self):
         for i, cluster in enumerate(self.clusters):
-            print("Prototype cluster", i, ":", cluster.prototype)
\ No newline at end of file
+            print("Prototype cluster", i, ":", cluster.prototype)